@@ -8,10 +8,10 @@ from datetime import datetime
 from typing import Dict, Optional
 
 import jwt
-import numpy as np
 from loguru import logger
 
 from backend.db import RedisHandler
+from backend.jobs import InitLock
 from config import conf
 from models.user import User
 
@@ -40,11 +40,20 @@ class AuthHandler(object):
         return cls.__singleton
 
     def register_admin(self):
-        # we wait a random amount of time here to support multi-processing (gunicorn spawns multiple processes) so
-        # only the instance that reads the init_flag first will init Redis! Otherwise it gets initialized multiple
-        # times
-        time.sleep(np.random.uniform(low=0.3, high=1.0))
-        self.register(User(id=self.__admin_id, password=self.__admin_pwd))
+        # only one of the (gunicorn) worker processes registers the admin. The lock is bound to the fingerprint of the
+        # admin credentials so that changed credentials get registered (e.g. after a restart). The fingerprint is a
+        # PBKDF2 hash so that the password cannot be recovered from the name of the lock
+        fingerprint = self.__hash_password(self.__admin_pwd, self.__admin_id.encode('utf-8')).hex()[:32]
+        InitLock(f"admin_{fingerprint}").run_once(self.__register_admin)
+
+    def __register_admin(self):
+        admin = User(id=self.__admin_id, password=self.__admin_pwd)
+        salt = self.__get_salt(admin) if self.user_exists(admin) else None
+        if salt is not None and self.__auth.get(admin.id) != self.__hash_password(admin.password, salt):
+            logger.info(f"Password of admin {admin.id} changed!")
+            self.__auth.delete(admin.id, str(admin.id + '_salt').encode('utf-8'),
+                               str(admin.id + '_token').encode('utf-8'))
+        self.register(admin)
 
     def __get_jwt(self, user: User) -> Dict[str, str]:
         # try to load from cache
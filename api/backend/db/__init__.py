@@ -1 +1,2 @@
-from .redis_handler import RedisHandler
\ No newline at end of file
+from .redis_handler import RedisHandler
+from .async_redis_handler import AsyncRedisHandler
@@ -0,0 +1,236 @@
+from typing import Optional, Type, Union, Dict, Any
+
+import orjson
+import redis.asyncio as aioredis
+from loguru import logger
+from pydantic import BaseModel
+
+from backend.db import lua_scripts, ranking_positions
+from backend.db.codec import DocumentCodec, JSON
+from backend.db.document_cache import DocumentCache
+from backend.db.redis_handler import SAMPLE_MODELS, samples_of_results_key
+from config import conf
+from models import RankingSample, RankingResult, ModelRanking, LikertSample, LikertResult, BaseSample, BaseResult, \
+    RatingResult, RatingSample, StudyType
+from models.validation_context import get_referenced_sample
+
+
+# non-blocking counterpart of the RedisHandler for the hot paths of the async routes (next, submit and loading single
+# documents). Every Redis DB gets its own connection pool, which is created lazily inside the running event loop and
+# shared by all concurrent requests of the worker.
+class AsyncRedisHandler(object):
+    __singleton = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__singleton is None:
+            logger.info('Instantiating AsyncRedisHandler!')
+            cls.__singleton = super(AsyncRedisHandler, cls).__new__(cls)
+
+            cls.__host = conf.backend.redis.host
+            cls.__port = conf.backend.redis.port
+            cls.__max_connections = conf.backend.redis.max_connections
+            cls.__codec = DocumentCodec(conf.backend.redis.codec, conf.backend.redis.zstd_level)
+            # see RedisHandler
+            cls.__compact_ranking_results = conf.backend.redis.compact_ranking_results and cls.__codec.name != JSON
+            cls.__db_indices = {client.lower(): db_idx for client, db_idx in conf.backend.redis.clients.items()}
+            cls.__clients = {}
+            cls.__load_sample_script = None
+            # shared with the RedisHandler (which subscribes to the invalidations)
+            cls.__cache = DocumentCache()
+            cls.__sample_db_args = [arg for typ in StudyType
+                                    for arg in [typ.value, conf.backend.redis.clients[f'{typ.value}_sample']]]
+
+        return cls.__singleton
+
+    def __client(self, client_name: str) -> aioredis.Redis:
+        if client_name not in self.__clients:
+            # a blocking pool lets bursts wait for a free connection instead of failing with 'Too many connections'
+            pool = aioredis.BlockingConnectionPool(host=self.__host,
+                                                   port=self.__port,
+                                                   db=self.__db_indices[client_name],
+                                                   max_connections=self.__max_connections)
+            self.__clients[client_name] = aioredis.Redis(connection_pool=pool)
+            logger.info(f"Created async connection pool for Redis {client_name.upper()} DB "
+                        f"#{self.__db_indices[client_name]}")
+        return self.__clients[client_name]
+
+    def get_progress_client(self, typ: str) -> aioredis.Redis:
+        return self.__client(f'{typ.lower()}_progress')
+
+    @logger.catch(reraise=True)
+    async def shutdown(self) -> None:
+        logger.info("Shutting down AsyncRedisHandler!")
+        for client in self.__clients.values():
+            await client.close()
+            await client.connection_pool.disconnect()
+        self.__clients.clear()
+
+    async def __load(self, client_name: str, model: Type[BaseModel], key: Union[str, bytes], verbose: bool,
+                     namespace: Optional[str] = None):
+        # documents with a namespace are read-through the DocumentCache
+        if namespace is not None:
+            doc = self.__cache.get(namespace, key)
+            if isinstance(doc, model):
+                return doc
+
+        s = await self.__client(client_name).get(key)
+        if s is None:
+            logger.error(f"Cannot load {model.__name__} {key}")
+            return None
+        else:
+            doc = await self.__parse(client_name, model, key, s)
+            if doc is None:
+                return None
+            if namespace is not None:
+                self.__cache.put(namespace, key, doc)
+            if verbose:
+                logger.debug(f"Successfully loaded {model.__name__} {doc.id}")
+            return doc
+
+    async def __parse(self, client_name: str, model: Type[BaseModel], key: Union[str, bytes],
+                      raw: bytes) -> Optional[BaseModel]:
+        if model is RankingResult:
+            doc = await self.__decode_ranking_result(raw)
+            doc = None if doc is None else RankingResult.parse_obj(doc)
+        else:
+            doc = self.__codec.parse(model, raw)
+        # documents that were encoded with another codec are migrated lazily (see RedisHandler.migrate_documents). The
+        # positions of compact RankingResults cannot be represented in JSON, so the expanded result is encoded instead
+        if doc is not None and not self.__codec.is_current(raw):
+            value = self.__codec.encode(doc) if model is RankingResult and self.__codec.name == JSON else \
+                self.__codec.reencode(raw)
+            await self.__client(client_name).set(key, value, xx=True)
+        return doc
+
+    async def __decode_ranking_result(self, raw: bytes) -> Optional[Dict[str, Any]]:
+        # compact RankingResults are expanded with the image IDs of their sample (see ranking_positions)
+        doc = self.__codec.decode(raw)
+        if ranking_positions.is_compact(doc):
+            sample = await self.load_sample(doc['sample_id'])
+            if not isinstance(sample, RankingSample):
+                logger.error(f"Cannot expand RankingResult {doc['id']} because RankingSample {doc['sample_id']} "
+                             f"does not exist!")
+                return None
+            doc = ranking_positions.expand_ranking_result(doc, sample.image_ids)
+        return doc
+
+    @logger.catch(reraise=True)
+    async def load_raw(self, client_name: str, key: Union[str, bytes]) -> Optional[bytes]:
+        # returns the JSON of a document (e.g. to pass it through to the response without parsing it with pydantic)
+        if client_name not in self.__db_indices or client_name.endswith('_progress'):
+            raise KeyError(f"Cannot load raw documents from Redis {client_name.upper()} DB!")
+        s = await self.__client(client_name).get(key)
+        if s is None:
+            logger.error(f"Cannot load raw document {key} from Redis {client_name.upper()} DB")
+            return None
+        elif client_name == 'ranking_result' and self.__codec.codec_of(s) != JSON:
+            doc = await self.__decode_ranking_result(s)
+            return None if doc is None else orjson.dumps(doc)
+        return self.__codec.to_json(s)
+
+    async def __store_result(self, client_name: str, sample_client_name: str, result: BaseResult) -> Optional[str]:
+        name = type(result).__name__
+        # the sample was most likely already loaded while validating the result (see validation_context)
+        sample = get_referenced_sample(result.sample_id)
+        if sample is not None:
+            exists = sample.get_type() == result.get_type()
+        else:
+            exists = await self.__client(sample_client_name).exists(result.sample_id) == 1
+        if not exists:
+            logger.error(f"{name[:-len('Result')]}Sample {result.sample_id} referenced in {name} {result.id} "
+                         f"does not exist! Discarding!")
+            return None
+
+        await self.__client('index').sadd(samples_of_results_key(result.get_type()), result.sample_id)
+        doc = None
+        if self.__compact_ranking_results and isinstance(result, RankingResult):
+            sample = sample or await self.load_sample(result.sample_id)
+            if sample is not None:
+                doc = ranking_positions.compact_ranking_result(result, sample.image_ids)
+        if await self.__client(client_name).set(result.id, self.__codec.encode(doc or result)) != 1:
+            logger.error(f"Cannot store {name} {result.json()}")
+            return None
+        else:
+            logger.debug(f"Successfully stored {name} {result.id}")
+            return result.id
+
+    ################# ModelRanking #################
+
+    @logger.catch(reraise=True)
+    async def load_model_ranking(self, mr_id: str, verbose=False) -> Optional[ModelRanking]:
+        return await self.__load('model_ranking', ModelRanking, mr_id, verbose, 'model_ranking')
+
+    ################# Samples #################
+
+    @logger.catch(reraise=True)
+    async def load_ranking_sample(self, rs_id: str, verbose: bool = True) -> Optional[RankingSample]:
+        return await self.__load('ranking_sample', RankingSample, rs_id, verbose, 'sample')
+
+    @logger.catch(reraise=True)
+    async def load_likert_sample(self, ls_id: str, verbose: bool = True) -> Optional[LikertSample]:
+        return await self.__load('likert_sample', LikertSample, ls_id, verbose, 'sample')
+
+    @logger.catch(reraise=True)
+    async def load_rating_sample(self, rs_id: str, verbose: bool = True) -> Optional[RatingSample]:
+        return await self.__load('rating_sample', RatingSample, rs_id, verbose, 'sample')
+
+    @logger.catch(reraise=True)
+    async def typed_sample_exists(self, sample_id: Union[str, bytes], typ: StudyType) -> bool:
+        return await self.__client(f'{typ.value}_sample').exists(sample_id) == 1
+
+    async def __resolve_unregistered_sample_type(self, sample_id: Union[str, bytes]) -> Optional[StudyType]:
+        # samples stored by previous versions are not in the registry so we have to probe the sample DBs
+        for typ in StudyType:
+            if await self.__client(f'{typ.value}_sample').exists(sample_id):
+                await self.__client('index').hset('sample_types', sample_id, typ.value)
+                return typ
+        return None
+
+    @logger.catch(reraise=True)
+    async def load_sample(self, sample_id: Union[str, bytes]) -> Optional[BaseSample]:
+        sample = self.__cache.get('sample', sample_id)
+        if sample is not None:
+            return sample
+
+        # resolves the type (see RedisHandler.load_sample) and loads the sample in a single round trip
+        if self.__load_sample_script is None:
+            self.__load_sample_script = self.__client('index').register_script(lua_scripts.LOAD_SAMPLE)
+        resp = await self.__load_sample_script(keys=['sample_types', sample_id], args=self.__sample_db_args)
+        if resp is not None:
+            typ, s = StudyType(str(resp[0], encoding='utf-8')), resp[1]
+        else:
+            typ = await self.__resolve_unregistered_sample_type(sample_id)
+            s = None if typ is None else await self.__client(f'{typ.value}_sample').get(sample_id)
+
+        if s is None:
+            logger.error(f"Neither a RankingSample, a RatingSample nor a LikertSample with ID '{sample_id}' exists!")
+            return None
+        sample = await self.__parse(f'{typ.value}_sample', SAMPLE_MODELS[typ], sample_id, s)
+        self.__cache.put('sample', sample_id, sample)
+        return sample
+
+    ################# Results #################
+
+    @logger.catch(reraise=True)
+    async def load_ranking_result(self, rr_id: str, verbose: bool = False) -> Optional[RankingResult]:
+        return await self.__load('ranking_result', RankingResult, rr_id, verbose)
+
+    @logger.catch(reraise=True)
+    async def load_likert_result(self, lr_id: str, verbose: bool = False) -> Optional[LikertResult]:
+        return await self.__load('likert_result', LikertResult, lr_id, verbose)
+
+    @logger.catch(reraise=True)
+    async def load_rating_result(self, rr_id: str, verbose: bool = False) -> Optional[RatingResult]:
+        return await self.__load('rating_result', RatingResult, rr_id, verbose)
+
+    @logger.catch(reraise=True)
+    async def store_result(self, res: BaseResult) -> Optional[str]:
+        if isinstance(res, RankingResult):
+            return await self.__store_result('ranking_result', 'ranking_sample', res)
+        elif isinstance(res, LikertResult):
+            return await self.__store_result('likert_result', 'likert_sample', res)
+        elif isinstance(res, RatingResult):
+            return await self.__store_result('rating_result', 'rating_sample', res)
+        else:
+            logger.error("Only RankingResult, LikertResult, and RatingResult are supported!")
+            raise NotImplementedError("Only RankingResult, LikertResult, and RatingResult are supported!")
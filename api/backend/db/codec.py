@@ -0,0 +1,99 @@
+import datetime
+import threading
+from typing import Any, Dict, Type, Union
+
+import msgpack
+import orjson
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+MSGPACK_ZSTD = 'msgpack_zstd'
+CODECS = [JSON, MSGPACK, MSGPACK_ZSTD]
+
+# Binary documents start with a version byte. JSON documents (as stored by previous versions) always start with '{'.
+_VERSIONS = {MSGPACK: b'\x01', MSGPACK_ZSTD: b'\x02'}
+_JSON_PREFIX = b'{'
+
+
+def _default(obj: Any) -> Any:
+    # same representation as in the JSON of pydantic (e.g. ISO 8601 datetimes)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    return pydantic_encoder(obj)
+
+
+class DocumentCodec(object):
+    # Encodes the documents (samples, results, ModelRankings, ...) that are stored in Redis. Documents of all codecs can
+    # be decoded, independently of the codec used for encoding, so that existing documents can be migrated online.
+    def __init__(self, name: str, zstd_level: int = 3):
+        if name not in CODECS:
+            raise ValueError(f"Unknown codec '{name}'! Supported codecs: {CODECS}")
+        if name == MSGPACK_ZSTD and zstandard is None:
+            raise ImportError(f"The codec '{name}' requires the zstandard package!")
+        self.name = name
+        self.__zstd_level = zstd_level
+        # zstd (de)compressors must not be shared between threads
+        self.__local = threading.local()
+
+    def __compressor(self):
+        if not hasattr(self.__local, 'compressor'):
+            self.__local.compressor = zstandard.ZstdCompressor(level=self.__zstd_level)
+        return self.__local.compressor
+
+    def __decompressor(self):
+        if zstandard is None:
+            raise ImportError(f"Decoding documents of the codec '{MSGPACK_ZSTD}' requires the zstandard package!")
+        if not hasattr(self.__local, 'decompressor'):
+            self.__local.decompressor = zstandard.ZstdDecompressor()
+        return self.__local.decompressor
+
+    @staticmethod
+    def codec_of(raw: bytes) -> str:
+        if raw[:1] == _JSON_PREFIX:
+            return JSON
+        for name, version in _VERSIONS.items():
+            if raw[:1] == version:
+                return name
+        raise ValueError(f"Unknown document format (version byte {raw[:1]})!")
+
+    def is_current(self, raw: bytes) -> bool:
+        return self.codec_of(raw) == self.name
+
+    def encode(self, doc: Union[BaseModel, Dict[str, Any]]) -> bytes:
+        if self.name == JSON:
+            if isinstance(doc, BaseModel):
+                return doc.json().encode('utf-8')
+            return orjson.dumps(doc, default=_default)
+
+        packed = msgpack.packb(doc.dict() if isinstance(doc, BaseModel) else doc, default=_default, use_bin_type=True)
+        if self.name == MSGPACK_ZSTD:
+            return _VERSIONS[MSGPACK_ZSTD] + self.__compressor().compress(packed)
+        return _VERSIONS[MSGPACK] + packed
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        codec = self.codec_of(raw)
+        if codec == JSON:
+            return orjson.loads(raw)
+        elif codec == MSGPACK_ZSTD:
+            return msgpack.unpackb(self.__decompressor().decompress(raw[1:]), raw=False)
+        return msgpack.unpackb(raw[1:], raw=False)
+
+    def parse(self, model: Type[BaseModel], raw: bytes) -> BaseModel:
+        if raw[:1] == _JSON_PREFIX:
+            return model.parse_raw(raw)
+        return model.parse_obj(self.decode(raw))
+
+    def to_json(self, raw: bytes) -> bytes:
+        if raw[:1] == _JSON_PREFIX:
+            return raw
+        return orjson.dumps(self.decode(raw))
+
+    def reencode(self, raw: bytes) -> bytes:
+        return raw if self.is_current(raw) else self.encode(self.decode(raw))
@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Union, Tuple
+
+import redis
+from loguru import logger
+from pydantic import BaseModel
+
+from config import conf
+
+INVALIDATION_CHANNEL = 'document_cache_invalidation'
+
+
+# Bounded in-process LRU cache (with TTL) for documents that never change after they were stored, i.e., samples and
+# ModelRankings. The cached documents are shared and must not be modified! Since every worker process has its own
+# cache, the cache entries are invalidated across all processes via Redis pub/sub (e.g. on flush or new study runs).
+class DocumentCache(object):
+    __singleton = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__singleton is None:
+            logger.info('Instantiating DocumentCache!')
+            cls.__singleton = super(DocumentCache, cls).__new__(cls)
+
+            cls.__enabled = conf.backend.cache.enabled
+            cls.__max_size = conf.backend.cache.max_size
+            cls.__ttl = conf.backend.cache.ttl
+
+            cls.__lock = threading.Lock()
+            cls.__docs: OrderedDict = OrderedDict()
+            cls.__stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+            cls.__subscriber = None
+
+        return cls.__singleton
+
+    @staticmethod
+    def __key(namespace: str, key: Union[str, bytes]) -> Tuple[str, str]:
+        return namespace, key if isinstance(key, str) else str(key, encoding='utf-8')
+
+    def get(self, namespace: str, key: Union[str, bytes]) -> Optional[BaseModel]:
+        if not self.__enabled:
+            return None
+        k = self.__key(namespace, key)
+        with self.__lock:
+            entry = self.__docs.get(k)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.__docs[k]
+                self.__stats['misses'] += 1
+                return None
+            self.__docs.move_to_end(k)
+            self.__stats['hits'] += 1
+            return entry[1]
+
+    def put(self, namespace: str, key: Union[str, bytes], doc: BaseModel):
+        if not self.__enabled:
+            return
+        with self.__lock:
+            self.__docs[self.__key(namespace, key)] = (time.monotonic() + self.__ttl, doc)
+            self.__docs.move_to_end(self.__key(namespace, key))
+            while len(self.__docs) > self.__max_size:
+                self.__docs.popitem(last=False)
+                self.__stats['evictions'] += 1
+
+    def invalidate(self, namespace: Optional[str] = None, keys: Optional[List[Union[str, bytes]]] = None):
+        # invalidates the given keys of the namespace, the whole namespace, or (if no namespace is given) everything
+        with self.__lock:
+            if namespace is None:
+                self.__docs.clear()
+            elif keys is None:
+                for k in [k for k in self.__docs if k[0] == namespace]:
+                    del self.__docs[k]
+            else:
+                for k in keys:
+                    self.__docs.pop(self.__key(namespace, k), None)
+            self.__stats['invalidations'] += 1
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['size'] = len(self.__docs)
+        stats['max_size'] = self.__max_size
+        num_gets = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / num_gets if num_gets > 0 else 0.0
+        return stats
+
+    def publish_invalidation(self, client: redis.Redis, namespace: Optional[str] = None,
+                             keys: Optional[List[Union[str, bytes]]] = None):
+        # invalidates the entries in this process right away and in all other processes via pub/sub
+        self.invalidate(namespace, keys)
+        if keys is not None:
+            keys = [k if isinstance(k, str) else str(k, encoding='utf-8') for k in keys]
+        client.publish(INVALIDATION_CHANNEL, json.dumps({'namespace': namespace, 'keys': keys}))
+
+    def subscribe(self, client: redis.Redis):
+        if self.__subscriber is not None or not self.__enabled:
+            return
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: self.__handle_invalidation})
+        self.__subscriber = pubsub.run_in_thread(sleep_time=1.0, daemon=True,
+                                                 exception_handler=self.__handle_subscriber_error)
+        logger.info(f"DocumentCache subscribed to {INVALIDATION_CHANNEL}")
+
+    def __handle_invalidation(self, msg: Dict):
+        try:
+            data = json.loads(msg['data'])
+            self.invalidate(data.get('namespace'), data.get('keys'))
+        except Exception as e:
+            # we cannot tell what should have been invalidated
+            logger.error(f"Cannot handle cache invalidation {msg}! Clearing DocumentCache. Exception: {e}")
+            self.invalidate()
+
+    def __handle_subscriber_error(self, e: Exception, pubsub, thread):
+        # invalidations might have been missed while the connection was lost (the pubsub reconnects by itself)
+        logger.error(f"DocumentCache lost its subscription! Clearing DocumentCache. Exception: {e}")
+        self.invalidate()
+        time.sleep(1.0)
+
+    def shutdown(self):
+        if self.__subscriber is not None:
+            self.__subscriber.stop()
+            self.__subscriber = None
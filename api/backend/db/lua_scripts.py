@@ -0,0 +1,20 @@
+# Server-side Lua scripts of the Redis handlers. The scripts run in the INDEX DB and SELECT the DBs of the documents
+# they read (selecting a DB inside a script does not change the DB of the calling connection).
+
+# Resolves the study type of a sample in the sample type registry and loads the sample from the respective sample DB
+# KEYS[1]: sample type registry (hash), KEYS[2]: sample id
+# ARGV: pairs of study type and index of the sample DB of the study type
+# Returns {study_type, sample} or nil if the sample is not registered
+LOAD_SAMPLE = """
+local typ = redis.call('HGET', KEYS[1], KEYS[2])
+if not typ then
+    return nil
+end
+for i = 1, #ARGV, 2 do
+    if ARGV[i] == typ then
+        redis.call('SELECT', ARGV[i + 1])
+        return {typ, redis.call('GET', KEYS[2])}
+    end
+end
+return nil
+"""
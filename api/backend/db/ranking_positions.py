@@ -0,0 +1,52 @@
+from array import array
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from models import RankingResult
+
+# RankingResults can be stored in a compact form that references the images by their position in the image IDs of the
+# RankingSample (one byte per image) instead of repeating the image ID strings of the sample.
+RANKING_POS = 'ranking_pos'
+IRRELEVANT_POS = 'irrelevant_pos'
+MAX_POSITIONS = 256
+
+
+def compact_ranking_result(result: RankingResult, image_ids: List[str]) -> Optional[Dict[str, Any]]:
+    # returns None if the result cannot be represented by positions (e.g. it contains images that are not in the sample)
+    if len(image_ids) > MAX_POSITIONS:
+        return None
+    pos = {image_id: i for i, image_id in enumerate(image_ids)}
+    try:
+        ranking = array('B', [pos[image_id] for image_id in result.ranking])
+        irrelevant = array('B', [pos[image_id] for image_id in result.irrelevant])
+    except KeyError:
+        return None
+
+    doc = result.dict(exclude={'ranking', 'irrelevant'})
+    doc[RANKING_POS] = ranking.tobytes()
+    doc[IRRELEVANT_POS] = irrelevant.tobytes()
+    return doc
+
+
+def is_compact(doc: Dict[str, Any]) -> bool:
+    return RANKING_POS in doc
+
+
+def expand_ranking_result(doc: Dict[str, Any], image_ids: List[str]) -> Dict[str, Any]:
+    doc = dict(doc)
+    # iterating over bytes yields the positions as ints
+    doc['ranking'] = [image_ids[p] for p in doc.pop(RANKING_POS)]
+    doc['irrelevant'] = [image_ids[p] for p in doc.pop(IRRELEVANT_POS)]
+    return doc
+
+
+def positions(pos: bytes) -> np.ndarray:
+    # zero-copy view on the stored positions
+    return np.frombuffer(pos, dtype=np.uint8)
+
+
+def positions_of(image_ids: List[str], sample_image_ids: List[str]) -> np.ndarray:
+    # positions of image IDs (of a result that is not stored in the compact form). -1 if an image is not in the sample
+    pos = {image_id: i for i, image_id in enumerate(sample_image_ids)}
+    return np.array([pos.get(image_id, -1) for image_id in image_ids], dtype=np.int16)
@@ -1,14 +1,49 @@
+import base64
+import binascii
 import json
 import pprint
 import threading
-from typing import Optional, List, Dict, Union
+from itertools import islice
+from typing import Optional, List, Dict, Union, Iterator, Tuple, Type, Iterable
 
+import numpy as np
 import redis
 from loguru import logger
+from pydantic import BaseModel
 
+from backend.db import lua_scripts
+from backend.db import ranking_positions
+from backend.db.codec import DocumentCodec, JSON
+from backend.db.document_cache import DocumentCache
 from config import conf
 from models import RankingSample, RankingResult, ModelRanking, Feedback, LikertSample, LikertResult, StudyType, \
     BaseSample, BaseResult, RatingResult, RatingSample
+from models.validation_context import get_referenced_sample
+
+SAMPLE_MODELS: Dict[StudyType, Type[BaseSample]] = {
+    StudyType.RANKING: RankingSample,
+    StudyType.LIKERT: LikertSample,
+    StudyType.RATING: RatingSample
+}
+
+
+def samples_of_results_key(typ: StudyType) -> str:
+    # set (in the INDEX DB) of the IDs of the samples that are referenced by a result. The sample is added before the
+    # result is stored so that a sample of a stored result is always in the set
+    return f'samples_of_results_{typ.value}'
+
+
+# DBs (and key patterns) of the documents that are encoded with the DocumentCodec
+DOCUMENT_DBS: Dict[str, Optional[str]] = {
+    'model_ranking': None,
+    'ranking_sample': None,
+    'ranking_result': None,
+    'likert_sample': None,
+    'likert_result': None,
+    'rating_sample': None,
+    'rating_result': None,
+    'mturk': 'feedback_*'
+}
 
 
 class RedisHandler(object):
@@ -26,6 +61,16 @@ class RedisHandler(object):
             # setup redis
             r_host = conf.backend.redis.host
             r_port = conf.backend.redis.port
+            cls.__scan_batch_size = conf.backend.redis.scan_batch_size
+            cls.__write_batch_size = conf.backend.redis.write_batch_size
+            cls.__codec = DocumentCodec(conf.backend.redis.codec, conf.backend.redis.zstd_level)
+            cls.__migration_batch_size = conf.backend.redis.codec_migration_batch_size
+            # the positions of the compact RankingResults are bytes, which cannot be represented in JSON
+            cls.__compact_ranking_results = conf.backend.redis.compact_ranking_results
+            if cls.__compact_ranking_results and cls.__codec.name == JSON:
+                logger.warning(f"Compact RankingResults require a binary codec but the codec is {JSON}! "
+                               f"Storing RankingResults with image IDs.")
+                cls.__compact_ranking_results = False
 
             # setup clients
             cls.__clients = {}
@@ -35,6 +80,15 @@ class RedisHandler(object):
                     f"Couldn't connect to Redis {str(client).upper()} DB #{db_idx} at {r_host}:{r_port}!"
                 logger.info(f"Successfully connected to Redis {str(client).upper()} DB #{db_idx}")
 
+            # samples and ModelRankings are cached in-process and invalidated via pub/sub
+            cls.__cache = DocumentCache()
+            cls.__cache.subscribe(cls.__clients['coordination'])
+
+            # the sample type registry (sample_id -> study type) lives in the INDEX DB
+            cls.__load_sample_script = cls.__clients['index'].register_script(lua_scripts.LOAD_SAMPLE)
+            cls.__sample_db_args = [arg for typ in StudyType
+                                    for arg in [typ.value, conf.backend.redis.clients[f'{typ.value}_sample']]]
+
         return cls.__singleton
 
     def get_progress_client(self, typ: str):
@@ -43,9 +97,13 @@ class RedisHandler(object):
     def get_auth_client(self):
         return self.__clients['auth']
 
+    def get_coordination_client(self):
+        return self.__clients['coordination']
+
     @logger.catch(reraise=True)
     def shutdown(self) -> None:
         logger.info("Shutting down RedisHandler!")
+        self.__cache.shutdown()
         for client in self.__clients.values():
             client.close()
 
@@ -65,12 +123,228 @@ class RedisHandler(object):
                 continue
             elif not mturk and client_name == 'mturk':
                 continue
+            elif client_name == 'coordination':
+                # the locks and the leader election of the running worker processes are kept but the initialization
+                # steps have to run again on the flushed data
+                for keys in self.__scan_keys(client_name, match='init_done_*'):
+                    client.delete(*keys)
             else:
                 client.flushdb()
                 client.save()
+        self.__cache.publish_invalidation(self.__clients['coordination'])
+
+    @logger.catch(reraise=True)
+    def invalidate_cached_samples(self):
+        self.__cache.publish_invalidation(self.__clients['coordination'], 'sample')
 
     # TODO: I know there is a lot of redundant code here, which could be simplified by inheritance, flags AND TIME...
 
+    def __load_document(self, client_name: str, namespace: str, model: Type[BaseModel], key: Union[str, bytes],
+                        verbose: bool) -> Optional[BaseModel]:
+        # read-through the DocumentCache (samples and ModelRankings never change after they were stored)
+        doc = self.__cache.get(namespace, key)
+        if isinstance(doc, model):
+            return doc
+
+        s = self.__clients[client_name].get(key)
+        if s is None:
+            logger.error(f"Cannot load {model.__name__} {key}")
+            return None
+        doc = self.__parse(client_name, model, key, s)
+        self.__cache.put(namespace, key, doc)
+        if verbose:
+            logger.debug(f"Successfully loaded {model.__name__} {doc.id}")
+        return doc
+
+    def __parse(self, client_name: str, model: Type[BaseModel], key: Union[str, bytes],
+                raw: bytes) -> Optional[BaseModel]:
+        # returns None if the document cannot be parsed (i.e., a compact RankingResult whose sample does not exist)
+        if model is RankingResult:
+            doc = self.__expand_ranking_results([raw])[0]
+        else:
+            doc = self.__codec.parse(model, raw)
+        # documents that were encoded with another codec are migrated lazily when they are read (see migrate_documents)
+        if doc is not None and not self.__codec.is_current(raw):
+            self.__clients[client_name].set(key, self.__reencode_all(client_name, [raw], [doc])[0], xx=True)
+        return doc
+
+    def __parse_all(self, model: Type[BaseModel], raws: List[bytes]) -> List:
+        if model is RankingResult:
+            return [result for result in self.__expand_ranking_results(raws) if result is not None]
+        return [self.__codec.parse(model, raw) for raw in raws]
+
+    def __expand_ranking_results(self, raws: List[bytes]) -> List[Optional[RankingResult]]:
+        # compact RankingResults are expanded with the image IDs of their samples, which are loaded in one round trip.
+        # The results whose samples do not exist are None
+        docs = [self.__codec.decode(raw) for raw in raws]
+        samples = self.__ranking_samples_of([doc['sample_id'] for doc in docs if ranking_positions.is_compact(doc)])
+        results = []
+        for doc in docs:
+            if ranking_positions.is_compact(doc):
+                sample = samples.get(doc['sample_id'])
+                if sample is None:
+                    logger.error(f"Cannot expand RankingResult {doc['id']} because RankingSample {doc['sample_id']} "
+                                 f"does not exist!")
+                    results.append(None)
+                    continue
+                doc = ranking_positions.expand_ranking_result(doc, sample.image_ids)
+            results.append(RankingResult.parse_obj(doc))
+        return results
+
+    def __reencode_all(self, client_name: str, raws: List[bytes],
+                       docs: Optional[List[BaseModel]] = None) -> List[Optional[bytes]]:
+        # re-encodes the documents with the current codec. The positions of compact RankingResults are bytes, which
+        # cannot be represented in JSON, so they are expanded (or None if their samples do not exist) for the JSON codec
+        if client_name == 'ranking_result' and self.__codec.name == JSON:
+            docs = docs or self.__expand_ranking_results(raws)
+            return [None if doc is None else self.__codec.encode(doc) for doc in docs]
+        return [self.__codec.reencode(raw) for raw in raws]
+
+    def __ranking_samples_of(self, sample_ids: List[str]) -> Dict[str, RankingSample]:
+        samples = {}
+        for sample_id in set(sample_ids):
+            sample = self.__cache.get('sample', sample_id)
+            if isinstance(sample, RankingSample):
+                samples[sample_id] = sample
+        missing = [sample_id for sample_id in set(sample_ids) if sample_id not in samples]
+        for sample in self.__mget_models('ranking_sample', RankingSample, missing):
+            self.__cache.put('sample', sample.id, sample)
+            samples[sample.id] = sample
+        return samples
+
+    def encode(self, doc: Union[BaseModel, Dict]) -> bytes:
+        return self.__codec.encode(doc)
+
+    @logger.catch(reraise=True)
+    def migrate_documents(self, max_keys: Optional[int] = None) -> int:
+        # migrates (at most max_keys) documents that were encoded with another codec to the current codec. The progress
+        # (SCAN cursor) of every DB is stored in the COORDINATION DB so that the migration continues where it stopped
+        budget = max_keys or self.__migration_batch_size
+        state = self.__clients['coordination'].hgetall('codec_migration')
+        num_migrated = 0
+        for client_name, match in DOCUMENT_DBS.items():
+            codec, _, cursor = str(state.get(client_name.encode('utf-8'), b':0'), encoding='utf-8').partition(':')
+            if codec == self.__codec.name and cursor == 'done':
+                continue
+            cursor = int(cursor) if codec == self.__codec.name else 0
+
+            client = self.__clients[client_name]
+            while budget > 0:
+                cursor, keys = client.scan(cursor=cursor, match=match, count=self.__scan_batch_size)
+                budget -= len(keys)
+                if len(keys) > 0:
+                    stale = [(key, value) for key, value in zip(keys, client.mget(keys))
+                             if value is not None and not self.__codec.is_current(value)]
+                    pipe = client.pipeline(transaction=False)
+                    for (key, _), value in zip(stale, self.__reencode_all(client_name, [v for _, v in stale])):
+                        # documents that cannot be re-encoded are kept (they can still be decoded). XX so that
+                        # documents deleted in the meantime are not recreated
+                        if value is not None:
+                            pipe.set(key, value, xx=True)
+                    num_migrated += len(pipe)
+                    pipe.execute()
+                if cursor == 0:
+                    break
+
+            self.__clients['coordination'].hset('codec_migration', client_name,
+                                                f"{self.__codec.name}:{'done' if cursor == 0 else cursor}")
+            if cursor == 0:
+                logger.info(f"Migrated all documents in Redis {client_name.upper()} DB to codec {self.__codec.name}")
+            if budget <= 0:
+                break
+
+        if num_migrated > 0:
+            logger.info(f"Migrated {num_migrated} documents to codec {self.__codec.name}")
+        return num_migrated
+
+    ################# Bulk Loading #################
+
+    def __scan_keys(self, client_name: str, match: Optional[str] = None) -> Iterator[List[bytes]]:
+        # walk the keyspace with SCAN instead of KEYS so that Redis does not block the other workers
+        client = self.__clients[client_name]
+        cursor = None
+        while cursor != 0:
+            cursor, keys = client.scan(cursor=cursor or 0, match=match, count=self.__scan_batch_size)
+            if len(keys) > 0:
+                yield keys
+
+    def __scan_values(self, client_name: str, match: Optional[str] = None) -> Iterator[Tuple[bytes, bytes]]:
+        # the values of every SCAN batch are fetched with a single MGET, which is pipelined with the SCAN of the next
+        # batch so that every batch costs exactly one round trip. Note that SCAN might return a key more than once!
+        client = self.__clients[client_name]
+        cursor, keys = client.scan(cursor=0, match=match, count=self.__scan_batch_size)
+        while len(keys) > 0 or cursor != 0:
+            pipe = client.pipeline(transaction=False)
+            if len(keys) > 0:
+                pipe.mget(keys)
+            if cursor != 0:
+                pipe.scan(cursor=cursor, match=match, count=self.__scan_batch_size)
+            resp = pipe.execute()
+
+            if len(keys) > 0:
+                for key, value in zip(keys, resp.pop(0)):
+                    # the key might have been deleted in the meantime
+                    if value is not None:
+                        yield key, value
+
+            cursor, keys = resp[0] if cursor != 0 else (0, [])
+
+    def __bulk_load(self, client_name: str, model: Type[BaseModel], match: Optional[str] = None) -> Iterator:
+        values = (value for _, value in self.__scan_values(client_name, match=match))
+        for batch in iter(lambda: list(islice(values, self.__scan_batch_size)), []):
+            yield from self.__parse_all(model, batch)
+
+    def __scan_page(self, client_name: str, model: Type[BaseModel], cursor: Optional[str], limit: int,
+                    match: Optional[str] = None) -> Tuple[List, Optional[str]]:
+        # the opaque cursor encodes the SCAN cursor and the last key that was handed out from the SCAN batch, so that a
+        # page is never larger than the limit. The SCAN COUNT is fixed and independent of the limit, thus resuming
+        # re-scans the same buckets and skips the keys up to the last one in sorted order. Like SCAN itself, a key
+        # that is present during the whole iteration is returned at least once, but a page might repeat keys that
+        # were already handed out if the keyspace was rehashed in between. Returns the models of the page and the
+        # cursor of the next page (None if this was the last)
+        client = self.__clients[client_name]
+        scan_cursor, last_key = self.__decode_page_cursor(cursor)
+        items = []
+        while True:
+            next_scan_cursor, keys = client.scan(cursor=scan_cursor, match=match, count=self.__scan_batch_size)
+            keys = [key for key in sorted(keys) if last_key is None or key > last_key]
+            take = keys[:limit - len(items)]
+            if len(take) > 0:
+                items.extend(self.__parse_all(model, [value for value in client.mget(take) if value is not None]))
+
+            if len(take) < len(keys):
+                # the page is full but the current SCAN batch is not exhausted
+                return items, self.__encode_page_cursor(scan_cursor, take[-1])
+            elif next_scan_cursor == 0:
+                return items, None
+            elif len(items) >= limit:
+                return items, self.__encode_page_cursor(next_scan_cursor, None)
+            scan_cursor, last_key = next_scan_cursor, None
+
+    @staticmethod
+    def __encode_page_cursor(scan_cursor: int, last_key: Optional[bytes]) -> str:
+        return base64.urlsafe_b64encode(f"{scan_cursor}:".encode('utf-8') + (last_key or b'')).decode('utf-8')
+
+    @staticmethod
+    def __decode_page_cursor(cursor: Optional[str]) -> Tuple[int, Optional[bytes]]:
+        if cursor is None or cursor == '':
+            return 0, None
+        try:
+            scan_cursor, last_key = base64.urlsafe_b64decode(cursor.encode('utf-8')).split(b':', 1)
+            return int(scan_cursor), last_key or None
+        except (binascii.Error, ValueError):
+            raise ValueError(f"Invalid cursor '{cursor}'!")
+
+    @staticmethod
+    def __max_items(num: Optional[int]) -> Optional[int]:
+        # islice does not accept negative stops, all items are listed if num is None
+        return None if num is None else max(0, num)
+
+    def __mget_models(self, client_name: str, model: Type[BaseModel], keys: List[Union[str, bytes]]) -> List:
+        if len(keys) == 0:
+            return []
+        return self.__parse_all(model, [value for value in self.__clients[client_name].mget(keys) if value is not None])
+
     ################# Images #################
 
     @logger.catch(reraise=True)
@@ -78,6 +352,25 @@ class RedisHandler(object):
         # store in progress DB because in __m_rankings we need KEYS to get all MRs...
         self.__clients['images'].sadd('m_rankings', *mr.top_k_image_ids)
 
+    @logger.catch(reraise=True)
+    def store_image_id_pool(self, image_ids: Iterable[str]) -> None:
+        # bulk counterpart of store_image_ids: the image IDs are added in chunks, which are sent in one pipeline
+        pipe = self.__clients['images'].pipeline(transaction=False)
+        image_ids = iter(image_ids)
+        for chunk in iter(lambda: list(islice(image_ids, self.__write_batch_size)), []):
+            pipe.sadd('m_rankings', *chunk)
+        pipe.execute()
+
+    @logger.catch(reraise=True)
+    def get_image_id_pool(self) -> List[str]:
+        # SSCAN instead of SMEMBERS so that Redis does not block the other workers for large pools
+        return [str(i, encoding='utf-8')
+                for i in self.__clients['images'].sscan_iter('m_rankings', count=self.__scan_batch_size)]
+
+    @logger.catch(reraise=True)
+    def num_image_ids(self) -> int:
+        return self.__clients['images'].scard('m_rankings')
+
     @logger.catch(reraise=True)
     def get_random_image_ids(self, num: int = 1) -> List[str]:
         # store in progress DB because in __m_rankings we need KEYS to get all MRs...
@@ -87,8 +380,11 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def store_model_ranking(self, mr: ModelRanking) -> str:
-        if self.__clients['model_ranking'].set(mr.id, mr.json()) != 1:
+        if self.__clients['model_ranking'].set(mr.id, self.__codec.encode(mr)) != 1:
             logger.error(f"Cannot store ModelRanking {mr.json()}")
+        self.__clients['index'].hset('mr_ds_ids', mr.ds_id, mr.id)
+        # the ModelRanking might have been updated
+        self.__cache.publish_invalidation(self.__clients['coordination'], 'model_ranking', [mr.id])
 
         # store all associated image ids
         self.store_image_ids(mr)
@@ -96,29 +392,101 @@ class RedisHandler(object):
         logger.debug(f"Successfully stored ModelRanking {mr.id}")
         return mr.id
 
+    @logger.catch(reraise=True)
+    def store_model_ranking_payloads(self, payloads: Dict[str, bytes], ds_ids: Dict[str, str]) -> int:
+        # bulk counterpart of store_model_ranking for the ingestion of (already encoded) ModelRankings: they are
+        # written in chunks of MSETs, which are sent in one pipeline. Afterwards, the ds_id -> mr_id index gets
+        # updated. The image IDs have to be stored separately via store_image_id_pool.
+        pipe = self.__clients['model_ranking'].pipeline(transaction=False)
+        items = iter(payloads.items())
+        for chunk in iter(lambda: dict(islice(items, self.__write_batch_size)), {}):
+            pipe.mset(chunk)
+        if not all(pipe.execute()):
+            logger.error("Cannot store ModelRankings!")
+            raise RuntimeError("Cannot store ModelRankings!")
+
+        self.__store_ds_id_index(ds_ids)
+
+        # ModelRankings that are not new were updated
+        new_mr_ids = set(ds_ids.values())
+        updated = [mr_id for mr_id in payloads if mr_id not in new_mr_ids]
+        if len(updated) > 0:
+            self.__cache.publish_invalidation(self.__clients['coordination'], 'model_ranking', updated)
+        return len(payloads)
+
+    def __store_ds_id_index(self, ds_ids: Dict[str, str]):
+        pipe = self.__clients['index'].pipeline(transaction=False)
+        items = iter(ds_ids.items())
+        for chunk in iter(lambda: dict(islice(items, self.__write_batch_size)), {}):
+            pipe.hset('mr_ds_ids', mapping=chunk)
+        pipe.execute()
+
+    @logger.catch(reraise=True)
+    def get_model_ranking_ids_of_ds_ids(self, ds_ids: List[str]) -> List[Optional[str]]:
+        # looks up the IDs of the ModelRankings of the given dataset sample IDs (None if there is no ModelRanking)
+        if len(ds_ids) == 0:
+            return []
+        return [None if mr_id is None else str(mr_id, encoding='utf-8')
+                for mr_id in self.__clients['index'].hmget('mr_ds_ids', ds_ids)]
+
+    @logger.catch(reraise=True)
+    def num_indexed_model_rankings(self) -> int:
+        return self.__clients['index'].hlen('mr_ds_ids')
+
+    @logger.catch(reraise=True)
+    def rebuild_model_ranking_index(self) -> int:
+        # builds the ds_id -> mr_id index from the stored ModelRankings (e.g. if they were stored without the index)
+        self.__clients['index'].delete('mr_ds_ids')
+        num = 0
+        mrs = self.iter_model_rankings()
+        for chunk in iter(lambda: list(islice(mrs, self.__write_batch_size)), []):
+            self.__store_ds_id_index({mr.ds_id: mr.id for mr in chunk})
+            num += len(chunk)
+        logger.info(f"Rebuilt the index of {num} ModelRankings")
+        return num
+
+    @logger.catch(reraise=True)
+    def dataframe_is_ingested(self, name: str, fingerprint: str) -> bool:
+        ingested = self.__clients['index'].hget('ingested_dataframes', name)
+        return ingested is not None and str(ingested, encoding='utf-8') == fingerprint
+
+    @logger.catch(reraise=True)
+    def mark_dataframe_as_ingested(self, name: str, fingerprint: str):
+        self.__clients['index'].hset('ingested_dataframes', name, fingerprint)
+
     @logger.catch(reraise=True)
     def load_model_ranking(self, mr_id: str, verbose=False) -> Optional[ModelRanking]:
-        s = self.__clients['model_ranking'].get(mr_id)
-        if s is None:
-            logger.error(f"Cannot load ModelRanking {mr_id}")
-            return None
-        else:
-            sample = ModelRanking.parse_raw(s)
-            if verbose:
-                logger.debug(f"Successfully loaded ModelRanking {sample.id}")
-            return sample
+        return self.__load_document('model_ranking', 'model_ranking', ModelRanking, mr_id, verbose)
 
     @logger.catch(reraise=True)
     def model_ranking_exists(self, mr_id: str) -> bool:
         return bool(self.__clients['model_ranking'].exists(mr_id))
 
     @logger.catch(reraise=True)
-    def list_all_model_ranking_ids(self) -> List[str]:
-        return self.__clients['model_ranking'].keys()
+    def num_model_rankings(self) -> int:
+        # the model_ranking DB only contains ModelRankings
+        return self.__clients['model_ranking'].dbsize()
+
+    @logger.catch(reraise=True)
+    def list_all_model_ranking_ids(self) -> List[bytes]:
+        return [mr_id for batch in self.__scan_keys('model_ranking') for mr_id in batch]
+
+    @logger.catch(reraise=True)
+    def iter_model_ranking_ids(self) -> Iterator[str]:
+        return (str(mr_id, encoding='utf-8') for batch in self.__scan_keys('model_ranking') for mr_id in batch)
+
+    @logger.catch(reraise=True)
+    def iter_model_rankings(self) -> Iterator[ModelRanking]:
+        return self.__bulk_load('model_ranking', ModelRanking)
+
+    @logger.catch(reraise=True)
+    def page_model_rankings(self, cursor: Optional[str] = None,
+                            limit: int = 100) -> Tuple[List[ModelRanking], Optional[str]]:
+        return self.__scan_page('model_ranking', ModelRanking, cursor=cursor, limit=limit)
 
     @logger.catch(reraise=True)
     def list_model_rankings(self, num: int = None) -> List[ModelRanking]:
-        mrs = [self.load_model_ranking(mr_id=mr_id, verbose=False) for mr_id in self.list_all_model_ranking_ids()[:num]]
+        mrs = list(islice(self.iter_model_rankings(), self.__max_items(num)))
         logger.debug(f"Found {len(mrs)} ModelRankings!")
         return mrs
 
@@ -126,31 +494,27 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def store_ranking_sample(self, sample: RankingSample) -> str:
-        if self.__clients['ranking_sample'].set(sample.id, sample.json()) != 1:
+        if self.__clients['ranking_sample'].set(sample.id, self.__codec.encode(sample)) != 1:
             logger.error(f"Cannot store RankingSample {sample.json()}")
+        self.__register_sample_type(sample.id, StudyType.RANKING)
         logger.debug(f"Successfully stored RankingSample {sample.id}")
         return sample.id
 
     @logger.catch(reraise=True)
     def load_ranking_sample(self, rs_id: str, verbose: bool = True) -> Optional[RankingSample]:
-        s = self.__clients['ranking_sample'].get(rs_id)
-        if s is None:
-            logger.error(f"Cannot load RankingSample {rs_id}")
-            return None
-        else:
-            sample = RankingSample.parse_raw(s)
-            if verbose:
-                logger.debug(f"Successfully loaded RankingSample {sample.id}")
-            return sample
+        return self.__load_document('ranking_sample', 'sample', RankingSample, rs_id, verbose)
 
     @logger.catch(reraise=True)
     def ranking_sample_exists(self, rs_id: str) -> bool:
         return bool(self.__clients['ranking_sample'].exists(rs_id))
 
+    @logger.catch(reraise=True)
+    def iter_ranking_samples(self) -> Iterator[RankingSample]:
+        return self.__bulk_load('ranking_sample', RankingSample)
+
     @logger.catch(reraise=True)
     def list_ranking_samples(self, num: Optional[int] = None) -> List[RankingSample]:
-        rs = [self.load_ranking_sample(rs_id=rs_id, verbose=False) for rs_id in
-              self.__clients['ranking_sample'].keys()[:num]]
+        rs = list(islice(self.iter_ranking_samples(), self.__max_items(num)))
         logger.debug(f"Found {len(rs)} RankingSamples!")
         return rs
 
@@ -158,12 +522,20 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def store_ranking_result(self, result: RankingResult) -> Optional[str]:
-        if not self.ranking_sample_exists(result.sample_id):
+        if not self.__referenced_sample_exists(result.sample_id, StudyType.RANKING):
             logger.error(
                 f"RankingSample {result.sample_id} referenced in RankingResult {result.id} does not exist! Discarding!")
             return None
 
-        if self.__clients['ranking_result'].set(result.id, result.json()) != 1:
+        self.__clients['index'].sadd(samples_of_results_key(StudyType.RANKING), result.sample_id)
+        doc = None
+        if self.__compact_ranking_results:
+            sample = get_referenced_sample(result.sample_id)
+            if sample is None:
+                sample = self.load_ranking_sample(result.sample_id, verbose=False)
+            if sample is not None:
+                doc = ranking_positions.compact_ranking_result(result, sample.image_ids)
+        if self.__clients['ranking_result'].set(result.id, self.__codec.encode(doc or result)) != 1:
             logger.error(f"Cannot store RankingResult {result.json()}")
             return None
         else:
@@ -177,47 +549,72 @@ class RedisHandler(object):
             logger.error(f"Cannot load RankingResult {rr_id}")
             return None
         else:
-            result = RankingResult.parse_raw(s)
-            if verbose:
+            result = self.__parse('ranking_result', RankingResult, rr_id, s)
+            if result is not None and verbose:
                 logger.debug(f"Successfully loaded RankingResult {result.id}")
             return result
 
+    @logger.catch(reraise=True)
+    def iter_ranking_results(self) -> Iterator[RankingResult]:
+        return self.__bulk_load('ranking_result', RankingResult)
+
+    @logger.catch(reraise=True)
+    def page_ranking_results(self, cursor: Optional[str] = None,
+                             limit: int = 100) -> Tuple[List[RankingResult], Optional[str]]:
+        return self.__scan_page('ranking_result', RankingResult, cursor=cursor, limit=limit)
+
     @logger.catch(reraise=True)
     def list_ranking_results(self) -> List[RankingResult]:
-        res = [self.load_ranking_result(rr_id=res_id, verbose=False) for res_id in
-               self.__clients['ranking_result'].keys()]
+        res = list(self.iter_ranking_results())
         logger.debug(f"Found {len(res)} RankingResults!")
         return res
 
+    @logger.catch(reraise=True)
+    def iter_ranking_result_positions(self) -> Iterator[Tuple[str, str, np.ndarray, np.ndarray]]:
+        # yields (result ID, sample ID, ranking, irrelevant) of all RankingResults where ranking and irrelevant are the
+        # positions of the images in the image IDs of the sample. The positions of compact RankingResults are read
+        # without looking up the sample or any image ID strings.
+        values = (value for _, value in self.__scan_values('ranking_result'))
+        for batch in iter(lambda: list(islice(values, self.__scan_batch_size)), []):
+            docs = [self.__codec.decode(raw) for raw in batch]
+            samples = self.__ranking_samples_of([doc['sample_id'] for doc in docs
+                                                 if not ranking_positions.is_compact(doc)])
+            for doc in docs:
+                if ranking_positions.is_compact(doc):
+                    yield doc['id'], doc['sample_id'], \
+                          ranking_positions.positions(doc[ranking_positions.RANKING_POS]), \
+                          ranking_positions.positions(doc[ranking_positions.IRRELEVANT_POS])
+                elif doc['sample_id'] in samples:
+                    image_ids = samples[doc['sample_id']].image_ids
+                    yield doc['id'], doc['sample_id'], \
+                          ranking_positions.positions_of(doc['ranking'], image_ids), \
+                          ranking_positions.positions_of(doc['irrelevant'], image_ids)
+
     ################# LikertSample #################
 
     @logger.catch(reraise=True)
     def store_likert_sample(self, sample: LikertSample) -> str:
-        if self.__clients['likert_sample'].set(sample.id, sample.json()) != 1:
+        if self.__clients['likert_sample'].set(sample.id, self.__codec.encode(sample)) != 1:
             logger.error(f"Cannot store LikertSample {sample.json()}")
+        self.__register_sample_type(sample.id, StudyType.LIKERT)
         logger.debug(f"Successfully stored LikertSample {sample.id}")
         return sample.id
 
     @logger.catch(reraise=True)
     def load_likert_sample(self, ls_id: str, verbose: bool = True) -> Optional[LikertSample]:
-        s = self.__clients['likert_sample'].get(ls_id)
-        if s is None:
-            logger.error(f"Cannot load LikertSample {ls_id}")
-            return None
-        else:
-            sample = LikertSample.parse_raw(s)
-            if verbose:
-                logger.debug(f"Successfully loaded LikertSample {sample.id}")
-            return sample
+        return self.__load_document('likert_sample', 'sample', LikertSample, ls_id, verbose)
 
     @logger.catch(reraise=True)
     def likert_sample_exists(self, ls_id: str) -> bool:
         return bool(self.__clients['likert_sample'].exists(ls_id))
 
+    @logger.catch(reraise=True)
+    def iter_likert_samples(self) -> Iterator[LikertSample]:
+        return self.__bulk_load('likert_sample', LikertSample)
+
     @logger.catch(reraise=True)
     def list_likert_samples(self, num: Optional[int] = None) -> List[LikertSample]:
-        ls = [self.load_likert_sample(ls_id=ls_id, verbose=False) for ls_id in
-              self.__clients['likert_sample'].keys()[:num]]
+        ls = list(islice(self.iter_likert_samples(), self.__max_items(num)))
         logger.debug(f"Found {len(ls)} LikertSamples!")
         return ls
 
@@ -225,12 +622,13 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def store_likert_result(self, result: LikertResult) -> Optional[str]:
-        if not self.likert_sample_exists(result.sample_id):
+        if not self.__referenced_sample_exists(result.sample_id, StudyType.LIKERT):
             logger.error(
                 f"LikertSample {result.sample_id} referenced in LikertResult {result.id} does not exist! Discarding!")
             return None
 
-        if self.__clients['likert_result'].set(result.id, result.json()) != 1:
+        self.__clients['index'].sadd(samples_of_results_key(StudyType.LIKERT), result.sample_id)
+        if self.__clients['likert_result'].set(result.id, self.__codec.encode(result)) != 1:
             logger.error(f"Cannot store LikertResult {result.json()}")
             return None
         else:
@@ -244,15 +642,23 @@ class RedisHandler(object):
             logger.error(f"Cannot load LikertResult {lr_id}")
             return None
         else:
-            result = LikertResult.parse_raw(s)
+            result = self.__parse('likert_result', LikertResult, lr_id, s)
             if verbose:
                 logger.debug(f"Successfully loaded LikertResult {result.id}")
             return result
 
+    @logger.catch(reraise=True)
+    def iter_likert_results(self) -> Iterator[LikertResult]:
+        return self.__bulk_load('likert_result', LikertResult)
+
+    @logger.catch(reraise=True)
+    def page_likert_results(self, cursor: Optional[str] = None,
+                            limit: int = 100) -> Tuple[List[LikertResult], Optional[str]]:
+        return self.__scan_page('likert_result', LikertResult, cursor=cursor, limit=limit)
+
     @logger.catch(reraise=True)
     def list_likert_results(self) -> List[LikertResult]:
-        res = [self.load_likert_result(lr_id=res_id, verbose=False) for res_id in
-               self.__clients['likert_result'].keys()]
+        res = list(self.iter_likert_results())
         logger.debug(f"Found {len(res)} LikertResults!")
         return res
 
@@ -260,31 +666,27 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def store_rating_sample(self, sample: RatingSample) -> str:
-        if self.__clients['rating_sample'].set(sample.id, sample.json()) != 1:
+        if self.__clients['rating_sample'].set(sample.id, self.__codec.encode(sample)) != 1:
             logger.error(f"Cannot store RatingSample {sample.json()}")
+        self.__register_sample_type(sample.id, StudyType.RATING)
         logger.debug(f"Successfully stored RatingSample {sample.id}")
         return sample.id
 
     @logger.catch(reraise=True)
     def load_rating_sample(self, rs_id: str, verbose: bool = True) -> Optional[RatingSample]:
-        s = self.__clients['rating_sample'].get(rs_id)
-        if s is None:
-            logger.error(f"Cannot load RatingSample {rs_id}")
-            return None
-        else:
-            sample = RatingSample.parse_raw(s)
-            if verbose:
-                logger.debug(f"Successfully loaded RatingSample {sample.id}")
-            return sample
+        return self.__load_document('rating_sample', 'sample', RatingSample, rs_id, verbose)
 
     @logger.catch(reraise=True)
     def rating_sample_exists(self, rs_id: str) -> bool:
         return bool(self.__clients['rating_sample'].exists(rs_id))
 
+    @logger.catch(reraise=True)
+    def iter_rating_samples(self) -> Iterator[RatingSample]:
+        return self.__bulk_load('rating_sample', RatingSample)
+
     @logger.catch(reraise=True)
     def list_rating_samples(self, num: Optional[int] = None) -> List[RatingSample]:
-        ls = [self.load_rating_sample(rs_id=rs_id, verbose=False) for rs_id in
-              self.__clients['rating_sample'].keys()[:num]]
+        ls = list(islice(self.iter_rating_samples(), self.__max_items(num)))
         logger.debug(f"Found {len(ls)} RatingSamples!")
         return ls
 
@@ -292,12 +694,13 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def store_rating_result(self, result: RatingResult) -> Optional[str]:
-        if not self.rating_sample_exists(result.sample_id):
+        if not self.__referenced_sample_exists(result.sample_id, StudyType.RATING):
             logger.error(
                 f"LikertSample {result.sample_id} referenced in RatingResult {result.id} does not exist! Discarding!")
             return None
 
-        if self.__clients['rating_result'].set(result.id, result.json()) != 1:
+        self.__clients['index'].sadd(samples_of_results_key(StudyType.RATING), result.sample_id)
+        if self.__clients['rating_result'].set(result.id, self.__codec.encode(result)) != 1:
             logger.error(f"Cannot store RatingResult {result.json()}")
             return None
         else:
@@ -311,15 +714,23 @@ class RedisHandler(object):
             logger.error(f"Cannot load RatingResult {rr_id}")
             return None
         else:
-            result = RatingResult.parse_raw(s)
+            result = self.__parse('rating_result', RatingResult, rr_id, s)
             if verbose:
                 logger.debug(f"Successfully loaded RatingResult {result.id}")
             return result
 
+    @logger.catch(reraise=True)
+    def iter_rating_results(self) -> Iterator[RatingResult]:
+        return self.__bulk_load('rating_result', RatingResult)
+
+    @logger.catch(reraise=True)
+    def page_rating_results(self, cursor: Optional[str] = None,
+                            limit: int = 100) -> Tuple[List[RatingResult], Optional[str]]:
+        return self.__scan_page('rating_result', RatingResult, cursor=cursor, limit=limit)
+
     @logger.catch(reraise=True)
     def list_rating_results(self) -> List[RatingResult]:
-        res = [self.load_rating_result(rr_id=res_id, verbose=False) for res_id in
-               self.__clients['rating_result'].keys()]
+        res = list(self.iter_rating_results())
         logger.debug(f"Found {len(res)} RatingResults!")
         return res
 
@@ -350,8 +761,7 @@ class RedisHandler(object):
 
     @logger.catch(reraise=True)
     def list_hit_ids(self) -> List[str]:
-        keys = self.__clients['mturk'].keys('*_hit_info')
-        return [json.loads(self.__clients['mturk'].get(key))['HITId'] for key in keys]
+        return [json.loads(hit_info)['HITId'] for _, hit_info in self.__scan_values('mturk', match='*_hit_info')]
 
     ############### FEEDBACK (in MTurk DB) ##############################
 
@@ -359,7 +769,7 @@ class RedisHandler(object):
     def store_feedback(self, feedback: Feedback) -> Optional[str]:
         # store
         key = str('feedback_' + feedback.id)
-        if self.__clients['mturk'].set(key.encode('utf-8'), feedback.json()) != 1:
+        if self.__clients['mturk'].set(key.encode('utf-8'), self.__codec.encode(feedback)) != 1:
             logger.error(f"Cannot store Feedback {feedback.id} for RankingSample {feedback.sample_id}")
             return None
 
@@ -383,53 +793,191 @@ class RedisHandler(object):
             return None
         else:
             logger.debug(f"Successfully loaded Feedback {fb_id}")
-            return Feedback.parse_raw(fb)
+            return self.__parse('mturk', Feedback, key.encode('utf-8'), fb)
 
     @logger.catch(reraise=True)
     def list_feedbacks_of_sample(self, sample_id: str) -> List[Feedback]:
         key = str(sample_id + '_feedback')
-        return [self.load_feedback(str(fb_id, 'utf-8')) for fb_id in
-                self.__clients['mturk'].smembers(key.encode('utf-8'))]
+        fb_keys = [b'feedback_' + fb_id for fb_id in self.__clients['mturk'].smembers(key.encode('utf-8'))]
+        return self.__mget_models('mturk', Feedback, fb_keys)
 
     @logger.catch(reraise=True)
-    def list_all_feedbacks(self) -> List[Feedback]:
-        fb_ids = []
-        for key in self.__clients['mturk'].keys('*_feedback'):
-            fb_ids.extend(self.__clients['mturk'].smembers(key))
+    def iter_all_feedbacks(self) -> Iterator[Feedback]:
+        # every Feedback is stored under 'feedback_<ID>' so we do not have to resolve the per-sample sets
+        return self.__bulk_load('mturk', Feedback, match='feedback_*')
+
+    @logger.catch(reraise=True)
+    def page_all_feedbacks(self, cursor: Optional[str] = None,
+                           limit: int = 100) -> Tuple[List[Feedback], Optional[str]]:
+        return self.__scan_page('mturk', Feedback, cursor=cursor, limit=limit, match='feedback_*')
 
-        return [self.load_feedback(str(fb_id, 'utf-8')) for fb_id in fb_ids]
+    @logger.catch(reraise=True)
+    def list_all_feedbacks(self) -> List[Feedback]:
+        fbs = list(self.iter_all_feedbacks())
+        logger.debug(f"Found {len(fbs)} Feedbacks!")
+        return fbs
 
     ############### LIKERT_SAMPLE AND RANKING_SAMPLE ##############################
 
+    def __referenced_sample_exists(self, sample_id: str, typ: StudyType) -> bool:
+        # the sample was most likely already loaded while validating the result (see validation_context)
+        sample = get_referenced_sample(sample_id)
+        if sample is not None:
+            return sample.get_type() == typ
+        return self.__clients[f'{typ.value}_sample'].exists(sample_id) == 1
+
+    def __register_sample_type(self, sample_id: str, typ: StudyType):
+        self.__clients['index'].hset('sample_types', sample_id, typ.value)
+
+    def __resolve_unregistered_sample_type(self, sample_id: str) -> Optional[StudyType]:
+        # samples stored by previous versions are not in the registry so we have to probe the sample DBs
+        for typ in StudyType:
+            if self.__clients[f'{typ.value}_sample'].exists(sample_id):
+                self.__register_sample_type(sample_id, typ)
+                return typ
+        return None
+
+    @logger.catch(reraise=True)
+    def get_sample_type(self, sample_id: str) -> Optional[StudyType]:
+        typ = self.__clients['index'].hget('sample_types', sample_id)
+        if typ is None:
+            return self.__resolve_unregistered_sample_type(sample_id)
+        return StudyType(str(typ, encoding='utf-8'))
+
+    @logger.catch(reraise=True)
+    def typed_sample_exists(self, sample_id: str, typ: StudyType) -> bool:
+        # unlike sample_exists, this neither resolves the type nor logs an error if the sample does not exist
+        return self.__clients[f'{typ.value}_sample'].exists(sample_id) == 1
+
     @logger.catch(reraise=True)
     def sample_exists(self, sample_id: str, return_type=False) -> Union[bool, StudyType]:
-        if self.ranking_sample_exists(sample_id):
-            if return_type:
-                return StudyType.RANKING
-            return True
-        elif self.likert_sample_exists(sample_id):
-            if return_type:
-                return StudyType.LIKERT
-            return True
-        elif self.rating_sample_exists(sample_id):
-            if return_type:
-                return StudyType.RATING
-            return True
-        else:
-            logger.error(f"Neither a RankingSample nor a LikertSample with ID '{sample_id}' exists!")
+        typ = self.get_sample_type(sample_id)
+        if typ is None:
+            logger.error(f"Neither a RankingSample, a RatingSample nor a LikertSample with ID '{sample_id}' exists!")
             return False
+        return typ if return_type else True
 
     @logger.catch(reraise=True)
     def load_sample(self, sample_id: str) -> Optional[BaseSample]:
-        if self.ranking_sample_exists(sample_id):
-            return self.load_ranking_sample(rs_id=sample_id)
-        elif self.likert_sample_exists(sample_id):
-            return self.load_likert_sample(ls_id=sample_id)
-        elif self.rating_sample_exists(sample_id):
-            return self.load_rating_sample(rs_id=sample_id)
+        sample = self.__cache.get('sample', sample_id)
+        if sample is not None:
+            return sample
+
+        # resolves the type and loads the sample in a single round trip
+        resp = self.__load_sample_script(keys=['sample_types', sample_id], args=self.__sample_db_args)
+        if resp is not None:
+            typ, s = StudyType(str(resp[0], encoding='utf-8')), resp[1]
         else:
+            typ = self.__resolve_unregistered_sample_type(sample_id)
+            s = None if typ is None else self.__clients[f'{typ.value}_sample'].get(sample_id)
+
+        if s is None:
             logger.error(f"Neither a RankingSample, a RatingSample nor a LikertSample with ID '{sample_id}' exists!")
             return None
+        sample = self.__parse(f'{typ.value}_sample', SAMPLE_MODELS[typ], sample_id, s)
+        self.__cache.put('sample', sample_id, sample)
+        return sample
+
+    @logger.catch(reraise=True)
+    def store_samples(self, samples: List[BaseSample]) -> List[str]:
+        # bulk counterpart of the store_*_sample methods: the samples are written in chunks (MSET) that are sent in one
+        # pipeline per sample DB. The samples are registered afterwards so that every registered sample exists. The
+        # latest sample of every ModelRanking is remembered so that it can be reused in later study runs.
+        registry = {}
+        index = self.__clients['index'].pipeline(transaction=False)
+        for typ in StudyType:
+            typed = [sample for sample in samples if sample.get_type() == typ]
+            if len(typed) == 0:
+                continue
+            pipe = self.__clients[f'{typ.value}_sample'].pipeline(transaction=False)
+            for chunk in self.__chunks(typed):
+                pipe.mset({sample.id: self.__codec.encode(sample) for sample in chunk})
+                index.hset(self.__samples_of_mrs_key(typ), mapping={sample.mr_id: sample.id for sample in chunk})
+            pipe.execute()
+            registry.update({sample.id: typ.value for sample in typed})
+
+        for chunk in self.__chunks(list(registry.items())):
+            index.hset('sample_types', mapping=dict(chunk))
+        index.execute()
+
+        logger.debug(f"Successfully stored {len(registry)} Samples")
+        return list(registry.keys())
+
+    def __chunks(self, items: List) -> Iterator[List]:
+        for i in range(0, len(items), self.__write_batch_size):
+            yield items[i:i + self.__write_batch_size]
+
+    @staticmethod
+    def __samples_of_mrs_key(typ: StudyType) -> str:
+        return f'samples_of_mrs_{typ.value}'
+
+    @logger.catch(reraise=True)
+    def get_reusable_sample_ids(self, typ: StudyType, mr_ids: List[str]) -> List[Optional[str]]:
+        # the latest sample of every ModelRanking or None if there is none (or it does not exist anymore)
+        if len(mr_ids) == 0:
+            return []
+        sample_ids = [None if sid is None else str(sid, encoding='utf-8')
+                      for sid in self.__clients['index'].hmget(self.__samples_of_mrs_key(typ), mr_ids)]
+        pipe = self.__clients[f'{typ.value}_sample'].pipeline(transaction=False)
+        for sid in sample_ids:
+            pipe.exists(sid or '')
+        return [sid if sid is not None and exists == 1 else None for sid, exists in zip(sample_ids, pipe.execute())]
+
+    @logger.catch(reraise=True)
+    def iter_sample_batches(self, typ: StudyType) -> Iterator[List[Tuple[bytes, str]]]:
+        # IDs of the samples and the IDs of their ModelRankings in SCAN batches
+        values = self.__scan_values(f'{typ.value}_sample')
+        for batch in iter(lambda: list(islice(values, self.__scan_batch_size)), []):
+            yield [(sid, self.__codec.decode(value)['mr_id']) for sid, value in batch]
+
+    @logger.catch(reraise=True)
+    def samples_referenced_by_results_or_mrs(self, typ: StudyType, samples: List[Tuple[bytes, str]]) -> List[bool]:
+        # whether the samples are referenced by a result or are the reusable sample of their ModelRanking
+        if len(samples) == 0:
+            return []
+        pipe = self.__clients['index'].pipeline(transaction=False)
+        for sid, _ in samples:
+            pipe.sismember(samples_of_results_key(typ), sid)
+        pipe.hmget(self.__samples_of_mrs_key(typ), [mr_id for _, mr_id in samples])
+        refs = pipe.execute()
+        reusable = refs.pop()
+        return [in_results or latest == sid for (sid, _), in_results, latest in zip(samples, refs, reusable)]
+
+    @logger.catch(reraise=True)
+    def backfill_samples_of_results(self, typ: StudyType) -> Iterator[int]:
+        # adds the samples of the results that were stored before the samples of the results were tracked, one SCAN
+        # batch of results per step. Yields the number of results of every batch
+        values = self.__scan_values(f'{typ.value}_result')
+        for batch in iter(lambda: list(islice(values, self.__scan_batch_size)), []):
+            # the results are only decoded (compact RankingResults do not have to be expanded)
+            self.__clients['index'].sadd(samples_of_results_key(typ),
+                                         *{self.__codec.decode(value)['sample_id'] for _, value in batch})
+            yield len(batch)
+
+    def samples_of_results_complete(self, typ: StudyType) -> bool:
+        return self.__clients['index'].hexists('samples_of_results_complete', typ.value)
+
+    def mark_samples_of_results_complete(self, typ: StudyType):
+        self.__clients['index'].hset('samples_of_results_complete', typ.value, 1)
+
+    @logger.catch(reraise=True)
+    def samples_referenced_by_mturk(self, sample_ids: List[Union[str, bytes]]) -> List[bool]:
+        # whether there is a HIT or feedback of the samples
+        pipe = self.__clients['mturk'].pipeline(transaction=False)
+        for sid in sample_ids:
+            sid = sid if isinstance(sid, str) else str(sid, encoding='utf-8')
+            pipe.exists(f'{sid}_hit_info', f'{sid}_feedback')
+        return [num > 0 for num in pipe.execute()]
+
+    @logger.catch(reraise=True)
+    def delete_samples(self, typ: StudyType, sample_ids: List[Union[str, bytes]]) -> int:
+        if len(sample_ids) == 0:
+            return 0
+        # UNLINK frees the memory in a background thread of Redis
+        num = self.__clients[f'{typ.value}_sample'].unlink(*sample_ids)
+        self.__clients['index'].hdel('sample_types', *sample_ids)
+        self.__cache.publish_invalidation(self.__clients['coordination'], 'sample', sample_ids)
+        return num
 
     @logger.catch(reraise=True)
     def store_result(self, res: BaseResult) -> Optional[str]:
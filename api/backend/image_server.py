@@ -1,12 +1,11 @@
 import os
-import time
 import urllib.parse as url
 from typing import List
 
-import numpy as np
 from loguru import logger
 
-from init_imgs import init_images
+from backend.jobs import InitLock
+from init_imgs import init_images, image_dir_fingerprint, update_perceptual_hashes
 from config import conf
 
 
@@ -78,9 +77,15 @@ class ImageServer(object):
         return [self.get_img_id(img_url) for img_url in img_urls]
 
     def init_image_data(self):
-        # we wait a random amount of time here to support multi-processing (gunicorn spawns multiple processes) so
-        # only the instance that reads the init_flag first will init Redis! Otherwise it gets initialized multiple
-        # times
-        time.sleep(np.random.uniform(low=0.05, high=0.5))
+        # only one of the (gunicorn) worker processes initializes the images while the others wait until it's done. The
+        # lock is bound to the fingerprint of the image directory so that new images get initialized (e.g. after a
+        # restart)
+        InitLock(f"images_{image_dir_fingerprint(self.__img_root)}").run_once(self.__init_images)
+        # the perceptual hashes are used to keep near-duplicates of the top-k images out of the RankingSamples. They are
+        # backfilled in a separate step so that images that were initialized before are hashed as well
+        InitLock(f"perceptual_hashes_{image_dir_fingerprint(self.__img_root)}").run_once(
+            lambda: update_perceptual_hashes(self.__img_root))
+
+    def __init_images(self):
         logger.info("Initializing Image Data")
         init_images(image_dir=self.__img_root)
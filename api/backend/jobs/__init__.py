@@ -0,0 +1,2 @@
+from .job_runner import JobRunner
+from .init_lock import InitLock
@@ -0,0 +1,82 @@
+import os
+import socket
+import threading
+import time
+from typing import Callable
+
+from loguru import logger
+from shortuuid import uuid
+
+from backend.db import RedisHandler
+from backend.jobs.job_runner import RENEW_LEADERSHIP, RELEASE_LEADERSHIP
+from config import conf
+
+# identifies the start of the server and is shared by all of its worker processes, also by the ones that are restarted
+# later (set by gunicorn_conf.on_starting). Processes that are not started by gunicorn have their own
+STARTUP_EPOCH = os.getenv('STARTUP_EPOCH') or uuid()
+
+
+class InitLock(object):
+    # Barrier that makes sure an initialization step runs exactly once across all worker processes (and nodes). The
+    # first process acquires the lock (SET NX PX) and runs the step while renewing the lock. All other processes wait
+    # until the step is marked as done. If the lock holder dies or fails, its lock expires (or gets released) and one
+    # of the waiting processes takes over.
+    def __init__(self, name: str):
+        self.name = name
+        self.__lock_key = f"init_lock_{name}".encode('utf-8')
+        self.__done_key = f"init_done_{name}".encode('utf-8')
+        self.__id = f"{socket.gethostname()}:{os.getpid()}:{uuid()}"
+
+        self.__coord = RedisHandler().get_coordination_client()
+        self.__renew = self.__coord.register_script(RENEW_LEADERSHIP)
+        self.__release = self.__coord.register_script(RELEASE_LEADERSHIP)
+
+        self.__ttl_ms = int(conf.backend.jobs.init_lock_ttl * 1000)
+        self.__poll_interval = conf.backend.jobs.init_lock_poll_interval
+        self.__timeout = conf.backend.jobs.init_lock_timeout
+
+    def is_done(self) -> bool:
+        return self.__coord.exists(self.__done_key) == 1
+
+    def reset(self):
+        self.__coord.delete(self.__done_key)
+
+    @logger.catch(reraise=True)
+    def run_once(self, fn: Callable[[], None]) -> bool:
+        # returns True if fn was run by this process and False if it was (or is being) run by another process
+        start = time.monotonic()
+        while not self.is_done():
+            if self.__coord.set(self.__lock_key, self.__id, nx=True, px=self.__ttl_ms):
+                self.__run(fn)
+                return True
+
+            if time.monotonic() - start > self.__timeout:
+                msg = f"Timeout while waiting for initialization of {self.name}!"
+                logger.error(msg)
+                raise TimeoutError(msg)
+            time.sleep(self.__poll_interval)
+
+        logger.info(f"Initialization of {self.name} already done!")
+        return False
+
+    def __run(self, fn: Callable[[], None]):
+        logger.info(f"Acquired InitLock for {self.name}")
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self.__heartbeat, args=(stopped,), name=f"init_lock_{self.name}",
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            fn()
+            self.__coord.set(self.__done_key, time.time())
+            logger.info(f"Successfully finished initialization of {self.name}")
+        finally:
+            stopped.set()
+            heartbeat.join()
+            self.__release(keys=[self.__lock_key], args=[self.__id])
+
+    def __heartbeat(self, stopped: threading.Event):
+        # renew the lock while the (possibly long-running) initialization is in progress
+        while not stopped.wait(self.__ttl_ms / 3000):
+            if self.__renew(keys=[self.__lock_key], args=[self.__id, self.__ttl_ms]) != 1:
+                logger.warning(f"Lost InitLock for {self.name}!")
+                return
@@ -0,0 +1,150 @@
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List
+
+from loguru import logger
+from shortuuid import uuid
+
+from backend.db import RedisHandler
+from config import conf
+
+LEADER_KEY = b"job_runner_leader"
+DEFAULT_GROUP = 'default'
+
+# renews the leadership only if this runner still is the leader
+# KEYS[1]: leader key, ARGV[1]: runner id, ARGV[2]: leader TTL in ms
+RENEW_LEADERSHIP = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# releases the leadership only if this runner still is the leader
+# KEYS[1]: leader key, ARGV[1]: runner id
+RELEASE_LEADERSHIP = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class PeriodicJob(object):
+    def __init__(self, name: str, fn: Callable[[], None], interval: float):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.next_run = 0.0
+
+
+class JobRunner(object):
+    # Runs periodic background jobs (e.g. reaping expired leases) in exactly one of all worker processes across all
+    # nodes. The runners elect the leader via a Redis lock that the leader renews with a heartbeat. Followers stay idle
+    # and take over as soon as the lock of the leader expires. Every group of jobs runs in its own thread, so a slow job
+    # (e.g. the sample GC) only delays the jobs of its own group but never latency critical ones like the lease reaper.
+    __singleton = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.__singleton is None:
+            logger.info("Instantiating JobRunner!")
+            cls.__singleton = super(JobRunner, cls).__new__(cls)
+
+            cls.__coord = RedisHandler().get_coordination_client()
+            cls.__renew = cls.__coord.register_script(RENEW_LEADERSHIP)
+            cls.__release = cls.__coord.register_script(RELEASE_LEADERSHIP)
+
+            cls.__id = f"{socket.gethostname()}:{os.getpid()}:{uuid()}"
+            cls.__leader_ttl_ms = int(conf.backend.jobs.leader_ttl * 1000)
+            cls.__heartbeat_interval = conf.backend.jobs.heartbeat_interval
+
+            cls.__groups: Dict[str, Dict[str, PeriodicJob]] = {}
+            cls.__is_leader = threading.Event()
+            cls.__stopped = threading.Event()
+            cls.__threads: List[threading.Thread] = []
+
+        return cls.__singleton
+
+    def register(self, name: str, fn: Callable[[], None], interval: float, group: str = DEFAULT_GROUP):
+        for jobs in self.__groups.values():
+            if jobs.pop(name, None) is not None:
+                logger.warning(f"Replacing Job {name}!")
+        if group not in self.__groups:
+            self.__groups[group] = {}
+            # groups that are registered after the start get their thread immediately
+            if len(self.__threads) > 0:
+                self.__start_thread(f"job_runner_{group}", self.__job_loop, group)
+        self.__groups[group][name] = PeriodicJob(name, fn, interval)
+        logger.info(f"Registered Job {name} in group {group} with an interval of {interval}s")
+
+    def is_leader(self) -> bool:
+        return self.__is_leader.is_set()
+
+    def start(self):
+        if len(self.__threads) > 0:
+            logger.warning("JobRunner already started!")
+            return
+        # heartbeat and jobs run in separate threads so that long-running jobs cannot delay renewing the leadership
+        self.__start_thread("job_runner_heartbeat", self.__heartbeat_loop)
+        for group in list(self.__groups.keys()):
+            self.__start_thread(f"job_runner_{group}", self.__job_loop, group)
+        logger.info(f"Started JobRunner {self.__id} with {len(self.__groups)} job groups")
+
+    def __start_thread(self, name: str, target: Callable, *args):
+        t = threading.Thread(target=target, name=name, args=args, daemon=True)
+        self.__threads.append(t)
+        t.start()
+
+    def shutdown(self):
+        logger.info(f"Shutting down JobRunner {self.__id}!")
+        self.__stopped.set()
+        for t in self.__threads:
+            t.join(timeout=self.__heartbeat_interval)
+        self.__threads = []
+        if self.is_leader():
+            self.__release(keys=[LEADER_KEY], args=[self.__id])
+            self.__is_leader.clear()
+
+    def __heartbeat(self):
+        if self.is_leader():
+            if self.__renew(keys=[LEADER_KEY], args=[self.__id, self.__leader_ttl_ms]) != 1:
+                logger.warning(f"JobRunner {self.__id} lost its leadership!")
+                self.__is_leader.clear()
+        elif self.__coord.set(LEADER_KEY, self.__id, nx=True, px=self.__leader_ttl_ms):
+            logger.info(f"JobRunner {self.__id} got elected as leader!")
+            # run all jobs immediately after taking over
+            for jobs in self.__groups.values():
+                for job in jobs.values():
+                    job.next_run = 0.0
+            self.__is_leader.set()
+
+    def __heartbeat_loop(self):
+        while not self.__stopped.is_set():
+            try:
+                self.__heartbeat()
+            except Exception as e:
+                # if we cannot reach Redis we cannot be sure that we are still the leader
+                logger.error(f"JobRunner heartbeat failed! Exception: {e}")
+                self.__is_leader.clear()
+            self.__stopped.wait(self.__heartbeat_interval)
+
+    def __job_loop(self, group: str):
+        jobs = self.__groups[group]
+        while not self.__stopped.is_set():
+            if not self.__is_leader.wait(timeout=self.__heartbeat_interval):
+                continue
+
+            now = time.monotonic()
+            for job in list(jobs.values()):
+                if job.next_run > now or not self.is_leader():
+                    continue
+                try:
+                    job.fn()
+                except Exception as e:
+                    logger.error(f"Job {job.name} failed! Exception: {e}")
+                job.next_run = now + job.interval
+
+            next_run = min([job.next_run for job in list(jobs.values())], default=now + self.__heartbeat_interval)
+            self.__stopped.wait(max(0.0, next_run - time.monotonic()))
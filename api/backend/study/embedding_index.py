@@ -0,0 +1,96 @@
+import os
+from typing import List, Iterable
+
+import numpy as np
+from loguru import logger
+
+
+# Precomputed image embeddings (an N x D .npy matrix and the image IDs of its rows in a .ids.npy next to it) that are
+# used to select hard negatives, i.e., images within a band of cosine similarity to the centroid of the top-k images.
+# The matrix is memory-mapped read-only so that all worker processes share the same pages (of the page cache) instead
+# of each loading its own copy. Only the row norms are held in memory.
+class EmbeddingIndex(object):
+
+    def __init__(self, embeddings: str, chunk_size: int = 2 ** 22):
+        ids = os.path.splitext(embeddings)[0] + '.ids.npy'
+        if not os.path.isfile(embeddings) or not os.path.isfile(ids):
+            logger.error(f"Cannot find image embeddings at {embeddings} and their image IDs at {ids}!")
+            raise FileNotFoundError(f"Cannot find image embeddings at {embeddings} and their image IDs at {ids}!")
+
+        self.__emb = np.load(embeddings, mmap_mode='r')
+        self.__ids = np.load(ids)
+        if self.__emb.ndim != 2 or len(self.__emb) != len(self.__ids):
+            raise ValueError(f"Image embeddings of shape {self.__emb.shape} do not match {len(self.__ids)} image IDs!")
+        self.__index = {image_id: i for i, image_id in enumerate(self.__ids.tolist())}
+        # number of elements that are materialized at once per chunk of rows, i.e., the rows of the chunk (rows times
+        # dimension) plus their similarities to the samples of the batch (rows times samples per batch)
+        self.__chunk_size = chunk_size
+
+        self.__norms = np.empty(len(self.__emb), dtype=np.float32)
+        for start, end in self.__chunks(0):
+            self.__norms[start:end] = np.linalg.norm(np.asarray(self.__emb[start:end], dtype=np.float32), axis=1)
+        # zero vectors have no direction (and a similarity of 0 to everything)
+        self.__norms[self.__norms == 0] = np.inf
+        self.__valid = np.ones(len(self.__emb), dtype=bool)
+
+        logger.info(f"Memory-mapped {self.__emb.shape[0]} image embeddings of dimension {self.__emb.shape[1]} from "
+                    f"{embeddings}")
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def __chunks(self, num_samples: int):
+        rows = max(1, self.__chunk_size // (self.__emb.shape[1] + num_samples))
+        for start in range(0, len(self.__emb), rows):
+            yield start, min(start + rows, len(self.__emb))
+
+    def restrict_to(self, image_ids: Iterable[str]) -> None:
+        # only images of the pool are selected
+        self.__valid = np.zeros(len(self.__emb), dtype=bool)
+        self.__valid[[self.__index[image_id] for image_id in image_ids if image_id in self.__index]] = True
+
+    def __centroids(self, top_k: List[List[str]]) -> np.ndarray:
+        centroids = np.zeros((len(top_k), self.__emb.shape[1]), dtype=np.float32)
+        for i, image_ids in enumerate(top_k):
+            rows = sorted(self.__index[image_id] for image_id in image_ids if image_id in self.__index)
+            if len(rows) > 0:
+                c = (np.asarray(self.__emb[rows], dtype=np.float32) / self.__norms[rows, None]).mean(axis=0)
+                centroids[i] = c / max(float(np.linalg.norm(c)), 1e-12)
+        return centroids
+
+    def candidates(self, top_k: List[List[str]], exclude: List[List[str]], min_similarity: float,
+                   max_similarity: float) -> List[np.ndarray]:
+        # the rows of the images whose cosine similarity to the centroid of the sample's top-k images is within
+        # [min_similarity, max_similarity] (without the excluded images). The similarities of all samples are computed
+        # by one matrix product per chunk of the (memory-mapped) matrix. The candidates do not depend on the random
+        # state, so they can be reused for every sample of the same top-k images (see draw)
+        centroids = self.__centroids(top_k)
+        has_centroid = np.any(centroids != 0, axis=1)
+        excluded = [np.array(sorted(self.__index[image_id] for image_id in set(ex) if image_id in self.__index),
+                             dtype=np.int64) for ex in exclude]
+
+        rows = [[] for _ in top_k]
+        for start, end in self.__chunks(len(top_k)):
+            sims = np.asarray(self.__emb[start:end], dtype=np.float32) @ centroids.T / self.__norms[start:end, None]
+            in_band = (sims >= min_similarity) & (sims <= max_similarity) & self.__valid[start:end, None]
+            in_band[:, ~has_centroid] = False
+            for i, ex in enumerate(excluded):
+                in_band[ex[(ex >= start) & (ex < end)] - start, i] = False
+            for i in range(len(top_k)):
+                rows[i].append(np.flatnonzero(in_band[:, i]).astype(np.int32) + start)
+        return [np.concatenate(r) if len(r) > 0 else np.empty(0, dtype=np.int32) for r in rows]
+
+    def draw(self, candidates: List[np.ndarray], num: int, rng: np.random.Generator) -> List[List[str]]:
+        # selects (up to) num images of the candidates of every sample uniformly at random (in random order)
+        negatives = []
+        for rows in candidates:
+            picked = rng.choice(rows, size=min(num, len(rows)), replace=False) if num > 0 else rows[:0]
+            negatives.append(self.__ids[picked].tolist())
+        return negatives
+
+    def hard_negatives(self, top_k: List[List[str]], exclude: List[List[str]], num: int, min_similarity: float,
+                       max_similarity: float, rng: np.random.Generator) -> List[List[str]]:
+        # selects (up to) num images per sample uniformly at random among the images in the similarity band
+        if num <= 0:
+            return [[] for _ in top_k]
+        return self.draw(self.candidates(top_k, exclude, min_similarity, max_similarity), num, rng)
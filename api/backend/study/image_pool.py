@@ -0,0 +1,127 @@
+import os
+from typing import List, Iterable, Optional, Dict
+
+import numpy as np
+from loguru import logger
+
+from backend.db import RedisHandler
+from init_imgs import load_perceptual_hashes, PHASH_FILE
+
+# number of set bits of every 16-bit word
+_POPCOUNT_8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_POPCOUNT_16 = _POPCOUNT_8[np.arange(65536) & 255] + _POPCOUNT_8[np.arange(65536) >> 8]
+
+
+def hamming_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # pairwise Hamming distances (len(a) x len(b)) of two arrays of 64-bit hashes. Every XOR is looked up as four
+    # 16-bit words in the popcount table
+    xor = np.bitwise_xor(a.astype(np.uint64)[:, None], b.astype(np.uint64)[None, :])
+    words = _POPCOUNT_16[xor.view(np.uint16)]
+    return words[:, 0::4] + words[:, 1::4] + words[:, 2::4] + words[:, 3::4]
+
+
+# In-memory copy of the pool of image IDs (the m_rankings set of the IMAGES DB) from which the random images of the
+# RankingSamples are drawn. The pool is sorted so that the samples drawn with a seeded RNG are reproducible.
+# If the perceptual hashes of the images are available (see init_imgs), images that are near-duplicates of the given
+# images, i.e., within max_hamming_distance of any of them, are not drawn either. A negative distance disables this.
+class ImagePool(object):
+
+    def __init__(self, seed: Optional[int] = None, image_dir: Optional[str] = None, img_prefix: str = '',
+                 max_hamming_distance: int = -1):
+        self.__rh = RedisHandler()
+        self.__rng = np.random.default_rng(seed)
+        self.__ids: np.ndarray = np.empty(0, dtype=object)
+        self.__index: Dict[str, int] = {}
+
+        self.__image_dir = image_dir
+        self.__img_prefix = img_prefix
+        self.__max_hamming_distance = max_hamming_distance
+        self.__hashes: np.ndarray = np.empty(0, dtype=np.uint64)
+        self.__hashed: np.ndarray = np.empty(0, dtype=bool)
+        self.__hashes_mtime = None
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self.__rng
+
+    @property
+    def image_ids(self) -> np.ndarray:
+        return self.__ids
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def refresh(self) -> None:
+        # (re)loads the pool if the number of images changed since it was loaded
+        if self.__rh.num_image_ids() != len(self.__ids):
+            self.__ids = np.array(sorted(self.__rh.get_image_id_pool()), dtype=object)
+            self.__index = {image_id: i for i, image_id in enumerate(self.__ids)}
+            self.__hashes_mtime = None
+            logger.info(f"Loaded ImagePool with {len(self.__ids)} images")
+        self.__refresh_hashes()
+
+    def __refresh_hashes(self) -> None:
+        if self.__max_hamming_distance < 0 or self.__image_dir is None:
+            return
+        pth = os.path.join(self.__image_dir, PHASH_FILE)
+        mtime = os.stat(pth).st_mtime_ns if os.path.isfile(pth) else None
+        if mtime == self.__hashes_mtime and len(self.__hashed) == len(self.__ids):
+            return
+
+        self.__hashes = np.zeros(len(self.__ids), dtype=np.uint64)
+        self.__hashed = np.zeros(len(self.__ids), dtype=bool)
+        names, hashes = load_perceptual_hashes(self.__image_dir)
+        for name, h in zip(names.tolist(), hashes):
+            i = self.__index.get(name[len(self.__img_prefix):] if name.startswith(self.__img_prefix) else None)
+            if i is not None:
+                self.__hashes[i] = h
+                self.__hashed[i] = True
+        self.__hashes_mtime = mtime
+        logger.info(f"Loaded the perceptual hashes of {self.__hashed.sum()} of {len(self.__ids)} images")
+
+    def __near_duplicates(self, candidates: np.ndarray, originals: np.ndarray) -> np.ndarray:
+        # mask of the candidates that are near-duplicates of any of the original images
+        if self.__max_hamming_distance < 0 or len(self.__hashed) != len(self.__ids):
+            return np.zeros(len(candidates), dtype=bool)
+        ref = self.__hashes[originals[self.__hashed[originals]]]
+        if len(ref) == 0:
+            return np.zeros(len(candidates), dtype=bool)
+        near = (hamming_distances(self.__hashes[candidates], ref) <= self.__max_hamming_distance).any(axis=1)
+        return near & self.__hashed[candidates]
+
+    def __indices(self, image_ids: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.__index[image_id] for image_id in set(image_ids) if image_id in self.__index),
+                           dtype=np.int64)
+
+    def filter(self, image_ids: List[str], near_duplicates_of: Iterable[str]) -> List[str]:
+        # removes the images that are not in the pool or are near-duplicates of near_duplicates_of
+        candidates = np.array([self.__index[image_id] for image_id in image_ids if image_id in self.__index],
+                              dtype=np.int64)
+        candidates = candidates[~self.__near_duplicates(candidates, self.__indices(near_duplicates_of))]
+        return self.__ids[candidates].tolist()
+
+    def sample(self, num: int, exclude: Iterable[str] = (), near_duplicates_of: Optional[Iterable[str]] = None,
+               rng: Optional[np.random.Generator] = None) -> List[str]:
+        # draws num distinct images that are neither excluded nor near-duplicates of near_duplicates_of (by default the
+        # excluded images) with rng (by default the RNG of the pool). Since at most len(exclude) of the drawn candidates
+        # are excluded, drawing num + len(exclude) candidates without replacement usually yields enough images.
+        # Otherwise, twice as many candidates are drawn (until all images are drawn).
+        exclude = list(exclude)
+        excluded = self.__indices(exclude)
+        originals = self.__indices(exclude if near_duplicates_of is None else near_duplicates_of)
+        if len(self.__ids) - len(excluded) < num:
+            raise ValueError(f"Cannot draw {num} images from the ImagePool of {len(self.__ids)} images if "
+                             f"{len(excluded)} are excluded!")
+
+        rng = rng or self.__rng
+        size = num + len(excluded)
+        while True:
+            candidates = rng.choice(len(self.__ids), size=size, replace=False)
+            candidates = candidates[~np.isin(candidates, excluded)]
+            candidates = candidates[~self.__near_duplicates(candidates, originals)]
+            if len(candidates) >= num:
+                return self.__ids[candidates[:num]].tolist()
+            elif size == len(self.__ids):
+                raise ValueError(f"Cannot draw {num} images from the ImagePool of {len(self.__ids)} images if "
+                                 f"{len(excluded)} and their near-duplicates are excluded!")
+            size = min(2 * size, len(self.__ids))
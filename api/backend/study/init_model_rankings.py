@@ -1,79 +1,173 @@
 import glob
+import hashlib
 import os
 import time
+from typing import Dict, Set, Iterator, Tuple, List
 
 import numpy as np
-import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 from loguru import logger
+from shortuuid import uuid
 
 from backend.db import RedisHandler
+from backend.jobs import InitLock
 from config import conf
-from models import ModelRanking
+
+MANDATORY_COLUMNS = ['sample_id', 'caption', 'top_k_matches']
+DATAFRAME_PATTERNS = ["*.df.feather", "*.df.parquet"]
 
 
 def init_model_rankings():
-    # we wait a random amount of time here to support multi-processing (gunicorn spawns multiple processes) so
-    # only the instance that reads the init_flag first will init Redis! Otherwise it gets initialized multiple
-    # times
-    time.sleep(np.random.uniform(low=0.5, high=3.0))
-    if len(RedisHandler().list_model_rankings(1)) != 1:
-        data_root = conf.study_initialization.model_rankings.data_root
-        if not os.path.lexists(data_root):
-            logger.error(f"Cannot read Dataframe {data_root}")
-            raise FileNotFoundError(f"Cannot find Dataframe at {data_root}")
-
-        if os.path.isdir(data_root):
-            # find the feather serialized Dataframe in the data root
-            feathers = glob.glob(os.path.join(data_root, "*.df.feather"))
-            if len(feathers) != 1:
-                logger.error(
-                    f"Found multiple Dataframes! Please make sure only one Dataframe like '*.df.feather'"
-                    f"exists is in {data_root}!"
-                )
-                raise FileExistsError(
-                    f"Found multiple Dataframes! Please make sure only one Dataframe like '*.df.feather'"
-                    f"exists is in {data_root}!"
-                )
-            dataframe = feathers[0]
-        elif os.path.isfile(data_root):
-            dataframe = data_root
-        else:
-            logger.error(f"Cannot read Dataframe {data_root}")
-            raise FileNotFoundError(f"Cannot find Dataframe at {data_root}")
-
-        logger.info(f"Initializing ModelRankings from Dataframe {dataframe}")
-        # load the Dataframe
-        df = pd.read_feather(dataframe)
-
-        # make sure the mandatory columns exist
-        for k in ['sample_id', 'caption', 'top_k_matches']:
-            if k not in df.columns:
-                logger.error(f"Cannot find {k} in the columns of the DataFrame!")
-                raise IndexError(f"Cannot find {k} in the columns of the DataFrame!")
-
-        # we don't use lambda for cleaner code
-        def generate_model_ranking(row) -> ModelRanking:
-            opts = None
-            # add optional kwargs from non mandatory columns
-            for c in row.index:
-                if c not in ['sample_id', 'caption', 'top_k_matches']:
-                    if opts is None:
-                        opts = dict()
-                    opts[c] = row[c]
-            return ModelRanking(ds_id=row['sample_id'],
-                                query=row['caption'],
-                                top_k_image_ids=row['top_k_matches'].tolist(),
-                                opts=opts)
-
-        # generate ModelRankings from DataFrame
-        rankings = df.apply(generate_model_ranking, axis=1).tolist()
-        logger.info(f"Instantiated {len(rankings)} ModelRankings from Dataframe {dataframe}")
-
-        # shuffle and slice
-        if conf.study_initialization.model_rankings.shuffle:
-            logger.debug("Shuffling ModelRankings")
-            np.random.shuffle(rankings)
-
-        # store the ModelRankings
-        for mr in rankings:
-            RedisHandler().store_model_ranking(mr)
+    dataframes = _find_dataframes(conf.study_initialization.model_rankings.data_root)
+    # only one of the (gunicorn) worker processes ingests the Dataframes while the others wait until it's done. The lock
+    # is bound to the fingerprints of the Dataframes so that new or changed Dataframes get ingested (e.g. after a
+    # restart)
+    fingerprints = hashlib.md5(";".join(map(_fingerprint, dataframes)).encode('utf-8')).hexdigest()
+    InitLock(f"model_rankings_{fingerprints}").run_once(lambda: _init_model_rankings(dataframes))
+
+
+def _find_dataframes(data_root: str) -> List[str]:
+    if not os.path.lexists(data_root):
+        logger.error(f"Cannot read Dataframe {data_root}")
+        raise FileNotFoundError(f"Cannot find Dataframe at {data_root}")
+
+    if os.path.isdir(data_root):
+        # find all feather (or parquet) serialized Dataframes in the data root
+        dataframes = sorted(df for p in DATAFRAME_PATTERNS for df in glob.glob(os.path.join(data_root, p)))
+        if len(dataframes) == 0:
+            logger.error(f"Cannot find any Dataframe like '*.df.feather' or '*.df.parquet' in {data_root}!")
+            raise FileNotFoundError(f"Cannot find any Dataframe like '*.df.feather' or '*.df.parquet' in {data_root}!")
+        return dataframes
+    elif os.path.isfile(data_root):
+        return [data_root]
+    else:
+        logger.error(f"Cannot read Dataframe {data_root}")
+        raise FileNotFoundError(f"Cannot find Dataframe at {data_root}")
+
+
+def _fingerprint(dataframe: str) -> str:
+    stat = os.stat(dataframe)
+    return f"{os.path.basename(dataframe)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _init_model_rankings(dataframes: List[str]):
+    rh = RedisHandler()
+    # ModelRankings stored by previous versions are not indexed yet
+    if rh.num_indexed_model_rankings() == 0 and rh.num_model_rankings() > 0:
+        rh.rebuild_model_ranking_index()
+
+    for dataframe in dataframes:
+        name, fingerprint = os.path.basename(dataframe), _fingerprint(dataframe)
+        if rh.dataframe_is_ingested(name, fingerprint):
+            logger.info(f"Dataframe {dataframe} already ingested!")
+            continue
+        ingest_model_rankings(dataframe, upsert=conf.study_initialization.model_rankings.upsert)
+        rh.mark_dataframe_as_ingested(name, fingerprint)
+
+
+def _open_batches(dataframe: str, batch_size: int) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    # the Dataframe is memory-mapped and read in record batches of at most batch_size rows so that the memory usage
+    # does not depend on the size of the Dataframe
+    if dataframe.endswith('.parquet'):
+        pf = pq.ParquetFile(dataframe, memory_map=True)
+        return pf.schema_arrow, pf.iter_batches(batch_size=batch_size)
+
+    source = pa.memory_map(dataframe, 'r')
+    try:
+        # feather V2 is the Arrow IPC file format
+        reader = pa.ipc.open_file(source)
+    except pa.ArrowInvalid:
+        # feather V1 files cannot be read in batches
+        logger.warning(f"Cannot stream Dataframe {dataframe} (feather V1)! Reading the whole Dataframe instead.")
+        table = feather.read_table(dataframe, memory_map=True)
+        return table.schema, iter(table.to_batches(max_chunksize=batch_size))
+
+    def batches() -> Iterator[pa.RecordBatch]:
+        try:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                # the record batches of the file can be larger than batch_size
+                for offset in range(0, batch.num_rows, batch_size):
+                    yield batch.slice(offset, batch_size)
+        finally:
+            source.close()
+
+    return reader.schema, batches()
+
+
+def _image_ids_column(batch: pa.RecordBatch) -> pa.Array:
+    # the image IDs of the top-k matches are stored as strings (but might be serialized as integers)
+    col = batch.column(batch.schema.get_field_index('top_k_matches'))
+    if not pa.types.is_string(col.type.value_type):
+        col = col.cast(pa.list_(pa.string()))
+    return col
+
+
+def ingest_model_rankings(dataframe: str, upsert: bool = False) -> int:
+    # Stores the ModelRankings of the Dataframe columnar, i.e., the Arrow record batches are converted to (serialized)
+    # ModelRankings in bulk without instantiating a DataFrame or pydantic models and are written via pipelines.
+    # Rows of dataset samples that already have a ModelRanking (looked up in the ds_id index) are skipped or, if
+    # upsert is True, update the existing ModelRanking.
+    logger.info(f"Initializing ModelRankings from Dataframe {dataframe}")
+    start = time.time()
+    schema, batches = _open_batches(dataframe, conf.study_initialization.model_rankings.batch_size)
+
+    # make sure the mandatory columns exist
+    for k in MANDATORY_COLUMNS:
+        if k not in schema.names:
+            logger.error(f"Cannot find {k} in the columns of the DataFrame!")
+            raise IndexError(f"Cannot find {k} in the columns of the DataFrame!")
+    # all non mandatory columns are stored as optional kwargs (except the index of pandas)
+    opt_columns = [c for c in schema.names if c not in MANDATORY_COLUMNS and not c.startswith('__index_level_')]
+
+    rh = RedisHandler()
+    shuffle = conf.study_initialization.model_rankings.shuffle
+    image_ids: Set[str] = set()
+    num_stored, num_updated, num_skipped = 0, 0, 0
+    for batch in batches:
+        ds_ids = [str(ds_id) for ds_id in batch.column(batch.schema.get_field_index('sample_id')).to_pylist()]
+        queries = batch.column(batch.schema.get_field_index('caption')).to_pylist()
+        top_k_image_ids = _image_ids_column(batch).to_pylist()
+        opts = {c: batch.column(batch.schema.get_field_index(c)).to_pylist() for c in opt_columns}
+
+        # the ModelRankings are shuffled within the batches
+        rows = np.random.permutation(batch.num_rows) if shuffle else range(batch.num_rows)
+
+        # ds_id -> mr_id of the already stored ModelRankings
+        index = {ds_id: mr_id for ds_id, mr_id in zip(ds_ids, rh.get_model_ranking_ids_of_ds_ids(ds_ids))
+                 if mr_id is not None}
+
+        payloads: Dict[str, bytes] = {}
+        new_ds_ids: Dict[str, str] = {}
+        for i in rows:
+            mr_id = index.get(ds_ids[i])
+            if mr_id is None:
+                mr_id = uuid()
+                index[ds_ids[i]] = new_ds_ids[ds_ids[i]] = mr_id
+            elif not upsert:
+                num_skipped += 1
+                continue
+            elif mr_id not in payloads:
+                num_updated += 1
+
+            # same fields as ModelRanking
+            payloads[mr_id] = rh.encode({'id': mr_id,
+                                         'ds_id': ds_ids[i],
+                                         'query': queries[i],
+                                         'top_k_image_ids': top_k_image_ids[i],
+                                         'opts': {c: vals[i] for c, vals in opts.items()} if opt_columns else None})
+            image_ids.update(top_k_image_ids[i])
+
+        num_stored += rh.store_model_ranking_payloads(payloads, new_ds_ids)
+        logger.debug(f"Stored {num_stored} ModelRankings ({num_updated} updated, {num_skipped} skipped)")
+
+    # store all associated image ids at once (their number is bounded by the number of images, not the rows)
+    rh.store_image_id_pool(image_ids)
+
+    duration = time.time() - start
+    logger.info(f"Stored {num_stored} ModelRankings ({num_updated} updated, {num_skipped} skipped) with "
+                f"{len(image_ids)} distinct images from Dataframe {dataframe} in {duration:.2f}s "
+                f"({(num_stored + num_skipped) / max(duration, 1e-6):.0f} rows/s)")
+    return num_stored
@@ -1,6 +1,5 @@
 from loguru import logger
 
-from backend.db import RedisHandler
 from backend.study import StudyCoordinatorBase
 from config import conf
 from models import LikertSample, ModelRanking, StudyType
@@ -41,7 +40,5 @@ class LikertStudyCoordinator(StudyCoordinatorBase):
                           question=self.question,
                           answers=self.answers,
                           answer_weights=self.answer_weights)
-        # and persist in redis
-        RedisHandler().store_likert_sample(ls)
 
         return ls
@@ -0,0 +1,197 @@
+# Server-side Lua scripts that implement the state transitions of a study run. Every script runs atomically in Redis,
+# i.e., the transitions are consistent across all worker processes (and nodes) and cost a single round trip.
+#
+# All scripts get the same KEYS:
+#   KEYS[1]: TODO set, KEYS[2]: IN_PROGRESS sorted set (leases scored by their expiry timestamp), KEYS[3]: DONE set,
+#   KEYS[4]: run counter, KEYS[5]: FIFO list of the tickets of the waiting clients (see hand_off),
+#   KEYS[6]: hash of the start timestamps of the leases, KEYS[7]: hash of the lease statistics (see record_duration)
+# and return the progress of the study run as {num_todo, num_in_progress, num_done, run} (if not stated otherwise).
+#
+# Some scripts also access keys that are not declared since they are only known inside the script: the wakeup lists of
+# the waiting clients (KEYS[5] .. ':' .. ticket, see hand_off) and the result sets of the current run (run results
+# prefix .. run counter, see COMPLETE). Hence, the scripts do not support Redis Cluster (which does not support the
+# multiple DBs of the studies anyway, see RedisHandler).
+
+# the lease durations are counted in logarithmic buckets, i.e., bucket i counts the durations in [b^i, b^(i+1)) seconds
+HISTOGRAM_BASE = 1.1
+
+# NOTE: scripts calling random commands like SPOP require effects replication, which is the default since Redis 5
+_PREAMBLE = f"local HISTOGRAM_BASE = {HISTOGRAM_BASE}" + """
+local function progress()
+    return {redis.call('SCARD', KEYS[1]), redis.call('ZCARD', KEYS[2]), redis.call('SCARD', KEYS[3]),
+            tonumber(redis.call('GET', KEYS[4]) or 0)}
+end
+-- we use the clock of the Redis server so that the lease expiry does not depend on the clocks of the workers
+local function now()
+    local t = redis.call('TIME')
+    return tonumber(t[1]) + tonumber(t[2]) / 1000000
+end
+-- the remaining TTL (in seconds) of the lease that expires first or 0 if there are no leases
+local function shortest_ttl()
+    local first = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if #first == 0 then
+        return 0
+    end
+    return math.max(0, math.ceil(tonumber(first[2]) - now()))
+end
+-- the adapted lease TTL (see StudyCoordinatorBase.adapt_lease_ttl) or the configured TTL
+local function lease_ttl(default)
+    return tonumber(redis.call('HGET', KEYS[7], 'ttl') or default)
+end
+-- leases the sample for ttl seconds from start on and remembers when the lease started
+local function lease(sample_id, start, ttl)
+    redis.call('ZADD', KEYS[2], start + ttl, sample_id)
+    redis.call('HSET', KEYS[6], sample_id, string.format('%.6f', start))
+end
+-- counts the duration of the (last) lease of the sample until now in the histogram of the lease statistics
+local function record_duration(sample_id)
+    local start = redis.call('HGET', KEYS[6], sample_id)
+    if start then
+        local duration = math.max(now() - tonumber(start), 1)
+        redis.call('HINCRBY', KEYS[7], 'b' .. math.floor(math.log(duration) / math.log(HISTOGRAM_BASE)), 1)
+        redis.call('HDEL', KEYS[6], sample_id)
+    end
+end
+-- the deadline of a queued ticket (the entries of KEYS[5] are '<deadline>:<ticket>') or 0 if it has none
+local function deadline(entry)
+    return tonumber(string.match(entry, '^([%d.]+):') or 0)
+end
+-- leases the samples in TODO to the waiting clients in FIFO order and wakes them up by pushing the leased sample id
+-- to the wakeup list of their ticket (KEYS[5] .. ':' .. ticket). Tickets whose deadline passed are skipped since
+-- their clients stopped waiting. The wakeup lists expire with the lease
+local function hand_off(ttl)
+    ttl = lease_ttl(ttl)
+    while redis.call('LLEN', KEYS[5]) > 0 and redis.call('SCARD', KEYS[1]) > 0 do
+        local entry = redis.call('LPOP', KEYS[5])
+        if deadline(entry) > now() then
+            local wakeup = KEYS[5] .. ':' .. string.sub(entry, string.find(entry, ':', 1, true) + 1)
+            local sample_id = redis.call('SPOP', KEYS[1])
+            lease(sample_id, now(), ttl)
+            redis.call('RPUSH', wakeup, sample_id)
+            redis.call('EXPIRE', wakeup, math.ceil(ttl))
+        end
+    end
+end
+"""
+
+# Leases a random sample, i.e., moves it from TODO to IN_PROGRESS with the expiry timestamp of the lease as score.
+# ARGV[1]: (configured) lease TTL in seconds, ARGV[2]: optional ticket that is queued in KEYS[5] if TODO is empty,
+# ARGV[3]: seconds the client waits for the hand-off to the ticket (required with a ticket)
+# Returns {sample_id, progress...} or the shortest remaining TTL of the IN_PROGRESS samples if TODO is empty.
+LEASE = _PREAMBLE + """
+local sample_id = redis.call('SPOP', KEYS[1])
+if not sample_id then
+    if ARGV[2] then
+        -- drop the tickets at the head of the queue whose deadline passed (the others are skipped by hand_off)
+        local head = redis.call('LINDEX', KEYS[5], 0)
+        while head and deadline(head) <= now() do
+            redis.call('LPOP', KEYS[5])
+            head = redis.call('LINDEX', KEYS[5], 0)
+        end
+        redis.call('RPUSH', KEYS[5], string.format('%.6f', now() + tonumber(ARGV[3])) .. ':' .. ARGV[2])
+    end
+    return shortest_ttl()
+end
+lease(sample_id, now(), lease_ttl(ARGV[1]))
+local prog = progress()
+table.insert(prog, 1, sample_id)
+return prog
+"""
+
+# Leases up to ARGV[2] random samples at once, which all expire at the same time.
+# ARGV[1]: (configured) lease TTL in seconds, ARGV[2]: max. number of samples
+# Returns {expiry timestamp (as string since Lua numbers are converted to integers), lease TTL, {sample_ids...},
+# progress...} or the shortest remaining TTL of the IN_PROGRESS samples if TODO is empty.
+LEASE_BATCH = _PREAMBLE + """
+local sample_ids = redis.call('SPOP', KEYS[1], tonumber(ARGV[2]))
+if #sample_ids == 0 then
+    return shortest_ttl()
+end
+local ttl = lease_ttl(ARGV[1])
+local start = now()
+for _, sample_id in ipairs(sample_ids) do
+    lease(sample_id, start, ttl)
+end
+local prog = progress()
+table.insert(prog, 1, sample_ids)
+table.insert(prog, 1, ttl)
+table.insert(prog, 1, string.format('%.6f', start + ttl))
+return prog
+"""
+
+# Completes a leased sample, i.e., moves it from IN_PROGRESS to DONE and references the result in the current run.
+# The duration of the lease is recorded, also if the lease already expired (unless the sample was leased again) since
+# the TTL is too short for such late submissions.
+# ARGV[1]: sample id, ARGV[2]: prefix of the run results keys, ARGV[3]: result id
+# Returns nil if the sample is not (anymore) IN_PROGRESS
+COMPLETE = _PREAMBLE + """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+        record_duration(ARGV[1])
+        redis.call('HINCRBY', KEYS[7], 'late', 1)
+    end
+    redis.call('HINCRBY', KEYS[7], 'rejected', 1)
+    return nil
+end
+record_duration(ARGV[1])
+redis.call('HINCRBY', KEYS[7], 'completed', 1)
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('SADD', ARGV[2] .. (redis.call('GET', KEYS[4]) or 0), ARGV[3])
+return progress()
+"""
+
+# Reverts COMPLETE if the result could not be stored, i.e., moves the sample from DONE back to TODO.
+# ARGV[1]: sample id, ARGV[2]: prefix of the run results keys, ARGV[3]: result id, ARGV[4]: lease TTL in seconds
+RELEASE = _PREAMBLE + """
+if redis.call('SMOVE', KEYS[3], KEYS[1], ARGV[1]) == 1 then
+    redis.call('SREM', ARGV[2] .. (redis.call('GET', KEYS[4]) or 0), ARGV[3])
+    hand_off(ARGV[4])
+end
+return progress()
+"""
+
+# Reaps expired leases, i.e., moves the samples whose lease expired from IN_PROGRESS back to TODO.
+# ARGV[1]: max. number of leases to reap, ARGV[2]: lease TTL in seconds
+# Returns the ids of the expired samples
+REAP = _PREAMBLE + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now(), 'LIMIT', 0, tonumber(ARGV[1]))
+for _, sample_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], sample_id)
+    redis.call('SADD', KEYS[1], sample_id)
+end
+if #expired > 0 then
+    redis.call('HINCRBY', KEYS[7], 'expired', #expired)
+end
+hand_off(ARGV[2])
+return expired
+"""
+
+# Starts a new run, i.e., replaces TODO with the prepared set of the next run, clears IN_PROGRESS and DONE, and
+# increments the run counter.
+# KEYS[8]: prepared TODO set of the next run, ARGV[1]: lease TTL in seconds
+NEW_RUN = _PREAMBLE + """
+if redis.call('EXISTS', KEYS[8]) == 0 then
+    return redis.error_reply('TODO of the next run is not prepared')
+end
+redis.call('RENAME', KEYS[8], KEYS[1])
+redis.call('DEL', KEYS[2], KEYS[3], KEYS[6])
+redis.call('INCR', KEYS[4])
+hand_off(ARGV[1])
+return progress()
+"""
+
+# Halves the counts of the histogram of the lease statistics so that older lease durations are gradually forgotten.
+DECAY_HISTOGRAM = _PREAMBLE + """
+local stats = redis.call('HGETALL', KEYS[7])
+for i = 1, #stats, 2 do
+    if string.sub(stats[i], 1, 1) == 'b' then
+        local count = math.floor(tonumber(stats[i + 1]) / 2)
+        if count > 0 then
+            redis.call('HSET', KEYS[7], stats[i], count)
+        else
+            redis.call('HDEL', KEYS[7], stats[i])
+        end
+    end
+end
+return nil
+"""
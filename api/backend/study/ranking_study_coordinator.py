@@ -1,7 +1,15 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
 import numpy as np
+from loguru import logger
 
 from backend.db import RedisHandler
 from backend.study import StudyCoordinatorBase
+from backend.study.embedding_index import EmbeddingIndex
+from backend.study.image_pool import ImagePool
 from config import conf
 from models import RankingSample, ModelRanking, StudyType
 
@@ -25,30 +33,105 @@ class RankingStudyCoordinator(StudyCoordinatorBase):
             self.num_random_imgs = sub_conf.num_random_imgs
             # we need this for whatever pythonic reason (it's not accessible from self.__rh from the super class)
             self.__rh = RedisHandler()
+            # a seed makes the drawn random images (and their order) reproducible
+            self.__image_pool = ImagePool(seed=sub_conf.seed,
+                                          image_dir=conf.image_server.img_root,
+                                          img_prefix=conf.image_server.img_prefix,
+                                          max_hamming_distance=sub_conf.near_duplicate_max_distance)
+
+            # optionally, some of the random images are hard negatives selected by their embedding similarity
+            hn_conf = sub_conf.hard_negatives
+            self.num_hard_negatives = min(hn_conf.num, self.num_random_imgs) if hn_conf.enabled else 0
+            self.__hn_similarity_band = (hn_conf.min_similarity, hn_conf.max_similarity)
+            self.__embeddings: Optional[EmbeddingIndex] = None
+            if self.num_hard_negatives > 0:
+                data_root = conf.study_initialization.model_rankings.data_root
+                data_dir = data_root if os.path.isdir(data_root) else os.path.dirname(data_root)
+                self.__embeddings = EmbeddingIndex(os.path.join(data_dir, hn_conf.embeddings), hn_conf.chunk_size)
+            self.__embeddings_pool_size = None
+            # the hard negative candidates (image rows in the similarity band) of the recently used ModelRankings, so
+            # that materializing further (virtual) samples of a ModelRanking does not scan the embeddings again. The
+            # cache is bounded by the total number of cached rows and cleared if the image pool changes
+            self.__hn_cache: OrderedDict = OrderedDict()
+            self.__hn_cache_rows = 0
+            self.__hn_cache_size = hn_conf.cache_size
+            self.__hn_lock = threading.Lock()
 
     def _generate_sample(self, mr: ModelRanking) -> RankingSample:
-        # get top-k from model ranking
-        tk_imgs = mr.top_k_image_ids[0:self.num_top_k_imgs]
-        # get  random images
-        random_imgs = set(self.__rh.get_random_image_ids(self.num_random_imgs))
-
-        # make sure intersection of the top-k and the random images is an empty set!
-        mr_top_k_imgs = set(mr.top_k_image_ids)  # order doesnt matter for checking
-        while len(mr_top_k_imgs.intersection(random_imgs)) != 0:
-            # sample new random images if there was an overlap
-            random_imgs = set(self.__rh.get_random_image_ids(self.num_random_imgs))
-
-        # combine random images and top-k images
-        es_imgs = tk_imgs + list(random_imgs)
-
-        # shuffle so users cannot observe patterns so easy
-        np.random.shuffle(es_imgs)
-
-        # create the sample
-        rs = RankingSample(mr_id=mr.id,
-                           query=mr.query,
-                           image_ids=es_imgs)
-        # and store in redis
-        self.__rh.store_ranking_sample(rs)
-
-        return rs
+        return self._generate_samples([mr])[0]
+
+    def _generate_samples(self, mrs: List[ModelRanking],
+                          rng: Optional[np.random.Generator] = None) -> List[RankingSample]:
+        # the random images are drawn from the in-memory ImagePool (which is reloaded only if images were added)
+        self.__image_pool.refresh()
+        rng = rng or self.__image_pool.rng
+        hard_negatives = self.__hard_negatives(mrs, rng)
+
+        samples = []
+        for mr, negatives in zip(mrs, hard_negatives):
+            # get top-k from model ranking
+            tk_imgs = mr.top_k_image_ids[0:self.num_top_k_imgs]
+
+            # make sure intersection of the top-k (and their near-duplicates) and the random images is an empty set!
+            # If there are not enough hard negatives, the remaining random images are drawn uniformly
+            try:
+                random_imgs = self.__image_pool.filter(negatives, near_duplicates_of=tk_imgs)[:self.num_hard_negatives]
+                random_imgs += self.__image_pool.sample(self.num_random_imgs - len(random_imgs),
+                                                        exclude=mr.top_k_image_ids + random_imgs,
+                                                        near_duplicates_of=tk_imgs,
+                                                        rng=rng)
+            except ValueError as e:
+                logger.error(f"Cannot draw random images for ModelRanking {mr.id}! {e}")
+                raise RuntimeError(f"Cannot draw random images for ModelRanking {mr.id}! {e}")
+
+            # combine random images and top-k images
+            es_imgs = tk_imgs + random_imgs
+
+            # shuffle so users cannot observe patterns so easy
+            rng.shuffle(es_imgs)
+
+            # create the sample
+            samples.append(RankingSample(mr_id=mr.id,
+                                         query=mr.query,
+                                         image_ids=es_imgs))
+        return samples
+
+    def __hard_negatives(self, mrs: List[ModelRanking], rng: np.random.Generator) -> List[List[str]]:
+        if self.__embeddings is None:
+            return [[] for _ in mrs]
+        with self.__hn_lock:
+            if self.__embeddings_pool_size != len(self.__image_pool):
+                self.__embeddings.restrict_to(self.__image_pool.image_ids)
+                self.__embeddings_pool_size = len(self.__image_pool)
+                self.__hn_cache.clear()
+                self.__hn_cache_rows = 0
+            candidates = [self.__hn_cache.get(mr.id) for mr in mrs]
+            for mr, rows in zip(mrs, candidates):
+                if rows is not None:
+                    self.__hn_cache.move_to_end(mr.id)
+
+        # the candidates of all ModelRankings that are not cached are computed with a single scan
+        missing = [i for i, rows in enumerate(candidates) if rows is None]
+        if len(missing) > 0:
+            top_k = [mrs[i].top_k_image_ids[0:self.num_top_k_imgs] for i in missing]
+            computed = self.__embeddings.candidates(top_k=top_k,
+                                                    exclude=[mrs[i].top_k_image_ids for i in missing],
+                                                    min_similarity=self.__hn_similarity_band[0],
+                                                    max_similarity=self.__hn_similarity_band[1])
+            with self.__hn_lock:
+                for i, rows in zip(missing, computed):
+                    candidates[i] = rows
+                    self.__cache_candidates(mrs[i].id, rows)
+
+        # twice as many as needed because some might be near-duplicates of the top-k images
+        return self.__embeddings.draw(candidates, 2 * self.num_hard_negatives, rng)
+
+    def __cache_candidates(self, mr_id: str, rows: np.ndarray):
+        if len(rows) > self.__hn_cache_size:
+            return
+        previous = self.__hn_cache.pop(mr_id, None)
+        self.__hn_cache_rows += len(rows) - (0 if previous is None else len(previous))
+        self.__hn_cache[mr_id] = rows
+        while self.__hn_cache_rows > self.__hn_cache_size:
+            _, evicted = self.__hn_cache.popitem(last=False)
+            self.__hn_cache_rows -= len(evicted)
@@ -1,6 +1,5 @@
 from loguru import logger
 
-from backend.db import RedisHandler
 from backend.study import StudyCoordinatorBase
 from config import conf
 from models import ModelRanking, RatingSample, StudyType
@@ -41,7 +40,5 @@ class RatingStudyCoordinator(StudyCoordinatorBase):
                           min_rating=self.min_rating,
                           max_rating=self.max_rating,
                           rating_step=self.rating_step)
-        # and persist in redis
-        RedisHandler().store_rating_sample(rs)
 
         return rs
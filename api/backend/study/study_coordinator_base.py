@@ -1,21 +1,27 @@
 from __future__ import annotations
 
-import concurrent
-import threading
+import asyncio
+import json
+import math
 import time
 from abc import abstractmethod
-from concurrent.futures.thread import ThreadPoolExecutor
 from enum import Enum, unique
-from typing import Dict, Union, List, Optional
+from itertools import islice
+from typing import Dict, Union, List, Optional, Iterator, Tuple, Iterable
 
 import numpy as np
 import redis
+import redis.asyncio as aioredis
 from loguru import logger
+from shortuuid import uuid
 
-from backend.db import RedisHandler
+from backend.db import RedisHandler, AsyncRedisHandler
 from backend.image_server import ImageServer
+from backend.jobs import JobRunner, InitLock
+from backend.study import lua_scripts
 from config import conf
-from models import BaseResult, BaseSample, ModelRanking
+from models import BaseResult, BaseSample, ModelRanking, Lease
+from models.validation_context import known_model_rankings
 
 
 @unique
@@ -28,37 +34,66 @@ class InitState(int, Enum):
 @unique
 class Keys(bytes, Enum):
     TODO = b"todo"
-    IN_PROGRESS = b"in_progress"
+    TODO_NEXT_RUN = b"todo_next_run"
+    # sorted set of the leased samples scored by the expiry timestamp of their lease
+    IN_PROGRESS = b"in_progress_leases"
     DONE = b"done"
     INIT_STATE = b"init_lvl"
     RUN_CNT = b"run_cnt"
     RUN_RESULTS = b"run_results_"
-    TTL = b"__ttl_shadow__"
-
-
-def expired_handler(coordinator: StudyCoordinatorBase):
-    rh = RedisHandler()
-    progress = rh.get_progress_client(coordinator.typ)
-    while True:
-        try:
-            # if a sample id is in in_progress but not in KEYS, the sample id is expired.
-            # we have to be careful here with bytes and strings! every key is handled as bytes and combining with str
-            # leads to hard-to-find errors...
-            in_prog_ids = set(progress.smembers(Keys.IN_PROGRESS))
-            ttk_shadow_keys = list(progress.keys(Keys.TTL.value + b"*"))
-            ttl_shadow_ids = set([key.replace(Keys.TTL.value, b"") for key in ttk_shadow_keys])
-            expired = list(in_prog_ids - ttl_shadow_ids)
-            coordinator.expire(expired)
-            time.sleep(0.1)
-        except Exception as e:
-            print(e)
+    # set of the leased samples whose expiry was tracked by TTL shadow keys in previous versions
+    LEGACY_IN_PROGRESS = b"in_progress"
+    # list of periodic progress snapshots (newest first)
+    PROGRESS_HISTORY = b"progress_history"
+    # FIFO list of the tickets of the clients that wait for a sample (see next_async) as <deadline>:<ticket>. The
+    # sample leased to a waiting client is pushed to the wakeup list WAITERS:<ticket>
+    WAITERS = b"waiters"
+    # hash of the start timestamps of the current leases
+    LEASES = b"lease_starts"
+    # hash of the histogram of the lease durations (bucket i is the field b<i>, see lua_scripts), the counts of the
+    # completed, rejected (of which late) and expired leases, and the adapted lease TTL (field ttl)
+    LEASE_STATS = b"lease_stats"
+    # unreferenced samples found by the previous (next) garbage collection pass
+    GC_CANDIDATES = b"gc_candidates"
+    GC_CANDIDATES_NEXT = b"gc_candidates_next"
+
+
+def virtual_sample_id(mr_id: str, seed: int) -> str:
+    # ID of a virtual sample, i.e., a sample that is built deterministically from the ModelRanking and the seed when it
+    # is leased the first time. The sample is stored with this ID (the generated IDs do not contain '-')
+    return f"{mr_id}-{seed}"
+
+
+def parse_virtual_sample_id(sample_id: str) -> Optional[Tuple[str, int]]:
+    mr_id, _, seed = sample_id.rpartition('-')
+    if len(mr_id) == 0 or not seed.isdigit():
+        return None
+    return mr_id, int(seed)
+
+
+def lease_duration_percentile(buckets: List[Tuple[int, int]], count: int, p: float) -> Optional[float]:
+    # the upper bound (in seconds) of the histogram bucket of the p-th percentile of the lease durations (i.e., an
+    # overestimation by at most one bucket) or None if there are no lease durations
+    cum = 0
+    for i, c in buckets:
+        cum += c
+        if cum >= p / 100 * count:
+            return round(lua_scripts.HISTOGRAM_BASE ** (i + 1), 2)
+    return None
+
+
+def lease_duration_percentiles(buckets: List[Tuple[int, int]], count: int,
+                               percentiles: Iterable[float]) -> Dict[str, Optional[float]]:
+    # the percentiles are keyed by their shortest representation, i.e., 95 and 95.0 are both '95'
+    return {f"{p:g}": lease_duration_percentile(buckets, count, p) for p in sorted({float(p) for p in percentiles})}
 
 
 class StudyCoordinatorBase(object):
-    __sync_lock: threading.Lock = None
     __rh: RedisHandler = None
+    __arh: AsyncRedisHandler = None
     __is: ImageServer = None
     __progress: redis.Redis = None
+    __aprogress: aioredis.Redis = None
 
     def __init__(self, typ: str, num_top_k_imgs: int, num_samples: int, in_prog_ttl: int):
         logger.info(f"Instantiating {typ.capitalize()}Study Coordinator")
@@ -70,175 +105,547 @@ class StudyCoordinatorBase(object):
 
         self.__is = ImageServer()
 
-        # lock object for critical sections
-        self.__sync_lock = threading.Lock()
-
         # get redis client
         self.__rh = RedisHandler()
         self.__progress = self.__rh.get_progress_client(typ)
+        self.__arh = AsyncRedisHandler()
+        self.__aprogress = self.__arh.get_progress_client(typ)
+
+        # the state transitions are done atomically by Lua scripts (instead of locks), which also works across
+        # processes. The scripts are registered for the sync and the async client
+        self.__scripts = {}
+        self.__async_scripts = {}
+        for name in ['LEASE', 'LEASE_BATCH', 'COMPLETE', 'RELEASE', 'REAP', 'NEW_RUN', 'DECAY_HISTOGRAM']:
+            self.__scripts[name] = self.__progress.register_script(getattr(lua_scripts, name))
+            self.__async_scripts[name] = self.__aprogress.register_script(getattr(lua_scripts, name))
 
         # common config for model rankings
         self.__init_data_root = conf.study_initialization.model_rankings.data_root
         self.__init_flush = conf.study_initialization.model_rankings.flush
         self.__init_shuffle = conf.study_initialization.model_rankings.shuffle
-
-        # setup expired watcher
-        self.expired_watcher = ThreadPoolExecutor(max_workers=1)
-        self.expired_watcher.submit(expired_handler, coordinator=self)
+        self.__sample_batch_size = conf.study_initialization.sample_batch_size
+        self.__reuse_samples = conf.study_initialization.reuse_samples
+        self.__virtual_samples = conf.study_initialization.virtual_samples
+        self.__max_lease_batch_size = conf.study_initialization.max_lease_batch_size
+        self.__max_wait = conf.study_initialization.long_poll.max_wait
+        self.__max_waiters = conf.study_initialization.long_poll.max_waiters
+        # number of clients of this process that are waiting for a sample (each blocks a connection)
+        self.__num_waiters = 0
+        self.__ttl_conf = conf.study_initialization.adaptive_ttl
+        self.__seed_rng = np.random.default_rng()
+
+        # the background jobs only run in the elected leader of all worker processes (see JobRunner). The reapers run
+        # in their own group because they hand off released samples to waiting clients and must not wait for the GC
+        self.__progress_history_len = conf.backend.jobs.progress_history_len
+        JobRunner().register(f"{typ.lower()}_lease_reaper", self.reap, conf.backend.jobs.lease_reap_interval,
+                             group='leases')
+        JobRunner().register(f"{typ.lower()}_progress_rollup", self.rollup_progress,
+                             conf.backend.jobs.progress_rollup_interval)
+        JobRunner().register(f"{typ.lower()}_sample_gc", self.collect_garbage, conf.backend.jobs.sample_gc_interval)
+        JobRunner().register(f"{typ.lower()}_lease_ttl", self.adapt_lease_ttl, conf.backend.jobs.lease_ttl_interval)
+
+        # state of the current garbage collection pass (see collect_garbage)
+        self.__gc_min_pass_interval = conf.backend.jobs.sample_gc_min_pass_interval
+        self.__gc_batches: Optional[Iterator[List[Tuple[bytes, str]]]] = None
+        # adds the samples of results that were stored by previous versions to the samples of the results
+        self.__gc_backfill: Optional[Iterator[int]] = None
+        self.__gc_last_pass = 0.
+        self.__gc_stats = {'scanned': 0, 'candidates': 0, 'deleted': 0}
 
         # set init state to todo
         self.__progress.set(Keys.INIT_STATE, InitState.TODO.value, nx=True)
 
+        self.__migrate_legacy_in_progress()
+
+    def __migrate_legacy_in_progress(self):
+        # the leases of the legacy IN_PROGRESS set cannot be migrated (their TTL shadow keys do not store the expiry
+        # timestamp) so they are given back to TODO
+        if self.__progress.exists(Keys.LEGACY_IN_PROGRESS):
+            pipe = self.__progress.pipeline(transaction=True)
+            pipe.sunionstore(Keys.TODO, Keys.TODO, Keys.LEGACY_IN_PROGRESS)
+            pipe.delete(Keys.LEGACY_IN_PROGRESS)
+            pipe.execute()
+            logger.warning(f"Moved the samples of the legacy {Keys.LEGACY_IN_PROGRESS} set back to {Keys.TODO}!")
+
     @abstractmethod
     def _generate_sample(self, mr: ModelRanking) -> BaseSample:
+        # generates (but does not store) the sample of the ModelRanking
         pass
 
+    def _generate_samples(self, mrs: List[ModelRanking], rng: Optional[np.random.Generator] = None) -> List[BaseSample]:
+        # subclasses can override this to share Redis round trips between the samples of a batch. Subclasses whose
+        # samples are random have to draw from rng if given (virtual samples have to be reproducible)
+        return [self._generate_sample(mr) for mr in mrs]
+
     def init_study(self):
-        # we wait a random amount of time here to support multi-processing (gunicorn spawns multiple processes) so
-        # only the instance that reads the init_flag first will init Redis! Otherwise it gets initialized multiple
-        # times
-        time.sleep(np.random.uniform(low=0.05, high=0.5))
+        # only one of the (gunicorn) worker processes initializes the study while the others wait until it's done
+        InitLock(f"{self.typ.lower()}_study").run_once(self.__init_study)
+        logger.info(f"{self.typ.upper()} Study already started! Current Progress: {self.current_progress()}")
+
+    def __init_study(self):
         init_state = self.__progress.get(Keys.INIT_STATE)
         if init_state is not None and int(init_state) == InitState.TODO.value:
             # set init state to in_progress
             self.__progress.set(Keys.INIT_STATE, InitState.IN_PROGRESS.value)
 
-            # init run count with 0
+            # init run count with 0 (the first run increments it)
             self.__set_run_count(0)
             # set init state to done
             self.__progress.set(Keys.INIT_STATE, InitState.DONE.value)
             logger.info(f"Successfully initialized {self.typ.upper()} Study")
 
             self.__start_new_run()
-        logger.info(f"{self.typ.upper()} Study already started! Current Progress: {self.current_progress()}")
 
     def __start_new_run(self):
+        # the TODO list of the next run is prepared in a separate set and swapped in atomically together with
+        # resetting IN_PROGRESS and DONE, so that the progress is never observed in an intermediate state
         self.__init_todo()
-        self.__init_done()
-        self.__init_in_progress()
-        self.__set_run_count(int(self.__current_run()) + 1)
+        prog = self.__run_script('NEW_RUN', Keys.TODO_NEXT_RUN, args=[self.in_prog_ttl])
+        self.__rh.invalidate_cached_samples()
 
-        logger.info(f"Successfully started {self.typ.upper()} Study Run  #{self.__current_run()}")
-        logger.info(f"Current {self.typ.upper()} Study Progress: {self.current_progress()}")
+        logger.info(f"Successfully started {self.typ.upper()} Study Run  #{prog['run']}")
+        logger.info(f"Current {self.typ.upper()} Study Progress: {prog}")
 
     def __init_todo(self):
-        # init to do set (initially contains all ModelRanking IDs)
-        mr_ids = self.__rh.list_all_model_ranking_ids()
-        if len(mr_ids) == 0:
+        # init to do set of the next run (initially contains all ModelRanking IDs)
+        if self.__rh.num_model_rankings() == 0:
             logger.error("ModelRankings not initialized!")
             raise RuntimeError("ModelRankings not initialized!")
 
-        self.__progress.delete(Keys.TODO)
-
-        # generate num_samples Samples from ModelRankings
-        samples = [self._generate_sample(mr) for mr in self.__rh.list_model_rankings(num=self.num_samples)]
+        start = time.perf_counter()
+        self.__progress.delete(Keys.TODO_NEXT_RUN)
 
-        # add their reverences (IDs) to todo
-        self.__progress.sadd(Keys.TODO, *[rs.id for rs in samples])
-
-        if self.__progress.scard(Keys.TODO) != len(samples):
+        # generate num_samples Samples from ModelRankings in batches. The samples of a batch are stored and referenced
+        # in todo with one pipeline each instead of one round trip per sample. If samples are reused, only the
+        # ModelRankings without a sample (of a previous run) get a new one. Virtual samples are only referenced by
+        # their ID (and built when they are leased) so that only the IDs of the ModelRankings have to be loaded
+        num_samples, num_reused = 0, 0
+        if self.__virtual_samples:
+            mrs = islice(self.__rh.iter_model_ranking_ids(), self.num_samples)
+        else:
+            mrs = islice(self.__rh.iter_model_rankings(), self.num_samples)
+        for batch in iter(lambda: list(islice(mrs, self.__sample_batch_size)), []):
+            mr_ids = batch if self.__virtual_samples else [mr.id for mr in batch]
+            sample_ids = [None] * len(batch)
+            if self.__reuse_samples:
+                sample_ids = self.__rh.get_reusable_sample_ids(self.typ, mr_ids)
+            missing = [i for i, sid in enumerate(sample_ids) if sid is None]
+
+            if self.__virtual_samples:
+                seeds = self.__seed_rng.integers(2 ** 31, size=len(missing)).tolist()
+                new_ids = [virtual_sample_id(mr_ids[i], seed) for i, seed in zip(missing, seeds)]
+            else:
+                # the ModelRankings were just loaded so the samples do not have to check if they exist
+                with known_model_rankings([mr_ids[i] for i in missing]):
+                    samples = self._generate_samples([batch[i] for i in missing])
+                if len(samples) > 0:
+                    self.__rh.store_samples(samples)
+                new_ids = [s.id for s in samples]
+
+            reused = [sid for sid in sample_ids if sid is not None]
+            self.__progress.sadd(Keys.TODO_NEXT_RUN, *new_ids, *reused)
+            num_samples += len(batch)
+            num_reused += len(reused)
+
+        if self.__progress.scard(Keys.TODO_NEXT_RUN) != num_samples:
             logger.error("Error while initializing ToDo List!")
             raise RuntimeError("Error while initializing ToDo List!")
 
-        logger.info(f"Successfully initialized {Keys.TODO} List!")
-        logger.info(f"Current Progress: {self.current_progress()}")
-
-    def __init_done(self):
-        # init done set (empty set)
-        self.__progress.delete(Keys.DONE)
-        logger.info(f"Successfully initialized {Keys.DONE} List!")
+        duration = time.perf_counter() - start
+        logger.info(f"Successfully initialized {Keys.TODO_NEXT_RUN} List with {num_samples} "
+                    f"{self.typ.capitalize()}Samples in {duration:.2f}s ({num_samples / max(duration, 1e-9):.0f} "
+                    f"samples/s)!")
+        if self.__reuse_samples:
+            logger.info(f"Reused {num_reused} {self.typ.capitalize()}Samples of previous runs")
+
+    def collect_garbage(self) -> Dict[str, int]:
+        # deletes the samples that are referenced by neither the progress of the current and the next run (TODO,
+        # IN_PROGRESS, DONE, TODO_NEXT_RUN), nor a result, nor the reusable samples, nor MTurk (HITs and feedback).
+        # A pass SCANs the sample DB in batches, one batch per call so that the job never blocks for long. Since
+        # samples are stored before they are referenced, a sample is only deleted if it was already unreferenced in
+        # the previous pass (at least sample_gc_min_pass_interval seconds ago). Nothing gets deleted until the samples
+        # of all results stored by previous versions are tracked, which is backfilled one batch of results per call
+        if not self.__backfill_samples_of_results():
+            return self.__gc_stats
+        if self.__gc_batches is None:
+            if time.time() - self.__gc_last_pass < self.__gc_min_pass_interval:
+                return self.__gc_stats
+            self.__gc_last_pass = time.time()
+            self.__gc_batches = self.__rh.iter_sample_batches(self.typ)
+            self.__gc_stats = {'scanned': 0, 'candidates': 0, 'deleted': 0}
+            self.__progress.delete(Keys.GC_CANDIDATES_NEXT)
+
+        batch = next(self.__gc_batches, None)
+        if batch is None:
+            self.__finish_gc_pass()
+            return self.__gc_stats
+
+        candidates = self.__unreferenced(batch)
+        if len(candidates) > 0:
+            pipe = self.__progress.pipeline(transaction=False)
+            for sid in candidates:
+                pipe.sismember(Keys.GC_CANDIDATES, sid)
+            seen = pipe.execute()
+            garbage = [sid for sid, was_candidate in zip(candidates, seen) if was_candidate]
+            new = [sid for sid, was_candidate in zip(candidates, seen) if not was_candidate]
+            if len(garbage) > 0:
+                self.__gc_stats['deleted'] += self.__rh.delete_samples(self.typ, garbage)
+            if len(new) > 0:
+                self.__progress.sadd(Keys.GC_CANDIDATES_NEXT, *new)
+            self.__gc_stats['candidates'] += len(new)
+        self.__gc_stats['scanned'] += len(batch)
+        return self.__gc_stats
+
+    def __backfill_samples_of_results(self) -> bool:
+        # returns whether the samples of all results are tracked
+        if self.__rh.samples_of_results_complete(self.typ):
+            return True
+        if self.__gc_backfill is None:
+            logger.info(f"Backfilling the {self.typ.capitalize()}Samples referenced by results")
+            self.__gc_backfill = self.__rh.backfill_samples_of_results(self.typ)
+        if next(self.__gc_backfill, None) is not None:
+            return False
+        self.__rh.mark_samples_of_results_complete(self.typ)
+        self.__gc_backfill = None
+        logger.info(f"Finished backfilling the {self.typ.capitalize()}Samples referenced by results")
+        return True
+
+    def __unreferenced(self, samples: List[Tuple[bytes, str]]) -> List[bytes]:
+        referenced = self.__rh.samples_referenced_by_results_or_mrs(self.typ, samples)
+        sample_ids = [sid for (sid, _), ref in zip(samples, referenced) if not ref]
+        if len(sample_ids) == 0:
+            return []
+        pipe = self.__progress.pipeline(transaction=False)
+        for sid in sample_ids:
+            pipe.sismember(Keys.TODO, sid)
+            pipe.sismember(Keys.TODO_NEXT_RUN, sid)
+            pipe.sismember(Keys.DONE, sid)
+            pipe.zscore(Keys.IN_PROGRESS, sid)
+        refs = pipe.execute()
+        sample_ids = [sid for i, sid in enumerate(sample_ids) if not any(refs[4 * i:4 * i + 4])]
+        if len(sample_ids) == 0:
+            return []
+        in_mturk = self.__rh.samples_referenced_by_mturk(sample_ids)
+        return [sid for sid, referenced in zip(sample_ids, in_mturk) if not referenced]
+
+    def __finish_gc_pass(self):
+        # the candidates of this pass become the candidates of the next pass
+        if self.__progress.exists(Keys.GC_CANDIDATES_NEXT):
+            self.__progress.rename(Keys.GC_CANDIDATES_NEXT, Keys.GC_CANDIDATES)
+        else:
+            self.__progress.delete(Keys.GC_CANDIDATES)
+        self.__gc_batches = None
+        logger.info(f"Finished {self.typ.upper()} Sample garbage collection pass: {self.__gc_stats}")
 
-    def __init_in_progress(self):
-        # remove all in-progress ids
-        in_prog_ids = self.__progress.keys(f"{Keys.IN_PROGRESS}*")
-        if len(in_prog_ids) > 0:
-            self.__progress.delete(*in_prog_ids)
-        logger.info(f"Successfully initialized {Keys.IN_PROGRESS} List!")
+    @staticmethod
+    def __script_args(extra_keys: List[Keys], args: Optional[List]) -> Dict[str, List]:
+        keys = [Keys.TODO.value, Keys.IN_PROGRESS.value, Keys.DONE.value, Keys.RUN_CNT.value, Keys.WAITERS.value,
+                Keys.LEASES.value, Keys.LEASE_STATS.value]
+        return {'keys': keys + [k.value for k in extra_keys], 'args': args or []}
+
+    def __run_script(self, name: str, *extra_keys: Keys, args: Optional[List] = None):
+        resp = self.__scripts[name](**self.__script_args(list(extra_keys), args))
+        return self.__parse_script_response(name, resp)
+
+    async def __run_script_async(self, name: str, *extra_keys: Keys, args: Optional[List] = None):
+        resp = await self.__async_scripts[name](**self.__script_args(list(extra_keys), args))
+        return self.__parse_script_response(name, resp)
+
+    def __parse_script_response(self, name: str, resp):
+        if name == 'LEASE':
+            # either the shortest TTL (if TODO is empty) or the leased sample id and the progress
+            if isinstance(resp, int):
+                return None, resp
+            return resp[0], self.__progress_dict(*resp[1:])
+        elif name == 'LEASE_BATCH':
+            # either the shortest TTL (if TODO is empty) or the expiry timestamp, the TTL and the leased sample ids
+            if isinstance(resp, int):
+                return None, resp
+            return (float(resp[0]), resp[1], resp[2]), self.__progress_dict(*resp[3:])
+        elif name in ['REAP', 'DECAY_HISTOGRAM']:
+            return resp
+        return None if resp is None else self.__progress_dict(*resp)
 
-    # noinspection PyUnresolvedReferences,PyProtectedMember
     def shutdown(self):
+        # the background jobs are stopped by the JobRunner
         logger.info(f'Shutting down {self.typ.capitalize()}StudyCoordinator!')
-        # clear remaining futures
-        # https://gist.github.com/clchiou/f2608cbe54403edb0b13
-        self.expired_watcher._threads.clear()
-        concurrent.futures.thread._threads_queues.clear()
-        self.expired_watcher.shutdown(wait=False)
 
     def initialization_is_done(self) -> bool:
         init_state = self.__progress.get(Keys.INIT_STATE)
         return init_state is not None and int(init_state) == InitState.DONE.value
 
     def next(self) -> Union[BaseSample, int]:
-        with self.__sync_lock:
-            # get random sample (id) from to do list
-            sample_id = self.__progress.srandmember(Keys.TODO)
+        # lease a random sample (id), i.e., move it from TODO to IN_PROGRESS
+        sample_id, prog = self.__run_script('LEASE', args=[self.in_prog_ttl])
+        if sample_id is None:
+            # the to do list is empty so we return the shortest TTL of the in_progess ist
+            return prog
+        self.__log_lease(sample_id, prog)
+        # load and return the actual sample per ID
+        return self.__load_leased(sample_id)
+
+    async def next_async(self, wait: Optional[float] = None) -> Union[BaseSample, int]:
+        # same as next() but without blocking the event loop while waiting for Redis. If TODO is empty and wait is
+        # given, the request waits (at most wait seconds) until a sample is handed off to it (see __wait)
+        sample_id, prog = await self.__lease_or_wait(wait)
+        if sample_id is None:
+            return prog
+        self.__log_lease(sample_id, prog)
+        return await self.__load_leased_async(sample_id)
+
+    async def __lease_or_wait(self, wait: Optional[float]) -> Tuple[Optional[bytes], Union[Dict[str, int], int]]:
+        wait = 0 if wait is None else min(wait, self.__max_wait)
+        if wait <= 0 or self.__num_waiters >= self.__max_waiters:
+            return await self.__run_script_async('LEASE', args=[self.in_prog_ttl])
+
+        # the ticket is queued atomically with the failed lease so that no hand-off can be missed in between
+        ticket = uuid()
+        sample_id, prog = await self.__run_script_async('LEASE', args=[self.in_prog_ttl, ticket, wait])
+        if sample_id is None:
+            sample_id = await self.__wait(ticket, wait)
             if sample_id is None:
-                # the to do list is empty so we return the shortest TTL of the in_progess ist
-                return self.__shortest_ttl()
+                # the shortest TTL after the timeout (unless a sample was added to TODO in the meantime)
+                return await self.__run_script_async('LEASE', args=[self.in_prog_ttl])
+            prog = await self.current_progress_async()
+        return sample_id, prog
+
+    async def __wait(self, ticket: str, timeout: float) -> Optional[bytes]:
+        # waits until a sample is handed off to the ticket (in FIFO order of the tickets) or the timeout is reached.
+        # The waiting clients are woken up by the scripts that move samples back to TODO (REAP, RELEASE, NEW_RUN)
+        # instead of polling. The ticket is queued with the deadline of the timeout (on the clock of Redis), after which
+        # it is skipped by the hand-off. Thus, the ticket does not have to be dequeued and tickets of crashed processes
+        # only get a sample (that is reaped after its lease expired) until their deadline
+        wakeup = Keys.WAITERS.value + b':' + ticket.encode('utf-8')
+        self.__num_waiters += 1
+        try:
+            resp = await self.__aprogress.blpop(wakeup, timeout=timeout)
+            if resp is not None:
+                return resp[1]
+            # the timeout of BLPOP and the deadline of the ticket are not synchronized, so a sample might have been
+            # handed off right before the deadline
+            return await self.__aprogress.lpop(wakeup)
+        finally:
+            self.__num_waiters -= 1
+
+    def next_batch(self, num: int) -> Union[List[Lease], int]:
+        # lease up to num random samples at once (with a single round trip) so that clients can prefetch samples
+        leased, prog = self.__run_script('LEASE_BATCH', args=[self.in_prog_ttl, self.__lease_batch_size(num)])
+        if leased is None:
+            return prog
+        expires_at, ttl, sample_ids = leased
+        self.__log_lease(sample_ids, prog)
+        return self.__leases([self.__load_leased(sid) for sid in sample_ids], expires_at, ttl)
+
+    async def next_batch_async(self, num: int, wait: Optional[float] = None) -> Union[List[Lease], int]:
+        # same as next_batch() but without blocking the event loop. The samples are loaded concurrently. If TODO is
+        # empty and wait is given, the request waits for a single sample like next_async
+        leased, prog = await self.__run_script_async('LEASE_BATCH',
+                                                     args=[self.in_prog_ttl, self.__lease_batch_size(num)])
+        if leased is None and wait is not None:
+            sample_id, prog = await self.__lease_or_wait(wait)
+            if sample_id is not None:
+                pipe = self.__aprogress.pipeline(transaction=False)
+                pipe.zscore(Keys.IN_PROGRESS, sample_id)
+                pipe.hget(Keys.LEASE_STATS, 'ttl')
+                expires_at, ttl = await pipe.execute()
+                leased = float(expires_at or 0), int(ttl or self.in_prog_ttl), [sample_id]
+        if leased is None:
+            return prog
+        expires_at, ttl, sample_ids = leased
+        self.__log_lease(sample_ids, prog)
+        samples = await asyncio.gather(*[self.__load_leased_async(sid) for sid in sample_ids])
+        return self.__leases(samples, expires_at, ttl)
+
+    def __lease_batch_size(self, num: int) -> int:
+        return max(1, min(num, self.__max_lease_batch_size))
+
+    @staticmethod
+    def __leases(samples: List[Optional[BaseSample]], expires_at: float, ttl: int) -> List[Lease]:
+        # samples that cannot be loaded are skipped (their leases expire and they are reaped)
+        return [Lease[type(sample)](sample=sample, expires_at=expires_at, ttl=ttl)
+                for sample in samples if sample is not None]
+
+    def __load_leased(self, sample_id: bytes) -> Optional[BaseSample]:
+        # virtual samples are materialized when leased the first time
+        sample_id = str(sample_id, encoding='utf-8')
+        if self.__is_virtual(sample_id) and not self.__rh.typed_sample_exists(sample_id, self.typ):
+            return self.__materialize(sample_id)
+        return self.__rh.load_sample(sample_id)
+
+    async def __load_leased_async(self, sample_id: bytes) -> Optional[BaseSample]:
+        sample_id = str(sample_id, encoding='utf-8')
+        if self.__is_virtual(sample_id) and not await self.__arh.typed_sample_exists(sample_id, self.typ):
+            # building the sample (e.g., drawing random images) must not block the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, self.__materialize, sample_id)
+        return await self.__arh.load_sample(sample_id)
 
-            # move to in_progress list
-            self.__progress.smove(Keys.TODO, Keys.IN_PROGRESS, sample_id)
+    @staticmethod
+    def __is_virtual(sample_id: str) -> bool:
+        # independent of the config since virtual samples of a run can still be leased after the mode was switched off
+        return parse_virtual_sample_id(sample_id) is not None
+
+    def __materialize(self, sample_id: str) -> Optional[BaseSample]:
+        # builds the sample of a virtual sample ID from its ModelRanking with an RNG seeded by its seed and stores it
+        mr_id, seed = parse_virtual_sample_id(sample_id)
+        mr = self.__rh.load_model_ranking(mr_id)
+        if mr is None:
+            logger.error(f"Cannot materialize {self.typ.capitalize()}Sample {sample_id} since ModelRanking {mr_id} "
+                         f"does not exist!")
+            return None
+        with known_model_rankings([mr.id]):
+            sample = self._generate_samples([mr], rng=np.random.default_rng(seed))[0]
+        sample.id = sample_id
+        self.__rh.store_samples([sample])
+        logger.debug(f"Materialized {self.typ.capitalize()}Sample {sample_id}")
+        return sample
+
+    @staticmethod
+    def __log_lease(sample_id: Union[bytes, List[bytes]], prog: Dict[str, int]):
+        if isinstance(sample_id, list):
+            logger.info(f"Moved {len(sample_id)} Samples {sample_id} from TODO to IN_PROGRESS!")
+        else:
             logger.info(f"Moved Sample {sample_id} from TODO to IN_PROGRESS!")
-            logger.info(f"Current Progress: {self.current_progress()}")
-            # create shadow element with TTL
-            self.__progress.set(Keys.TTL.value + sample_id, "ttl_proxy", ex=self.in_prog_ttl)
-            # load and return the actual sample per ID
-            return self.__rh.load_sample(sample_id)
-
-    def __shortest_ttl(self) -> int:
-        in_prog_ids = self.__progress.smembers(Keys.IN_PROGRESS)
-        ttls = sorted([self.__progress.ttl(Keys.TTL.value + sample_id) for sample_id in in_prog_ids], reverse=True)
-        return ttls[0]
-
-    def expire(self, sample_ids: List[str]):
-        with self.__sync_lock:
-            # move the from in_progress back to todo
-            for sample_id in sample_ids:
-                self.__progress.smove(Keys.IN_PROGRESS, Keys.TODO, sample_id)
-                logger.info(f"Sample {sample_id} expired in IN_PROGRESS and moved back to TODO!")
-                logger.info(f"Current Progress: {self.current_progress()}")
+        logger.info(f"Current Progress: {prog}")
+
+    def reap(self, max_num: int = 1000) -> List[bytes]:
+        # move the samples with an expired lease from in_progress back to todo
+        expired = self.__run_script('REAP', args=[max_num, self.in_prog_ttl])
+        for sample_id in expired:
+            logger.info(f"Sample {sample_id} expired in IN_PROGRESS and moved back to TODO!")
+        return expired
+
+    def rollup_progress(self) -> Dict[str, Union[int, float]]:
+        # store a snapshot of the current progress in the (capped) progress history
+        snapshot = {'timestamp': time.time(), **self.current_progress()}
+        pipe = self.__progress.pipeline(transaction=True)
+        pipe.lpush(Keys.PROGRESS_HISTORY, json.dumps(snapshot))
+        pipe.ltrim(Keys.PROGRESS_HISTORY, 0, self.__progress_history_len - 1)
+        pipe.execute()
+        return snapshot
+
+    def progress_history(self, num: int = 100) -> List[Dict[str, Union[int, float]]]:
+        return [json.loads(s) for s in self.__progress.lrange(Keys.PROGRESS_HISTORY, 0, num - 1)]
+
+    def __load_lease_stats(self) -> Tuple[Dict[str, int], List[Tuple[int, int]]]:
+        # the fields of the lease statistics and the (index, count) of every bucket of the histogram
+        stats = {str(k, encoding='utf-8'): int(v) for k, v in self.__progress.hgetall(Keys.LEASE_STATS).items()}
+        return stats, sorted((int(k[1:]), v) for k, v in stats.items() if k.startswith('b'))
+
+    def lease_stats(self) -> Dict:
+        # the distribution of the lease durations (from lease to submission) and the lease TTL derived from it
+        stats, buckets = self.__load_lease_stats()
+        count = sum(c for _, c in buckets)
+        percentiles = [50, 90, 95, 99, self.__ttl_conf.percentile]
+        return {
+            'ttl': stats.get('ttl', self.in_prog_ttl),
+            'configured_ttl': self.in_prog_ttl,
+            'adaptive': self.__ttl_conf.enabled,
+            'count': count,
+            'completed': stats.get('completed', 0),
+            'rejected': stats.get('rejected', 0),
+            'late': stats.get('late', 0),
+            'expired': stats.get('expired', 0),
+            'percentiles': lease_duration_percentiles(buckets, count, percentiles),
+            # the upper bound (in seconds) and count of every bucket
+            'histogram': [{'le': round(lua_scripts.HISTOGRAM_BASE ** (i + 1), 2), 'count': c} for i, c in buckets]
+        }
+
+    def adapt_lease_ttl(self) -> int:
+        # sets the lease TTL to the configured percentile of the lease durations (times a margin) so that abandoned
+        # samples are reaped early while most annotators can still submit in time. The histogram is halved if it
+        # exceeds max_count so that it follows changes of the lease durations
+        stats, buckets = self.__load_lease_stats()
+        count = sum(c for _, c in buckets)
+        if count > self.__ttl_conf.max_count:
+            self.__run_script('DECAY_HISTOGRAM')
+
+        p = lease_duration_percentile(buckets, count, float(self.__ttl_conf.percentile))
+        if not self.__ttl_conf.enabled or count < self.__ttl_conf.min_samples or p is None:
+            self.__progress.hdel(Keys.LEASE_STATS, 'ttl')
+            return self.in_prog_ttl
+
+        ttl = int(min(max(math.ceil(p * self.__ttl_conf.margin), self.__ttl_conf.min_ttl), self.__ttl_conf.max_ttl))
+        current = stats.get('ttl', self.in_prog_ttl)
+        if ttl != current:
+            logger.info(f"Adapted the lease TTL of the {self.typ.upper()} Study from {current}s to {ttl}s "
+                        f"({self.__ttl_conf.percentile}th percentile of {count} lease durations: {p}s)")
+        self.__progress.hset(Keys.LEASE_STATS, 'ttl', ttl)
+        return ttl
 
     def submit(self, res: BaseResult) -> Optional[str]:
-        with self.__sync_lock:
-            # TODO do we want to accept this or raise an exception?!
-            if self.typ != res.get_type():
-                logger.warning(
-                    f"Submitting {res.get_type().capitalize()}Result to {self.typ.capitalize()}StudyCoordinator")
-
-            logger.info(f"{self.typ.capitalize()}Result {res.id} submission received!")
-
-            # if the Result is NOT for MTurk, check if the Sample is already expired in in_prog set
-            sample_id = res.sample_id.encode('utf-8')
-            if res.mt_params is None and sample_id not in self.__progress.smembers(Keys.IN_PROGRESS):
-                logger.warning(
-                    f"{self.typ.capitalize()}Sample '{sample_id}' referenced by {self.typ.capitalize()}Result"
-                    f"'{res.id}' already expired in IN_PROGRESS! Submission Rejected"
-                )
+        self.__log_submission(res)
+
+        # only coordinate the study if the result is NOT for MTurk
+        if res.mt_params is None:
+            # move referenced Sample to DONE if it is not already expired in IN_PROGRESS
+            prog = self.__run_script('COMPLETE', args=self.__complete_args(res))
+            if prog is None:
+                self.__log_rejection(res)
                 return None
 
-            # store the Result
+            # store the Result (and revert the completion if that fails)
             if self.__rh.store_result(res) is None:
+                self.__run_script('RELEASE', args=self.__release_args(res))
                 return None
+            self.__log_completion(res, prog)
 
-            # only coordinate the study if the result is NOT for MTurk
-            if res.mt_params is None:
-                # reference the Result in the current run results
-                self.__reference_in_current_run_results(res)
-                # move referenced Sample to DONE
-                self.__progress.smove(Keys.IN_PROGRESS, Keys.DONE, sample_id)
-                logger.info(f"Moved {self.typ.capitalize()}Sample {sample_id} from IN_PROGRESS to DONE")
-                prog = self.current_progress()
-                logger.info(f"Current Progress: {prog}")
+            # if this was the last remaining RankingSample, we start a new study run
+            if self.__study_run_finished(prog):
+                self.__start_new_run()
+        elif self.__rh.store_result(res) is None:
+            return None
 
-                # if this was the last remaining RankingSample, we start a new study run
-                if self.__study_run_finished():
-                    self.__start_new_run()
+        return res.id
+
+    async def submit_async(self, res: BaseResult) -> Optional[str]:
+        # same as submit() but without blocking the event loop while waiting for Redis
+        self.__log_submission(res)
+
+        if res.mt_params is None:
+            prog = await self.__run_script_async('COMPLETE', args=self.__complete_args(res))
+            if prog is None:
+                self.__log_rejection(res)
+                return None
+
+            if await self.__arh.store_result(res) is None:
+                await self.__run_script_async('RELEASE', args=self.__release_args(res))
+                return None
+            self.__log_completion(res, prog)
+
+            # starting a new run generates all samples, which must not block the event loop
+            if self.__study_run_finished(prog):
+                await asyncio.get_event_loop().run_in_executor(None, self.__start_new_run)
+        elif await self.__arh.store_result(res) is None:
+            return None
 
         return res.id
 
-    def __reference_in_current_run_results(self, res: BaseSample):
-        self.__progress.sadd(self.__current_run_results_key(), res.id)
-        logger.info(f"Successfully referenced RankingResult {res.id} in results of current run {self.__current_run()}!")
+    @staticmethod
+    def __complete_args(res: BaseResult) -> List:
+        return [res.sample_id, Keys.RUN_RESULTS.value, res.id]
+
+    def __release_args(self, res: BaseResult) -> List:
+        return [res.sample_id, Keys.RUN_RESULTS.value, res.id, self.in_prog_ttl]
+
+    def __log_submission(self, res: BaseResult):
+        # TODO do we want to accept this or raise an exception?!
+        if self.typ != res.get_type():
+            logger.warning(
+                f"Submitting {res.get_type().capitalize()}Result to {self.typ.capitalize()}StudyCoordinator")
+
+        logger.info(f"{self.typ.capitalize()}Result {res.id} submission received!")
+
+    def __log_rejection(self, res: BaseResult):
+        logger.warning(
+            f"{self.typ.capitalize()}Sample '{res.sample_id}' referenced by {self.typ.capitalize()}Result"
+            f"'{res.id}' already expired in IN_PROGRESS! Submission Rejected"
+        )
+
+    def __log_completion(self, res: BaseResult, prog: Dict[str, int]):
+        logger.info(f"Successfully referenced {self.typ.capitalize()}Result {res.id} in results of current run "
+                    f"{prog['run']}!")
+        logger.info(f"Moved {self.typ.capitalize()}Sample {res.sample_id} from IN_PROGRESS to DONE")
+        logger.info(f"Current Progress: {prog}")
 
     # TODO remove this ?!
     # def __reset_previous_results(self):
@@ -252,39 +659,34 @@ class StudyCoordinatorBase(object):
     def __set_run_count(self, run_cnt: int = 1):
         self.__progress.set(Keys.RUN_CNT, run_cnt)
 
-    def __current_run_results_key(self) -> str:
-        return self.__run_results_key(self.__current_run())
-
-    @staticmethod
-    def __run_results_key(run_cnt: int) -> str:
-        return f"{Keys.RUN_RESULTS}{run_cnt}"
-
-    def __num_todo(self) -> int:
-        return self.__progress.scard(Keys.TODO)
-
-    def __num_done(self) -> int:
-        return self.__progress.scard(Keys.DONE)
+    def current_progress(self) -> Dict[str, int]:
+        return self.__progress_dict(*self.__progress_pipeline(self.__progress).execute())
 
-    def __num_in_progress(self) -> int:
-        return self.__progress.scard(Keys.IN_PROGRESS)
+    async def current_progress_async(self) -> Dict[str, int]:
+        return self.__progress_dict(*await self.__progress_pipeline(self.__aprogress).execute())
 
-    def __current_run(self) -> int:
-        return self.__progress.get(Keys.RUN_CNT)
+    @staticmethod
+    def __progress_pipeline(client: Union[redis.Redis, aioredis.Redis]):
+        pipe = client.pipeline(transaction=False)
+        pipe.scard(Keys.TODO)
+        pipe.zcard(Keys.IN_PROGRESS)
+        pipe.scard(Keys.DONE)
+        pipe.get(Keys.RUN_CNT)
+        return pipe
 
-    def current_progress(self) -> Dict[str, int]:
-        n_todo = self.__num_todo()
-        n_in_prog = self.__num_in_progress()
-        n_done = self.__num_done()
+    @staticmethod
+    def __progress_dict(n_todo: int, n_in_prog: int, n_done: int, run: Optional[bytes]) -> Dict[str, int]:
         return {
             'num_todo': n_todo,
             'num_in_progress': n_in_prog,
             'num_done': n_done,
             'num_total': n_todo + n_in_prog + n_done,
-            'run': self.__current_run()
+            'run': int(run or 0)
         }
 
-    def __study_run_finished(self) -> bool:
-        prog = self.current_progress()
+    def __study_run_finished(self, prog: Optional[Dict[str, int]] = None) -> bool:
+        if prog is None:
+            prog = self.current_progress()
         if prog['num_todo'] == prog['num_in_progress'] == 0 and prog['num_done'] == prog['num_total']:
             return True
         elif (prog['num_todo'] == prog['num_in_progress'] == 0 and prog['num_done'] != prog['num_total']) or \
@@ -0,0 +1,78 @@
+import argparse
+import random
+import time
+from typing import List, Type, Dict
+
+from loguru import logger
+from pydantic import BaseModel
+from shortuuid import uuid
+
+from backend.db.codec import DocumentCodec, CODECS
+import models
+from models import ModelRanking, RankingSample, RankingResult
+
+
+def synthetic_documents(num: int, top_k: int) -> Dict[str, List[BaseModel]]:
+    image_ids = [f"{random.randint(10 ** 11, 10 ** 12)}" for _ in range(top_k * 100)]
+    mrs, samples, results = [], [], []
+    for _ in range(num):
+        ids = random.sample(image_ids, top_k)
+        query = ' '.join(uuid()[:random.randint(3, 8)] for _ in range(random.randint(8, 20)))
+        mrs.append(ModelRanking(ds_id=uuid(), query=query, top_k_image_ids=ids, opts={'score': random.random()}))
+        samples.append(RankingSample(mr_id=mrs[-1].id, query=query, image_ids=ids[:10]))
+        results.append(RankingResult(sample_id=samples[-1].id, ranking=ids[:5], irrelevant=ids[5:10]))
+    return {'ModelRanking': mrs, 'RankingSample': samples, 'RankingResult': results}
+
+
+def redis_documents(num: int) -> Dict[str, List[BaseModel]]:
+    from backend.db import RedisHandler
+    rh = RedisHandler()
+    return {'ModelRanking': rh.list_model_rankings(num),
+            'RankingSample': rh.list_ranking_samples(num),
+            'RankingResult': rh.list_ranking_results()[:num]}
+
+
+def benchmark(codec: DocumentCodec, model: Type[BaseModel], docs: List[BaseModel]) -> Dict[str, float]:
+    start = time.perf_counter()
+    encoded = [codec.encode(doc) for doc in docs]
+    enc = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for raw in encoded:
+        codec.parse(model, raw)
+    dec = time.perf_counter() - start
+
+    return {'bytes/key': sum(len(raw) for raw in encoded) / len(encoded),
+            'encode µs/key': enc / len(docs) * 1e6,
+            'decode µs/key': dec / len(docs) * 1e6}
+
+
+def run_benchmark(num: int = 10000, top_k: int = 100, from_redis: bool = False, zstd_level: int = 3):
+    # only the codecs are benchmarked, i.e., the validators must not look up the referenced documents in Redis
+    models.__validation_disabled__ = True
+    docs = redis_documents(num) if from_redis else synthetic_documents(num, top_k)
+    doc_models = {'ModelRanking': ModelRanking, 'RankingSample': RankingSample, 'RankingResult': RankingResult}
+    for name, model_docs in docs.items():
+        if len(model_docs) == 0:
+            logger.warning(f"No {name} documents available!")
+            continue
+        for codec in CODECS:
+            stats = benchmark(DocumentCodec(codec, zstd_level), doc_models[name], model_docs)
+            logger.info(f"{name:<14} {codec:<13} " + ' | '.join(f"{k}: {v:10.2f}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num', type=int, default=10000, help='Number of documents per document type')
+    parser.add_argument('--top_k', type=int, default=100,
+                        help='Number of image IDs of the synthetic ModelRankings')
+    parser.add_argument('--from_redis', action='store_true', default=False,
+                        help='If True, the documents are loaded from Redis instead of being generated')
+    parser.add_argument('--zstd_level', type=int, default=3, help='Compression level of the msgpack_zstd codec')
+
+    opts = parser.parse_args()
+
+    run_benchmark(opts.num,
+                  opts.top_k,
+                  opts.from_redis,
+                  opts.zstd_level)
@@ -2,6 +2,8 @@ import json
 import multiprocessing
 import os
 
+from shortuuid import uuid
+
 from config import conf
 
 workers_per_core_str = os.getenv("WORKERS_PER_CORE", "1")
@@ -66,4 +68,10 @@ log_data = {
     "host": host,
     "port": port,
 }
-print(json.dumps(log_data))
\ No newline at end of file
+print(json.dumps(log_data))
+
+
+def on_starting(server):
+    # the workers inherit the epoch of this start of the server (see backend.jobs.init_lock.STARTUP_EPOCH). Workers that
+    # are restarted later share it as well, whereas restarting the server starts a new epoch
+    os.environ['STARTUP_EPOCH'] = uuid()
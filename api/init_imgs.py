@@ -1,9 +1,10 @@
 import argparse
 import glob
+import hashlib
 import os
-import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Tuple
 
 import numpy as np
 from PIL import Image
@@ -11,6 +12,9 @@ from loguru import logger
 from tqdm import tqdm
 
 LOCK_FILE = '__lock_file__'
+# 64-bit perceptual hashes of the images (names of the image files without extension and the packed hashes)
+PHASH_FILE = 'phashes.npz'
+THUMBNAIL_INFIX = '_thumbnail'
 
 
 def convert_to_webp(pth: str,
@@ -26,13 +30,57 @@ def convert_to_webp(pth: str,
             im.save(f + ".webp", "WEBP", quality=webp_quality, lossless=True, method=6)
         if thumbnails:
             im.thumbnail((thumbnail_size, thumbnail_size))
-            im.save(f + "_thumbnail.webp", "WEBP", quality=85, lossless=True, method=6)
+            im.save(f + THUMBNAIL_INFIX + ".webp", "WEBP", quality=85, lossless=True, method=6)
     if remove_original:
         os.remove(pth)
 
     return
 
 
+def perceptual_hash(pth: str) -> int:
+    # difference hash (dHash): one bit per horizontally adjacent pixel pair of the 9x8 grayscale image, which is
+    # robust against rescaling and recompression of the image
+    with Image.open(pth) as im:
+        px = np.asarray(im.convert('L').resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return int(np.packbits(px[:, 1:] > px[:, :-1]).view('>u8')[0])
+
+
+def load_perceptual_hashes(image_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    pth = os.path.join(image_dir, PHASH_FILE)
+    if not os.path.isfile(pth):
+        return np.empty(0, dtype=str), np.empty(0, dtype=np.uint64)
+    with np.load(pth) as phashes:
+        return phashes['names'], phashes['hashes']
+
+
+def update_perceptual_hashes(image_dir: str, n_workers: int = 8):
+    # computes the hashes of all images (but not of the thumbnails) that have no hash yet
+    names, hashes = load_perceptual_hashes(image_dir)
+    known = set(names.tolist())
+    imgs = {}
+    for ext in ['webp', 'png', 'jpg', 'jpeg']:
+        for pth in glob.glob(f"{image_dir}/*.{ext}") + glob.glob(f"{image_dir}/*.{ext.upper()}"):
+            name = os.path.splitext(os.path.basename(pth))[0]
+            if not name.endswith(THUMBNAIL_INFIX) and name not in known:
+                imgs[name] = pth
+    if len(imgs) == 0:
+        logger.info("All images already have a perceptual hash!")
+        return
+
+    logger.info(f"Computing the perceptual hashes of {len(imgs)} images!")
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        new_hashes = list(tqdm(executor.map(perceptual_hash, imgs.values()), total=len(imgs)))
+
+    names = np.concatenate([names, np.array(list(imgs.keys()), dtype=str)])
+    hashes = np.concatenate([hashes, np.array(new_hashes, dtype=np.uint64)])
+    # write to a temporary file first so that readers never see a partially written file
+    tmp = os.path.join(image_dir, PHASH_FILE + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, names=names, hashes=hashes)
+    os.replace(tmp, os.path.join(image_dir, PHASH_FILE))
+    logger.info(f"Stored the perceptual hashes of {len(names)} images at {os.path.join(image_dir, PHASH_FILE)}")
+
+
 def create_lock_file(image_dir: str):
     pth = os.path.join(image_dir, LOCK_FILE)
     logger.info(f"Created LOCK FILE at {pth}")
@@ -51,6 +99,14 @@ def lock_file_exists(image_dir: str):
     return os.path.isfile(os.path.join(image_dir, LOCK_FILE))
 
 
+def image_dir_fingerprint(image_dir: str) -> str:
+    # md5 of the sorted names and sizes of all files in the image directory except the files written by init_images
+    # itself. Note that the fingerprint changes once after the images got converted
+    entries = sorted(f"{e.name}:{e.stat().st_size}" for e in os.scandir(image_dir)
+                     if e.is_file() and e.name not in (LOCK_FILE, PHASH_FILE) and not e.name.endswith('.tmp'))
+    return hashlib.md5(";".join(entries).encode('utf-8')).hexdigest()
+
+
 def init_images(image_dir: str = '../data/images/',
                 n_workers: int = 8,
                 webp: bool = True,
@@ -60,11 +116,6 @@ def init_images(image_dir: str = '../data/images/',
                 thumbnail_size: int = 120):
     assert os.path.lexists(image_dir), f"Cannot find {image_dir}!"
 
-    # we wait a random amount of time here to support multi-processing (gunicorn spawns multiple processes) so
-    # only the instance that reads the init_flag first will init Redis! Otherwise it gets initialized multiple
-    # times
-    time.sleep(np.random.uniform(low=0.3, high=1.0))
-
     if not lock_file_exists(image_dir):
         create_lock_file(image_dir)
         logger.info(f"Initializing images in {image_dir}")
@@ -75,28 +126,26 @@ def init_images(image_dir: str = '../data/images/',
 
         if len(imgs) == 0:
             logger.info(f"All images are already initialized!")
-            remove_lock_file(image_dir)
-            return
-
-        logger.info(f"Found {len(imgs)} total images to convert!")
-        with ThreadPoolExecutor(max_workers=n_workers) as executor:
-            logger.info(f"Starting conversion with {n_workers} workers!")
-            with tqdm(total=len(imgs)) as progress:
-                futures = []
-                for pth in imgs:
-                    future = executor.submit(convert_to_webp,
-                                             pth,
-                                             webp,
-                                             webp_quality,
-                                             remove_original,
-                                             thumbnails,
-                                             thumbnail_size)
-                    future.add_done_callback(lambda p: progress.update())
-                    futures.append(future)
-
-                # wait for all complete
-                for f in futures:
-                    f.result()
+        else:
+            logger.info(f"Found {len(imgs)} total images to convert!")
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                logger.info(f"Starting conversion with {n_workers} workers!")
+                with tqdm(total=len(imgs)) as progress:
+                    futures = []
+                    for pth in imgs:
+                        future = executor.submit(convert_to_webp,
+                                                 pth,
+                                                 webp,
+                                                 webp_quality,
+                                                 remove_original,
+                                                 thumbnails,
+                                                 thumbnail_size)
+                        future.add_done_callback(lambda p: progress.update())
+                        futures.append(future)
+
+                    # wait for all complete
+                    for f in futures:
+                        f.result()
 
         remove_lock_file(image_dir)
     else:
@@ -127,3 +176,4 @@ if __name__ == "__main__":
                 opts.remove_original,
                 opts.thumbnails,
                 opts.thumbnail_size)
+    update_perceptual_hashes(opts.image_dir, opts.n_workers)
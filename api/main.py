@@ -3,12 +3,15 @@ from fastapi import FastAPI
 from loguru import logger
 
 from backend.auth import AuthHandler
-from backend.db import RedisHandler
+from backend.db import RedisHandler, AsyncRedisHandler
 from backend.image_server import ImageServer
+from backend.jobs import JobRunner, InitLock
+from backend.jobs.init_lock import STARTUP_EPOCH
 from backend.mturk import MTurkHandler
 from backend.study import RankingStudyCoordinator, LikertStudyCoordinator, RatingStudyCoordinator
 from backend.study.init_model_rankings import init_model_rankings
 from config import conf
+from models.validation_context import ValidationContextMiddleware
 from routers import general, ranking_sample, ranking_result, likert_sample, likert_result, rating_sample, rating_result, \
     image, study, mranking, user, mturk, feedback
 
@@ -16,6 +19,8 @@ from routers import general, ranking_sample, ranking_result, likert_sample, like
 app = FastAPI(title="User Study API",
               description="Simple API that powers my Master Thesis' user study.",
               version="beta")
+# loads the samples referenced by submitted results only once per request
+app.add_middleware(ValidationContextMiddleware)
 
 
 @logger.catch(reraise=True)
@@ -27,9 +32,10 @@ def startup_event():
 
         # init redis
         rh = RedisHandler()
-        # flush all redis dbs if set
+        # flush all redis dbs if set. Only one of the worker processes flushes the DBs once per start of the server so
+        # that workers that are restarted later do not flush the data the other workers already serve
         if conf.study_initialization.flush:
-            rh.flush()
+            InitLock(f"flush_{STARTUP_EPOCH}").run_once(rh.flush)
 
         # init auth handler
         auth = AuthHandler()
@@ -50,6 +56,13 @@ def startup_event():
         rating_coord = RatingStudyCoordinator()
         rating_coord.init_study()
 
+        # migrate documents that were stored with another codec in the background
+        JobRunner().register('codec_migration', RedisHandler().migrate_documents,
+                             conf.backend.redis.codec_migration_interval)
+
+        # start the background jobs (only executed if this process gets elected as leader)
+        JobRunner().start()
+
         # init mturk
         mt = MTurkHandler()
 
@@ -61,8 +74,10 @@ def startup_event():
 
 @logger.catch(reraise=True)
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
+    JobRunner().shutdown()
     RedisHandler().shutdown()
+    await AsyncRedisHandler().shutdown()
     RankingStudyCoordinator().shutdown()
     LikertStudyCoordinator().shutdown()
     AuthHandler().shutdown()
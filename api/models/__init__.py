@@ -13,4 +13,5 @@ from .rating_result import RatingResult
 from .model_ranking import ModelRanking
 from .aws_credentials import AWSCreds
 from .feedback import Feedback
-
+from .page import Page
+from .lease import Lease
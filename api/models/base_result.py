@@ -7,6 +7,7 @@ from shortuuid import uuid
 
 import models
 from models import MTurkParams, StudyType
+from .validation_context import load_referenced_sample
 
 
 class BaseResult(BaseModel):
@@ -20,8 +21,8 @@ class BaseResult(BaseModel):
         if models.__validation_disabled__:
             return sample_id.strip()
 
-        from backend.db import RedisHandler
-        if not RedisHandler().sample_exists(sample_id=sample_id.strip()):
+        # the sample is loaded (once per request) because the validators of the subclasses need it anyway
+        if load_referenced_sample(sample_id.strip()) is None:
             raise ValueError(f"Sample '{sample_id}' does not exist!")
         return sample_id.strip()
 
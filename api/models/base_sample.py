@@ -6,6 +6,7 @@ from shortuuid import uuid
 
 import models
 from models import MTurkParams, StudyType
+from .validation_context import model_ranking_is_known
 
 
 class BaseSample(BaseModel):
@@ -16,15 +17,17 @@ class BaseSample(BaseModel):
     @validator('mr_id')
     def mr_must_exist(cls, mr_id: str):
         from backend.db import RedisHandler
-        if models.__validation_disabled__:
+        if models.__validation_disabled__ or model_ranking_is_known(mr_id.strip()):
             return mr_id.strip()
 
         if not RedisHandler().model_ranking_exists(mr_id=mr_id.strip()):
             raise ValueError(f"ModelRanking {mr_id} does not exist!")
         return mr_id.strip()
 
-    def add_mt_params(self, mt: MTurkParams):
-        self.mt_params = mt
+    def add_mt_params(self, mt: MTurkParams) -> 'BaseSample':
+        # the loaded samples are shared across requests by the DocumentCache, so the MTurk parameters of a request are
+        # added to a copy instead of the (cached) sample itself
+        return self.copy(deep=True, update={'mt_params': mt})
 
     @staticmethod
     @abstractmethod
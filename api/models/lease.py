@@ -0,0 +1,12 @@
+from typing import Generic, TypeVar
+
+from pydantic import Field
+from pydantic.generics import GenericModel
+
+T = TypeVar('T')
+
+
+class Lease(GenericModel, Generic[T]):
+    sample: T = Field(description="The leased sample")
+    expires_at: float = Field(description="Unix timestamp (of the server) at which the lease expires")
+    ttl: int = Field(description="Lease duration in seconds (independent of the clock of the client)")
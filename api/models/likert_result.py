@@ -1,8 +1,9 @@
 from pydantic import Field, root_validator
 
 import models
-from models import StudyType
+from models import StudyType, LikertSample
 from .base_result import BaseResult
+from .validation_context import load_referenced_sample
 
 
 class LikertResult(BaseResult):
@@ -18,8 +19,9 @@ class LikertResult(BaseResult):
         if sample_id is None or chosen_answer is None:
             raise ValueError(f"sample_id and chosen_answer must not be None!")
 
-        from backend.db import RedisHandler
-        ls = RedisHandler().load_likert_sample(ls_id=sample_id.strip())
+        ls = load_referenced_sample(sample_id.strip())
+        if not isinstance(ls, LikertSample):
+            raise ValueError(f"Sample '{sample_id}' is not a LikertSample!")
         if chosen_answer not in ls.answers:
             raise ValueError(f"Chosen answer '{chosen_answer}' does not exist in related LikertSample!")
         return values
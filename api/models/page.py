@@ -0,0 +1,12 @@
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic import Field
+from pydantic.generics import GenericModel
+
+T = TypeVar('T')
+
+
+class Page(GenericModel, Generic[T]):
+    items: List[T] = Field(description="Items of the current page")
+    next_cursor: Optional[str] = Field(description="Opaque cursor of the next page or None if this is the last page",
+                                       default=None)
@@ -3,8 +3,9 @@ from typing import List
 from pydantic import Field, root_validator
 
 import models
-from models import StudyType
+from models import StudyType, RatingSample
 from .base_result import BaseResult
+from .validation_context import load_referenced_sample
 
 
 class RatingResult(BaseResult):
@@ -20,8 +21,9 @@ class RatingResult(BaseResult):
         if sample_id is None or ratings is None:
             raise ValueError(f"sample_id and ratings must not be None!")
 
-        from backend.db import RedisHandler
-        rs = RedisHandler().load_rating_sample(rs_id=sample_id.strip())
+        rs = load_referenced_sample(sample_id.strip())
+        if not isinstance(rs, RatingSample):
+            raise ValueError(f"Sample '{sample_id}' is not a RatingSample!")
         if len(ratings) != len(rs.image_ids):
             raise ValueError(f"Number of ratings and number of images of the RatingSample do not match!")
         return values
@@ -36,8 +38,9 @@ class RatingResult(BaseResult):
         if sample_id is None or ratings is None:
             raise ValueError(f"sample_id and ratings must not be None!")
 
-        from backend.db import RedisHandler
-        rs = RedisHandler().load_rating_sample(rs_id=sample_id.strip())
+        rs = load_referenced_sample(sample_id.strip())
+        if not isinstance(rs, RatingSample):
+            raise ValueError(f"Sample '{sample_id}' is not a RatingSample!")
         if min(ratings) < rs.min_rating or max(ratings) > rs.max_rating:
             raise ValueError(f"Ratings must be in min max interval of the related RatingSample!")
         return values
@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Iterator, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # the BaseSample itself depends on this module
+    from .base_sample import BaseSample
+
+# samples (by ID) that were already loaded while handling the current request. None if there is no active context.
+_referenced_samples = ContextVar('referenced_samples', default=None)
+# IDs of ModelRankings that are known to exist (e.g. because they were just loaded to generate samples from them)
+_known_model_rankings = ContextVar('known_model_rankings', default=None)
+
+
+@contextmanager
+def validation_context() -> Iterator[None]:
+    # within the context every referenced sample is loaded from Redis only once and is shared by all validators (and
+    # the store path) of the results
+    token = _referenced_samples.set({})
+    try:
+        yield
+    finally:
+        _referenced_samples.reset(token)
+
+
+def load_referenced_sample(sample_id: str) -> Optional['BaseSample']:
+    samples = _referenced_samples.get()
+    if samples is not None and sample_id in samples:
+        return samples[sample_id]
+
+    from backend.db import RedisHandler
+    sample = RedisHandler().load_sample(sample_id=sample_id)
+    if samples is not None:
+        samples[sample_id] = sample
+    return sample
+
+
+def get_referenced_sample(sample_id: str) -> Optional['BaseSample']:
+    # returns the sample only if it was already loaded in the current context (and never reads from Redis)
+    samples = _referenced_samples.get()
+    return None if samples is None else samples.get(sample_id)
+
+
+@contextmanager
+def known_model_rankings(mr_ids: Iterable[str]) -> Iterator[None]:
+    # within the context the validators of the samples do not check if these ModelRankings exist in Redis
+    token = _known_model_rankings.set(set(mr_ids))
+    try:
+        yield
+    finally:
+        _known_model_rankings.reset(token)
+
+
+def model_ranking_is_known(mr_id: str) -> bool:
+    mr_ids = _known_model_rankings.get()
+    return mr_ids is not None and mr_id in mr_ids
+
+
+class ValidationContextMiddleware(object):
+    # ASGI middleware that opens a validation context for every HTTP request (the request body is parsed and validated
+    # inside the same task so the validators see the context)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        with validation_context():
+            await self.app(scope, receive, send)
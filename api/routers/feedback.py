@@ -1,11 +1,13 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
 
 from backend.auth import JWTBearer
 from backend.db import RedisHandler
+from models import Page
 from models.feedback import Feedback
+from routers.ndjson import ndjson_response
 
 PREFIX = "/feedback"
 TAG = ["feedback"]
@@ -50,3 +52,26 @@ async def list_feedbacks_for_ranking_sample(rs_id: str):
 async def list_all_feedbacks():
     logger.info(f"GET request on {PREFIX}/list")
     return rh.list_all_feedbacks()
+
+
+@logger.catch(reraise=True)
+@router.get("/list/page", tags=TAG,
+            response_model=Page[Feedback],
+            description="Returns a page of all Feedbacks. Pass the returned cursor to get the next page",
+            dependencies=[Depends(JWTBearer())])
+def page_all_feedbacks(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=10000)):
+    logger.info(f"GET request on {PREFIX}/list/page")
+    try:
+        items, next_cursor = rh.page_all_feedbacks(cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Page[Feedback](items=items, next_cursor=next_cursor)
+
+
+@logger.catch(reraise=True)
+@router.get("/list/stream", tags=TAG,
+            description="Streams all Feedbacks as newline delimited JSON",
+            dependencies=[Depends(JWTBearer())])
+def stream_all_feedbacks():
+    logger.info(f"GET request on {PREFIX}/list/stream")
+    return ndjson_response(rh.iter_all_feedbacks())
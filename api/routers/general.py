@@ -1,8 +1,11 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import RedirectResponse
 
 from loguru import logger
 
+from backend.auth import JWTBearer
+from backend.db.document_cache import DocumentCache
+
 router = APIRouter()
 
 
@@ -18,3 +21,13 @@ async def heartbeat():
 async def redirect_to_docs():
     logger.info("GET request on / -> redirecting to /docs")
     return RedirectResponse("/docs")
+
+
+@logger.catch(reraise=True)
+@router.get("/cache/stats", tags=["general"],
+            description="Returns the statistics (hits, misses, ...) of the DocumentCache of the worker process that "
+                        "handles the request",
+            dependencies=[Depends(JWTBearer())])
+async def cache_stats():
+    logger.info("GET request on /cache/stats")
+    return DocumentCache().stats()
@@ -1,13 +1,16 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
 from starlette.responses import JSONResponse
 
 from backend.study import LikertStudyCoordinator
 from backend.auth import JWTBearer
-from backend.db import RedisHandler
+from backend.db import RedisHandler, AsyncRedisHandler
+from models import Page
 from models.likert_result import LikertResult
+from routers.ndjson import ndjson_response
+from routers.raw_json import raw_json_response
 
 PREFIX = "/likert_result"
 TAG = ["likert_result"]
@@ -15,6 +18,7 @@ TAG = ["likert_result"]
 router = APIRouter()
 
 redis = RedisHandler()
+async_redis = AsyncRedisHandler()
 sc = LikertStudyCoordinator()
 
 
@@ -23,9 +27,32 @@ sc = LikertStudyCoordinator()
             response_model=List[LikertResult],
             description="Returns all submitted LikertResults",
             dependencies=[Depends(JWTBearer())])
-async def list_ranking_results():
+async def list_likert_results():
     logger.info(f"GET request on {PREFIX}/list")
-    return redis.list_ranking_results()
+    return redis.list_likert_results()
+
+
+@logger.catch(reraise=True)
+@router.get("/list/page", tags=TAG,
+            response_model=Page[LikertResult],
+            description="Returns a page of all submitted LikertResults. Pass the returned cursor to get the next page",
+            dependencies=[Depends(JWTBearer())])
+def page_likert_results(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=10000)):
+    logger.info(f"GET request on {PREFIX}/list/page")
+    try:
+        items, next_cursor = redis.page_likert_results(cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Page[LikertResult](items=items, next_cursor=next_cursor)
+
+
+@logger.catch(reraise=True)
+@router.get("/list/stream", tags=TAG,
+            description="Streams all submitted LikertResults as newline delimited JSON",
+            dependencies=[Depends(JWTBearer())])
+def stream_likert_results():
+    logger.info(f"GET request on {PREFIX}/list/stream")
+    return ndjson_response(redis.iter_likert_results())
 
 
 @logger.catch(reraise=True)
@@ -35,7 +62,7 @@ async def list_ranking_results():
             dependencies=[Depends(JWTBearer())])
 async def load(lr_id: str):
     logger.info(f"GET request on {PREFIX}/{lr_id}")
-    return redis.load_ranking_result(lr_id)
+    return raw_json_response(await async_redis.load_raw('likert_result', lr_id), 'LikertResult', lr_id)
 
 
 @logger.catch(reraise=True)
@@ -43,4 +70,4 @@ async def load(lr_id: str):
             description="Submit a LikertResult")
 async def submit(result: LikertResult):
     logger.info(f"GET request on {PREFIX}/submit")
-    return JSONResponse(content=sc.submit(result))
+    return JSONResponse(content=await sc.submit_async(result))
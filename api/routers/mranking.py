@@ -1,17 +1,22 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
+from starlette.concurrency import run_in_threadpool
 
 from backend.auth import JWTBearer
-from backend.db import RedisHandler
-from models import ModelRanking
+from backend.db import RedisHandler, AsyncRedisHandler
+from backend.study.init_model_rankings import init_model_rankings
+from models import ModelRanking, Page
+from routers.ndjson import ndjson_response
+from routers.raw_json import raw_json_response
 
 PREFIX = "/mranking"
 TAG = ["mranking"]
 router = APIRouter()
 
 rh = RedisHandler()
+arh = AsyncRedisHandler()
 
 
 @logger.catch(reraise=True)
@@ -19,11 +24,45 @@ rh = RedisHandler()
             response_model=List[ModelRanking],
             description="Returns all RankingSamples",
             dependencies=[Depends(JWTBearer())])
-async def list_rankings(num: int = 100):
+async def list_rankings(num: int = Query(100, ge=1)):
     logger.info(f"GET request on {PREFIX}/list")
     return rh.list_model_rankings(num)
 
 
+@logger.catch(reraise=True)
+@router.get("/list/page", tags=TAG,
+            response_model=Page[ModelRanking],
+            description="Returns a page of all ModelRankings. Pass the returned cursor to get the next page",
+            dependencies=[Depends(JWTBearer())])
+def page_rankings(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=10000)):
+    logger.info(f"GET request on {PREFIX}/list/page")
+    try:
+        items, next_cursor = rh.page_model_rankings(cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Page[ModelRanking](items=items, next_cursor=next_cursor)
+
+
+@logger.catch(reraise=True)
+@router.get("/list/stream", tags=TAG,
+            description="Streams all ModelRankings as newline delimited JSON",
+            dependencies=[Depends(JWTBearer())])
+def stream_rankings():
+    logger.info(f"GET request on {PREFIX}/list/stream")
+    return ndjson_response(rh.iter_model_rankings())
+
+
+@logger.catch(reraise=True)
+@router.put("/ingest", tags=TAG,
+            description="Ingests new or changed Dataframes of ModelRankings from the data root into the running study",
+            dependencies=[Depends(JWTBearer())])
+async def ingest_rankings():
+    logger.info(f"PUT request on {PREFIX}/ingest")
+    # the ingestion is blocking and can take a while
+    await run_in_threadpool(init_model_rankings)
+    return {'num_model_rankings': rh.num_model_rankings()}
+
+
 @logger.catch(reraise=True)
 @router.get("/{mr_id}", tags=TAG,
             response_model=ModelRanking,
@@ -31,4 +70,4 @@ async def list_rankings(num: int = 100):
             dependencies=[Depends(JWTBearer())])
 async def load_ranking(mr_id: str):
     logger.info(f"GET request on {PREFIX}/{mr_id}")
-    return rh.load_model_ranking(mr_id)
+    return raw_json_response(await arh.load_raw('model_ranking', mr_id), 'ModelRanking', mr_id)
@@ -23,7 +23,7 @@ rh = RedisHandler()
             dependencies=[Depends(JWTBearer())])
 async def create_hit(sample_id: str, creds: Optional[AWSCreds] = None, sandbox: Optional[bool] = True):
     logger.info(f"PUT request on {PREFIX}/hit/create")
-    sample = rh.load_sample(rs_id=sample_id)
+    sample = rh.load_sample(sample_id=sample_id)
     if sample is not None:
         if creds is not None:
             mturk.create_new_client(sandbox, creds.access_key, creds.secret)
@@ -0,0 +1,20 @@
+from itertools import islice
+from typing import Iterator
+
+from pydantic import BaseModel
+from starlette.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def ndjson_response(models: Iterator[BaseModel], chunk_size: int = 100) -> StreamingResponse:
+    # the models are serialized lazily (one line per model) while they are streamed from Redis so that exporting
+    # runs in constant memory. Lines are sent in chunks to avoid a threadpool round trip per model.
+    def lines() -> Iterator[bytes]:
+        while True:
+            chunk = list(islice(models, chunk_size))
+            if len(chunk) == 0:
+                break
+            yield "".join([m.json() + "\n" for m in chunk]).encode('utf-8')
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
@@ -1,13 +1,15 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
 from starlette.responses import JSONResponse
 
 from backend.study import RankingStudyCoordinator
 from backend.auth import JWTBearer
-from backend.db import RedisHandler
-from models import RankingResult
+from backend.db import RedisHandler, AsyncRedisHandler
+from models import RankingResult, Page
+from routers.ndjson import ndjson_response
+from routers.raw_json import raw_json_response
 
 PREFIX = "/ranking_result"
 TAG = ["ranking_result"]
@@ -15,6 +17,7 @@ TAG = ["ranking_result"]
 router = APIRouter()
 
 redis = RedisHandler()
+async_redis = AsyncRedisHandler()
 sc = RankingStudyCoordinator()
 
 
@@ -28,6 +31,29 @@ async def list_ranking_results():
     return redis.list_ranking_results()
 
 
+@logger.catch(reraise=True)
+@router.get("/list/page", tags=TAG,
+            response_model=Page[RankingResult],
+            description="Returns a page of all submitted RankingResults. Pass the returned cursor to get the next page",
+            dependencies=[Depends(JWTBearer())])
+def page_ranking_results(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=10000)):
+    logger.info(f"GET request on {PREFIX}/list/page")
+    try:
+        items, next_cursor = redis.page_ranking_results(cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Page[RankingResult](items=items, next_cursor=next_cursor)
+
+
+@logger.catch(reraise=True)
+@router.get("/list/stream", tags=TAG,
+            description="Streams all submitted RankingResults as newline delimited JSON",
+            dependencies=[Depends(JWTBearer())])
+def stream_ranking_results():
+    logger.info(f"GET request on {PREFIX}/list/stream")
+    return ndjson_response(redis.iter_ranking_results())
+
+
 @logger.catch(reraise=True)
 @router.get("/{rr_id}", tags=TAG,
             response_model=RankingResult,
@@ -35,7 +61,7 @@ async def list_ranking_results():
             dependencies=[Depends(JWTBearer())])
 async def load(rr_id: str):
     logger.info(f"GET request on {PREFIX}/{rr_id}")
-    return redis.load_ranking_result(rr_id)
+    return raw_json_response(await async_redis.load_raw('ranking_result', rr_id), 'RankingResult', rr_id)
 
 
 @logger.catch(reraise=True)
@@ -43,4 +69,4 @@ async def load(rr_id: str):
             description="Submit a RankingResult")
 async def submit(result: RankingResult):
     logger.info(f"GET request on {PREFIX}/submit")
-    return JSONResponse(content=sc.submit(result))
+    return JSONResponse(content=await sc.submit_async(result))
@@ -1,29 +1,36 @@
 from typing import Union, Optional, List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from loguru import logger
 
 from backend.study import RankingStudyCoordinator
 from backend.auth import JWTBearer
-from backend.db import RedisHandler
-from models import RankingSample, MTurkParams
+from backend.db import RedisHandler, AsyncRedisHandler
+from models import Lease, RankingSample, MTurkParams
+from routers.raw_json import raw_json_response
 
 PREFIX = "/ranking_sample"
 TAG = ["ranking_sample"]
 router = APIRouter()
 
 rh = RedisHandler()
+arh = AsyncRedisHandler()
 coord = RankingStudyCoordinator()
 
 
 @logger.catch(reraise=True)
 @router.get("/next", tags=TAG,
-            response_model=Union[RankingSample, int],
+            response_model=Union[RankingSample, List[Lease[RankingSample]], int],
             description="Returns the next RankingSample or the shortest waiting time in seconds until the next sample "
-                        "is ready.")
-async def get_next_ranking_sample():
+                        "is ready. With batch, up to batch RankingSamples are leased at once and returned together "
+                        "with the expiry of their lease. With wait, the request waits up to wait seconds for a "
+                        "sample if there is none left.")
+async def get_next_ranking_sample(batch: Optional[int] = Query(None, ge=1, description="Samples to lease at once"),
+                                  wait: Optional[float] = Query(None, ge=0, description="Max. seconds to wait")):
     logger.info(f"GET request on {PREFIX}/next")
-    return coord.next()
+    if batch is not None:
+        return await coord.next_batch_async(batch, wait=wait)
+    return await coord.next_async(wait=wait)
 
 
 @logger.catch(reraise=True)
@@ -31,7 +38,7 @@ async def get_next_ranking_sample():
             response_model=List[RankingSample],
             description="Returns all RankingSamples",
             dependencies=[Depends(JWTBearer())])
-async def list_ranking_samples(num: int = 100):
+async def list_ranking_samples(num: int = Query(100, ge=1)):
     logger.info(f"GET request on {PREFIX}/list")
     return rh.list_ranking_samples(num)
 
@@ -42,8 +49,6 @@ async def list_ranking_samples(num: int = 100):
             description="Returns the RankingSample with the specified ID")
 async def load_sample(rs_id: str, mt: Optional[MTurkParams] = Depends(MTurkParams)):
     logger.info(f"GET request on {PREFIX}/{rs_id}")
-    sample = rh.load_ranking_sample(rs_id)
-    if sample is not None:
-        sample.add_mt_params(mt)
-
-    return sample
+    # the stored sample is passed through and only the MTurk parameters are patched in
+    raw = await arh.load_raw('ranking_sample', rs_id)
+    return raw_json_response(raw, 'RankingSample', rs_id, patch={'mt_params': None if mt is None else mt.dict()})
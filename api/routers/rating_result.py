@@ -1,13 +1,15 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
 from starlette.responses import JSONResponse
 
 from backend.study import RatingStudyCoordinator
 from backend.auth import JWTBearer
-from backend.db import RedisHandler
-from models import RatingResult
+from backend.db import RedisHandler, AsyncRedisHandler
+from models import RatingResult, Page
+from routers.ndjson import ndjson_response
+from routers.raw_json import raw_json_response
 
 PREFIX = "/rating_result"
 TAG = ["rating_result"]
@@ -15,6 +17,7 @@ TAG = ["rating_result"]
 router = APIRouter()
 
 redis = RedisHandler()
+async_redis = AsyncRedisHandler()
 sc = RatingStudyCoordinator()
 
 
@@ -28,6 +31,29 @@ async def list_rating_results():
     return redis.list_rating_results()
 
 
+@logger.catch(reraise=True)
+@router.get("/list/page", tags=TAG,
+            response_model=Page[RatingResult],
+            description="Returns a page of all submitted RatingResults. Pass the returned cursor to get the next page",
+            dependencies=[Depends(JWTBearer())])
+def page_rating_results(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=10000)):
+    logger.info(f"GET request on {PREFIX}/list/page")
+    try:
+        items, next_cursor = redis.page_rating_results(cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Page[RatingResult](items=items, next_cursor=next_cursor)
+
+
+@logger.catch(reraise=True)
+@router.get("/list/stream", tags=TAG,
+            description="Streams all submitted RatingResults as newline delimited JSON",
+            dependencies=[Depends(JWTBearer())])
+def stream_rating_results():
+    logger.info(f"GET request on {PREFIX}/list/stream")
+    return ndjson_response(redis.iter_rating_results())
+
+
 @logger.catch(reraise=True)
 @router.get("/{rr_id}", tags=TAG,
             response_model=RatingResult,
@@ -35,7 +61,7 @@ async def list_rating_results():
             dependencies=[Depends(JWTBearer())])
 async def load(rr_id: str):
     logger.info(f"GET request on {PREFIX}/{rr_id}")
-    return redis.load_rating_result(rr_id)
+    return raw_json_response(await async_redis.load_raw('rating_result', rr_id), 'RatingResult', rr_id)
 
 
 @logger.catch(reraise=True)
@@ -43,4 +69,4 @@ async def load(rr_id: str):
             description="Submit a RatingResult")
 async def submit(result: RatingResult):
     logger.info(f"GET request on {PREFIX}/submit")
-    return JSONResponse(content=sc.submit(result))
+    return JSONResponse(content=await sc.submit_async(result))
@@ -1,29 +1,36 @@
 from typing import Union, Optional, List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from loguru import logger
 
 from backend.study import RatingStudyCoordinator
 from backend.auth import JWTBearer
-from backend.db import RedisHandler
-from models import RatingSample, MTurkParams
+from backend.db import RedisHandler, AsyncRedisHandler
+from models import Lease, RatingSample, MTurkParams
+from routers.raw_json import raw_json_response
 
 PREFIX = "/rating_sample"
 TAG = ["rating_sample"]
 router = APIRouter()
 
 rh = RedisHandler()
+arh = AsyncRedisHandler()
 coord = RatingStudyCoordinator()
 
 
 @logger.catch(reraise=True)
 @router.get("/next", tags=TAG,
-            response_model=Union[RatingSample, int],
+            response_model=Union[RatingSample, List[Lease[RatingSample]], int],
             description="Returns the next RatingSample or the shortest waiting time in seconds until the next sample "
-                        "is ready.")
-async def get_next_rating_sample():
+                        "is ready. With batch, up to batch RatingSamples are leased at once and returned together "
+                        "with the expiry of their lease. With wait, the request waits up to wait seconds for a "
+                        "sample if there is none left.")
+async def get_next_rating_sample(batch: Optional[int] = Query(None, ge=1, description="Samples to lease at once"),
+                                 wait: Optional[float] = Query(None, ge=0, description="Max. seconds to wait")):
     logger.info(f"GET request on {PREFIX}/next")
-    return coord.next()
+    if batch is not None:
+        return await coord.next_batch_async(batch, wait=wait)
+    return await coord.next_async(wait=wait)
 
 
 @logger.catch(reraise=True)
@@ -31,7 +38,7 @@ async def get_next_rating_sample():
             response_model=List[RatingSample],
             description="Returns all RatingSamples",
             dependencies=[Depends(JWTBearer())])
-async def list_rating_samples(num: int = 100):
+async def list_rating_samples(num: int = Query(100, ge=1)):
     logger.info(f"GET request on {PREFIX}/list")
     return rh.list_rating_samples(num)
 
@@ -42,8 +49,6 @@ async def list_rating_samples(num: int = 100):
             description="Returns the RatingSample with the specified ID")
 async def load_sample(rs_id: str, mt: Optional[MTurkParams] = Depends(MTurkParams)):
     logger.info(f"GET request on {PREFIX}/{rs_id}")
-    sample = rh.load_rating_sample(rs_id)
-    if sample is not None:
-        sample.add_mt_params(mt)
-
-    return sample
+    # the stored sample is passed through and only the MTurk parameters are patched in
+    raw = await arh.load_raw('rating_sample', rs_id)
+    return raw_json_response(raw, 'RatingSample', rs_id, patch={'mt_params': None if mt is None else mt.dict()})
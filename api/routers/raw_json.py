@@ -0,0 +1,19 @@
+from typing import Optional, Dict, Any
+
+import orjson
+from fastapi import HTTPException
+from starlette.responses import Response
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def raw_json_response(raw: Optional[bytes], name: str, key: str, patch: Optional[Dict[str, Any]] = None) -> Response:
+    # returns the stored JSON of a document as is (i.e., without parsing, validating and serializing it with pydantic).
+    # If a patch is given, only the top-level fields of the patch are replaced (via orjson)
+    if raw is None:
+        raise HTTPException(status_code=404, detail=f"Cannot find {name} {key}")
+    if patch is not None:
+        doc = orjson.loads(raw)
+        doc.update(patch)
+        raw = orjson.dumps(doc)
+    return Response(content=raw, media_type=JSON_MEDIA_TYPE)
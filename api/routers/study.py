@@ -1,21 +1,51 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
 
-from backend.study import LikertStudyCoordinator, RankingStudyCoordinator
+from backend.study import LikertStudyCoordinator, RankingStudyCoordinator, RatingStudyCoordinator
+from backend.study.study_coordinator_base import StudyCoordinatorBase
 from backend.auth import JWTBearer
+from models import StudyType
 
 PREFIX = "/study"
 TAG = ["study"]
 
+COORDINATORS = {StudyType.RANKING.value: RankingStudyCoordinator,
+                StudyType.LIKERT.value: LikertStudyCoordinator,
+                StudyType.RATING.value: RatingStudyCoordinator}
+
 router = APIRouter()
 
 
+def get_coordinator(study_type: str) -> StudyCoordinatorBase:
+    if study_type not in COORDINATORS:
+        raise HTTPException(status_code=404, detail=f"Unknown study type '{study_type}'!")
+    # the coordinators are singletons
+    return COORDINATORS[study_type]()
+
+
 @logger.catch(reraise=True)
 @router.get("/progress", tags=TAG,
             description="Returns the current progress of the Study",
             dependencies=[Depends(JWTBearer())])
 async def get_progress(study_type: str):
     logger.info(f"GET request on {PREFIX}/progress")
-    coords = {'likert': LikertStudyCoordinator(),
-              'ranking': RankingStudyCoordinator()}
-    return coords[study_type].current_progress()
+    return get_coordinator(study_type).current_progress()
+
+
+@logger.catch(reraise=True)
+@router.get("/progress/history", tags=TAG,
+            description="Returns the most recent snapshots of the progress of the Study (newest first)",
+            dependencies=[Depends(JWTBearer())])
+async def get_progress_history(study_type: str, num: int = Query(100, ge=1, le=10000)):
+    logger.info(f"GET request on {PREFIX}/progress/history")
+    return get_coordinator(study_type).progress_history(num)
+
+
+@logger.catch(reraise=True)
+@router.get("/leases", tags=TAG,
+            description="Returns the distribution of the lease durations (from lease to submission) of the Study and "
+                        "the lease TTL derived from it",
+            dependencies=[Depends(JWTBearer())])
+async def get_lease_stats(study_type: str):
+    logger.info(f"GET request on {PREFIX}/leases")
+    return get_coordinator(study_type).lease_stats()
@@ -0,0 +1,103 @@
+# The tests run against an in-memory fakeredis server (which also runs the Lua scripts) instead of a Redis server. All
+# (sync and async) clients share the same server, which is flushed before every test that uses the redis fixture.
+import asyncio
+import os
+import sys
+import tempfile
+from typing import List
+
+import pytest
+
+API_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_ROOT)
+os.environ.setdefault('IRST_CONFIG', os.path.join(API_ROOT, 'config', 'config.yml'))
+os.environ.setdefault('IMG_SRV_ROOT', tempfile.mkdtemp(prefix='img_srv_root_'))
+
+try:
+    import fakeredis
+    import fakeredis.aioredis
+    import redis
+    import redis.asyncio
+except ImportError:
+    fakeredis = None
+
+if fakeredis is not None:
+    SERVER = fakeredis.FakeServer()
+
+    class _FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, host=None, port=None, **kwargs):
+            super().__init__(*args, server=SERVER, **kwargs)
+
+    class _FakeAsyncRedis(fakeredis.aioredis.FakeRedis):
+        def __init__(self, *args, host=None, port=None, connection_pool=None, max_connections=None, **kwargs):
+            if connection_pool is not None:
+                kwargs['db'] = connection_pool.connection_kwargs['db']
+            super().__init__(*args, server=SERVER, **kwargs)
+
+    redis.Redis = _FakeRedis
+    redis.StrictRedis = _FakeRedis
+    redis.asyncio.Redis = _FakeAsyncRedis
+
+
+@pytest.fixture(scope='session')
+def loop():
+    # the async clients are bound to the event loop they were first used in
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def rh():
+    if fakeredis is None:
+        pytest.skip("The tests with Redis require fakeredis")
+    from backend.db import RedisHandler
+    _FakeRedis().flushall()
+    return RedisHandler()
+
+
+@pytest.fixture
+def no_validation(monkeypatch):
+    # the samples and results of the tests do not need to reference existing ModelRankings and samples
+    import models
+    monkeypatch.setattr(models, '__validation_disabled__', True)
+
+
+@pytest.fixture
+def model_rankings(rh):
+    # stores num ModelRankings with num_top_k images each and the image ID pool. Returns the ModelRanking IDs
+    from shortuuid import uuid
+
+    def store(num: int, num_top_k: int = 10, num_images: int = 200) -> List[str]:
+        image_ids = [f'img{i}' for i in range(num_images)]
+        payloads, ds_ids = {}, {}
+        for i in range(num):
+            mr_id = uuid()
+            payloads[mr_id] = rh.encode({'id': mr_id, 'ds_id': str(i), 'query': f'query {i}',
+                                         'top_k_image_ids': image_ids[i % num_images:i % num_images + num_top_k],
+                                         'opts': None})
+            ds_ids[str(i)] = mr_id
+        rh.store_model_ranking_payloads(payloads, ds_ids)
+        rh.store_image_id_pool(image_ids)
+        return list(payloads.keys())
+
+    return store
+
+
+@pytest.fixture
+def likert(rh, model_rankings):
+    # the LikertStudyCoordinator generates its samples from the top-k images only. The study is initialized with 5
+    # samples (the coordinator is a singleton, so the init state has to be reset after the flush)
+    from backend.study import LikertStudyCoordinator
+    from backend.study.study_coordinator_base import Keys, InitState
+    from models import StudyType
+    model_rankings(5)
+    rh.get_progress_client(StudyType.LIKERT).set(Keys.INIT_STATE, InitState.TODO.value)
+    coordinator = LikertStudyCoordinator()
+    coordinator.init_study()
+    return coordinator
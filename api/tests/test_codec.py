@@ -0,0 +1,104 @@
+import orjson
+import pytest
+
+from backend.db import AsyncRedisHandler
+from backend.db.codec import DocumentCodec, JSON, MSGPACK, MSGPACK_ZSTD, zstandard
+from models import RankingSample, RankingResult
+
+IMAGE_IDS = [f'img{i}' for i in range(12)]
+
+needs_zstd = pytest.mark.skipif(zstandard is None, reason="The msgpack_zstd codec requires zstandard")
+CODECS = [(JSON, False), (MSGPACK, False), (MSGPACK, True),
+          pytest.param(MSGPACK_ZSTD, False, marks=needs_zstd), pytest.param(MSGPACK_ZSTD, True, marks=needs_zstd)]
+
+
+def _use_codec(monkeypatch, rh, name: str, compact: bool):
+    # the sync and the async handler share the codec
+    codec = DocumentCodec(name)
+    monkeypatch.setattr(rh, '_RedisHandler__codec', codec)
+    monkeypatch.setattr(rh, '_RedisHandler__compact_ranking_results', compact)
+    monkeypatch.setattr(AsyncRedisHandler(), '_AsyncRedisHandler__codec', codec)
+    monkeypatch.setattr(AsyncRedisHandler(), '_AsyncRedisHandler__compact_ranking_results', compact)
+
+
+def _store_result(rh, delete_sample: bool = False) -> RankingResult:
+    sample = RankingSample(mr_id='mr', query='query', image_ids=IMAGE_IDS)
+    rh.store_samples([sample])
+    result = RankingResult(sample_id=sample.id, ranking=IMAGE_IDS[3:0:-1], irrelevant=IMAGE_IDS[5:7])
+    assert rh.store_ranking_result(result) == result.id
+    if delete_sample:
+        rh.delete_samples(sample.get_type(), [sample.id])
+    return result
+
+
+@pytest.mark.parametrize('codec, compact', CODECS)
+def test_documents_round_trip(monkeypatch, rh, model_rankings, run, no_validation, codec, compact):
+    _use_codec(monkeypatch, rh, codec, compact)
+    mr_id = model_rankings(1)[0]
+    result = _store_result(rh)
+    client = rh._RedisHandler__clients['ranking_result']
+    assert DocumentCodec.codec_of(client.get(result.id)) == codec
+
+    assert rh.load_model_ranking(mr_id).id == mr_id
+    assert rh.load_ranking_sample(result.sample_id).image_ids == IMAGE_IDS
+    assert rh.load_ranking_result(result.id) == result
+    assert rh.list_ranking_results() == [result]
+    arh = AsyncRedisHandler()
+    assert run(arh.load_ranking_result(result.id)) == result
+    assert orjson.loads(run(arh.load_raw('ranking_result', result.id))) == orjson.loads(result.json())
+
+
+@pytest.mark.parametrize('codec, compact', CODECS)
+@pytest.mark.parametrize('target', [JSON, MSGPACK, pytest.param(MSGPACK_ZSTD, marks=needs_zstd)])
+def test_migration_between_codecs(monkeypatch, rh, no_validation, codec, compact, target):
+    _use_codec(monkeypatch, rh, codec, compact)
+    results = [_store_result(rh) for _ in range(3)]
+
+    _use_codec(monkeypatch, rh, target, compact=False)
+    rh.migrate_documents(max_keys=1000)
+    client = rh._RedisHandler__clients['ranking_result']
+    for result in results:
+        # compact results stay compact with the msgpack codecs
+        assert DocumentCodec.codec_of(client.get(result.id)) == target
+        assert DocumentCodec.codec_of(rh._RedisHandler__clients['ranking_sample'].get(result.sample_id)) == target
+        assert rh.load_ranking_result(result.id) == result
+
+
+def test_compact_ranking_result_is_expanded_when_switching_from_msgpack_to_json(monkeypatch, rh, no_validation):
+    _use_codec(monkeypatch, rh, MSGPACK, compact=True)
+    result = _store_result(rh)
+    client = rh._RedisHandler__clients['ranking_result']
+    assert DocumentCodec.codec_of(client.get(result.id)) == MSGPACK
+
+    _use_codec(monkeypatch, rh, JSON, compact=False)
+    loaded = rh.load_ranking_result(result.id)
+    assert loaded == result
+    # the result was re-encoded lazily with the (expanded) image IDs
+    assert DocumentCodec.codec_of(client.get(result.id)) == JSON
+    assert rh.load_ranking_result(result.id) == result
+
+
+def test_migration_to_json_expands_compact_ranking_results(monkeypatch, rh, no_validation):
+    _use_codec(monkeypatch, rh, MSGPACK, compact=True)
+    results = [_store_result(rh) for _ in range(3)]
+    orphan = _store_result(rh, delete_sample=True)
+
+    _use_codec(monkeypatch, rh, JSON, compact=False)
+    rh.migrate_documents(max_keys=1000)
+    client = rh._RedisHandler__clients['ranking_result']
+    for result in results:
+        assert DocumentCodec.codec_of(client.get(result.id)) == JSON
+        assert rh.load_ranking_result(result.id) == result
+    # a compact result without its sample cannot be expanded. It is kept as it is and does not stop the migration
+    assert DocumentCodec.codec_of(client.get(orphan.id)) == MSGPACK
+    assert rh.load_ranking_result(orphan.id) is None
+
+
+def test_compact_ranking_result_is_expanded_when_loaded_async_with_json(monkeypatch, rh, run, no_validation):
+    _use_codec(monkeypatch, rh, MSGPACK, compact=True)
+    result = _store_result(rh)
+
+    _use_codec(monkeypatch, rh, JSON, compact=False)
+    assert run(AsyncRedisHandler().load_ranking_result(result.id)) == result
+    assert DocumentCodec.codec_of(rh._RedisHandler__clients['ranking_result'].get(result.id)) == JSON
+    assert rh.load_ranking_result(result.id) == result
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.study.image_pool import ImagePool, hamming_distances
+from init_imgs import perceptual_hash, update_perceptual_hashes, load_perceptual_hashes
+
+NUM_IMAGES = 20
+
+
+def _save_image(pth: str, seed: int, size=(90, 80)):
+    # a smooth random image, i.e., its dHash is stable under rescaling
+    px = np.random.default_rng(seed).integers(0, 256, size=(8, 9), dtype=np.uint8)
+    Image.fromarray(px).resize(size, Image.BILINEAR).convert('RGB').save(pth)
+
+
+@pytest.fixture
+def image_dir(tmp_path) -> str:
+    # img1 is a rescaled copy of img0
+    for i in range(NUM_IMAGES):
+        _save_image(str(tmp_path / f'img{i}.png'), seed=i)
+    _save_image(str(tmp_path / 'img1.png'), seed=0, size=(180, 160))
+    _save_image(str(tmp_path / 'img0_thumbnail.png'), seed=0, size=(45, 40))
+    return str(tmp_path)
+
+
+def test_hamming_distances():
+    a = np.array([0, 2 ** 64 - 1, 0b1011], dtype=np.uint64)
+    b = np.array([0, 0b1], dtype=np.uint64)
+    expected = [[bin(int(x) ^ int(y)).count('1') for y in b] for x in a]
+    assert hamming_distances(a, b).tolist() == expected
+
+
+def test_perceptual_hash_of_near_duplicate(image_dir):
+    h = [perceptual_hash(f'{image_dir}/img{i}.png') for i in range(3)]
+    distances = hamming_distances(np.array(h, dtype=np.uint64), np.array(h[:1], dtype=np.uint64))[:, 0]
+    assert distances[1] <= 4
+    assert distances[2] > 10
+
+
+def test_perceptual_hashes_are_updated_incrementally(image_dir):
+    update_perceptual_hashes(image_dir, n_workers=2)
+    names, hashes = load_perceptual_hashes(image_dir)
+    # thumbnails are not hashed
+    assert sorted(names.tolist()) == sorted(f'img{i}' for i in range(NUM_IMAGES))
+
+    _save_image(f'{image_dir}/img{NUM_IMAGES}.png', seed=NUM_IMAGES)
+    update_perceptual_hashes(image_dir, n_workers=2)
+    updated_names, updated_hashes = load_perceptual_hashes(image_dir)
+    assert updated_names.tolist() == names.tolist() + [f'img{NUM_IMAGES}']
+    assert updated_hashes[:NUM_IMAGES].tolist() == hashes.tolist()
+
+
+def test_pool_does_not_draw_near_duplicates(rh, image_dir):
+    update_perceptual_hashes(image_dir, n_workers=2)
+    rh.store_image_id_pool([f'img{i}' for i in range(NUM_IMAGES)])
+    pool = ImagePool(seed=0, image_dir=image_dir, max_hamming_distance=4)
+    pool.refresh()
+
+    assert pool.filter(['img1', 'img2'], near_duplicates_of=['img0']) == ['img2']
+    drawn = pool.sample(NUM_IMAGES - 2, exclude=['img0'])
+    assert sorted(drawn) == sorted(f'img{i}' for i in range(2, NUM_IMAGES))
+    with pytest.raises(ValueError):
+        pool.sample(NUM_IMAGES - 1, exclude=['img0'])
+
+    # without the perceptual hashes only the excluded images are not drawn
+    pool = ImagePool(seed=0, image_dir=image_dir, max_hamming_distance=-1)
+    pool.refresh()
+    assert 'img1' in pool.sample(NUM_IMAGES - 1, exclude=['img0'])
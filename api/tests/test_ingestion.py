@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from backend.study.init_model_rankings import ingest_model_rankings
+from config import conf
+
+NUM_ROWS = 10
+
+
+@pytest.fixture(params=['feather', 'parquet'])
+def dataframe(request, tmp_path, monkeypatch) -> str:
+    # the batches are smaller than the Dataframe. The image IDs are serialized as integers
+    monkeypatch.setattr(conf.study_initialization.model_rankings, 'batch_size', 3)
+    df = pd.DataFrame({'sample_id': list(range(NUM_ROWS)),
+                       'caption': [f'caption {i}' for i in range(NUM_ROWS)],
+                       'top_k_matches': [[i, i + 1, i + 2] for i in range(NUM_ROWS)],
+                       'score': [i / 10 for i in range(NUM_ROWS)]})
+    path = str(tmp_path / f'rankings.df.{request.param}')
+    getattr(df, f'to_{request.param}')(path)
+    return path
+
+
+def test_dataframe_is_ingested_in_batches(rh, dataframe):
+    assert ingest_model_rankings(dataframe) == NUM_ROWS
+    mrs = sorted(rh.list_model_rankings(), key=lambda mr: int(mr.ds_id))
+    assert [mr.ds_id for mr in mrs] == [str(i) for i in range(NUM_ROWS)]
+    assert mrs[3].query == 'caption 3'
+    assert mrs[3].top_k_image_ids == ['3', '4', '5']
+    assert mrs[3].opts == {'score': 0.3}
+    assert sorted(rh.get_image_id_pool(), key=int) == [str(i) for i in range(NUM_ROWS + 2)]
+
+
+def test_ingested_rows_are_skipped_or_updated(rh, dataframe):
+    ingest_model_rankings(dataframe)
+    mr_ids = sorted(mr.id for mr in rh.list_model_rankings())
+    assert ingest_model_rankings(dataframe) == 0
+    # upserting updates the ModelRankings in place instead of adding new ones
+    assert ingest_model_rankings(dataframe, upsert=True) == NUM_ROWS
+    assert sorted(mr.id for mr in rh.list_model_rankings()) == mr_ids
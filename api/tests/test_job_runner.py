@@ -0,0 +1,62 @@
+import pytest
+from fastapi import HTTPException
+
+from backend.jobs import JobRunner
+from backend.jobs.job_runner import LEADER_KEY
+from models import StudyType
+from routers.study import get_coordinator
+
+
+@pytest.fixture
+def runner(rh):
+    # the JobRunner is a singleton, so its leadership has to be reset (its threads are not started by the tests)
+    runner = JobRunner()
+    runner._JobRunner__is_leader.clear()
+    yield runner
+    runner._JobRunner__is_leader.clear()
+
+
+def test_runner_is_elected_and_renews_its_leadership(rh, runner):
+    coord = rh.get_coordination_client()
+    runner._JobRunner__heartbeat()
+    assert runner.is_leader()
+    assert coord.get(LEADER_KEY) == runner._JobRunner__id.encode('utf-8')
+
+    coord.pexpire(LEADER_KEY, 100)
+    runner._JobRunner__heartbeat()
+    assert runner.is_leader()
+    assert coord.pttl(LEADER_KEY) > 100
+
+
+def test_runner_follows_while_another_runner_leads(rh, runner):
+    coord = rh.get_coordination_client()
+    coord.set(LEADER_KEY, 'other', px=10000)
+    runner._JobRunner__heartbeat()
+    assert not runner.is_leader()
+
+    # the runner takes over after the leadership of the other runner expired
+    coord.delete(LEADER_KEY)
+    runner._JobRunner__heartbeat()
+    assert runner.is_leader()
+
+
+def test_runner_steps_down_if_it_lost_its_leadership(rh, runner):
+    runner._JobRunner__heartbeat()
+    assert runner.is_leader()
+    rh.get_coordination_client().set(LEADER_KEY, 'other')
+    runner._JobRunner__heartbeat()
+    assert not runner.is_leader()
+    assert rh.get_coordination_client().get(LEADER_KEY) == b'other'
+
+
+@pytest.mark.parametrize('study_type', [t.value for t in StudyType])
+def test_progress_rollup_is_served_for_every_study_type(rh, study_type):
+    coordinator = get_coordinator(study_type)
+    snapshot = coordinator.rollup_progress()
+    assert coordinator.progress_history(num=10) == [snapshot]
+
+
+def test_unknown_study_type_is_not_found():
+    with pytest.raises(HTTPException) as e:
+        get_coordinator('unknown')
+    assert e.value.status_code == 404
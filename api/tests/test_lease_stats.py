@@ -0,0 +1,24 @@
+from backend.study import lua_scripts
+from backend.study.study_coordinator_base import lease_duration_percentile, lease_duration_percentiles
+
+# 10 lease durations in bucket 10 and 90 in bucket 20 of the histogram
+BUCKETS = [(10, 10), (20, 90)]
+COUNT = 100
+
+
+def test_float_percentile_is_deduplicated():
+    percentiles = lease_duration_percentiles(BUCKETS, COUNT, [50, 90, 95, 99, 95.0])
+    assert list(percentiles.keys()) == ['50', '90', '95', '99']
+
+
+def test_float_percentile_key_matches_configured_percentile():
+    for configured in [95, 95.0, 97.5]:
+        percentiles = lease_duration_percentiles(BUCKETS, COUNT, [50, 90, 95, 99, configured])
+        assert percentiles[f"{float(configured):g}"] == lease_duration_percentile(BUCKETS, COUNT, configured)
+    assert '97.5' in lease_duration_percentiles(BUCKETS, COUNT, [97.5])
+
+
+def test_percentile_is_upper_bound_of_bucket():
+    assert lease_duration_percentile(BUCKETS, COUNT, 10.0) == round(lua_scripts.HISTOGRAM_BASE ** 11, 2)
+    assert lease_duration_percentile(BUCKETS, COUNT, 95.0) == round(lua_scripts.HISTOGRAM_BASE ** 21, 2)
+    assert lease_duration_percentile([], 0, 95.0) is None
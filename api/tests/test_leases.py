@@ -0,0 +1,72 @@
+import time
+
+from backend.study.study_coordinator_base import Keys
+from models import LikertResult, LikertSample, StudyType
+
+
+def _result(sample: LikertSample) -> LikertResult:
+    return LikertResult(sample_id=sample.id, chosen_answer=sample.answers[0])
+
+
+def _expire(rh, sample: LikertSample):
+    # the leases are scored by their expiry timestamp (on the clock of Redis)
+    rh.get_progress_client(StudyType.LIKERT).zadd(Keys.IN_PROGRESS, {sample.id: 1})
+
+
+def test_lease_and_complete(likert):
+    assert likert.current_progress() == {'num_todo': 5, 'num_in_progress': 0, 'num_done': 0, 'num_total': 5, 'run': 1}
+    sample = likert.next()
+    assert isinstance(sample, LikertSample)
+    assert likert.current_progress()['num_in_progress'] == 1
+
+    result = _result(sample)
+    assert likert.submit(result) == result.id
+    assert likert.current_progress() == {'num_todo': 4, 'num_in_progress': 0, 'num_done': 1, 'num_total': 5, 'run': 1}
+    # a sample can only be completed once
+    assert likert.submit(_result(sample)) is None
+
+
+def test_expired_lease_is_reaped_and_rejected(rh, likert):
+    sample = likert.next()
+    other = likert.next()
+    # the reaper only moves expired leases back to TODO
+    assert likert.reap() == []
+    _expire(rh, sample)
+    assert likert.reap() == [sample.id.encode('utf-8')]
+    assert likert.current_progress()['num_todo'] == 4
+    assert likert.current_progress()['num_in_progress'] == 1
+
+    # the expired lease cannot be completed anymore, but the other one can
+    assert likert.submit(_result(sample)) is None
+    assert likert.submit(_result(other)) is not None
+    assert likert.lease_stats()['expired'] == 1
+
+
+def test_empty_todo_returns_shortest_ttl_and_last_result_starts_new_run(likert):
+    samples = [likert.next() for _ in range(5)]
+    ttl = likert.next()
+    assert isinstance(ttl, int) and 0 < ttl <= likert.in_prog_ttl
+
+    for sample in samples:
+        assert likert.submit(_result(sample)) is not None
+    assert likert.current_progress() == {'num_todo': 5, 'num_in_progress': 0, 'num_done': 0, 'num_total': 5, 'run': 2}
+
+
+def test_batch_of_leases(likert, run):
+    leases = likert.next_batch(3)
+    assert len({lease.sample.id for lease in leases}) == 3
+    assert all(lease.ttl == likert.in_prog_ttl for lease in leases)
+    assert abs(leases[0].expires_at - time.time() - likert.in_prog_ttl) < 5
+    assert likert.current_progress()['num_in_progress'] == 3
+
+    # only the remaining samples are leased and an empty TODO returns the shortest TTL
+    assert len(run(likert.next_batch_async(3))) == 2
+    assert isinstance(likert.next_batch(3), int)
+    for lease in leases:
+        assert likert.submit(_result(lease.sample)) is not None
+
+
+def test_batch_size_is_capped(monkeypatch, likert):
+    monkeypatch.setattr(likert, '_StudyCoordinatorBase__max_lease_batch_size', 2)
+    assert len(likert.next_batch(50)) == 2
+    assert len(likert.next_batch(0)) == 1
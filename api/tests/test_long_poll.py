@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from backend.study.study_coordinator_base import Keys
+from models import LikertSample, StudyType
+
+
+def _lease_all(likert):
+    return [likert.next() for _ in range(5)]
+
+
+def _expire(rh, sample: LikertSample):
+    rh.get_progress_client(StudyType.LIKERT).zadd(Keys.IN_PROGRESS, {sample.id: 1})
+
+
+def test_waiting_client_gets_the_reaped_sample(rh, likert, run):
+    samples = _lease_all(likert)
+
+    async def wait_and_reap():
+        waiter = asyncio.ensure_future(likert.next_async(wait=5))
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+        _expire(rh, samples[2])
+        likert.reap()
+        return await asyncio.wait_for(waiter, timeout=5)
+
+    sample = run(wait_and_reap())
+    assert isinstance(sample, LikertSample) and sample.id == samples[2].id
+    # the sample was handed off directly, i.e., it is leased again instead of being in TODO
+    assert likert.current_progress()['num_todo'] == 0
+    assert likert.current_progress()['num_in_progress'] == 5
+
+
+def test_waiting_client_times_out_with_the_shortest_ttl(likert, run):
+    _lease_all(likert)
+    start = time.monotonic()
+    ttl = run(likert.next_async(wait=0.3))
+    assert isinstance(ttl, int) and 0 < ttl <= likert.in_prog_ttl
+    assert 0.2 < time.monotonic() - start < 3
+
+
+def test_stale_tickets_are_skipped(rh, likert):
+    samples = _lease_all(likert)
+    progress = rh.get_progress_client(StudyType.LIKERT)
+    now = progress.time()[0]
+    # the ticket of a client that already timed out and the one of a client that still waits
+    progress.rpush(Keys.WAITERS, f'{now - 1}:stale', f'{now + 60}:waiting')
+    for sample in samples[:2]:
+        _expire(rh, sample)
+    likert.reap()
+
+    assert progress.lrange(Keys.WAITERS.value + b':stale', 0, -1) == []
+    assert progress.lrange(Keys.WAITERS.value + b':waiting', 0, -1) in [[samples[0].id.encode('utf-8')],
+                                                                         [samples[1].id.encode('utf-8')]]
+    # the other sample is moved back to TODO
+    assert likert.current_progress()['num_todo'] == 1
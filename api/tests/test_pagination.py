@@ -0,0 +1,43 @@
+import base64
+import json
+
+import pytest
+
+from routers.ndjson import ndjson_response
+
+
+def _page_all(rh, limit: int):
+    pages, cursor = [], None
+    while True:
+        items, cursor = rh.page_model_rankings(cursor=cursor, limit=limit)
+        pages.append(items)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize('limit', [1, 4, 100])
+def test_pages_cover_all_items(monkeypatch, rh, model_rankings, limit):
+    monkeypatch.setattr(rh, '_RedisHandler__scan_batch_size', 5)
+    mr_ids = model_rankings(23)
+    pages = _page_all(rh, limit)
+    assert all(len(page) <= limit for page in pages)
+    assert sorted(mr.id for page in pages for mr in page) == sorted(mr_ids)
+
+
+@pytest.mark.parametrize('cursor', ['not a cursor!', base64.urlsafe_b64encode(b'no separator').decode('utf-8'),
+                                    base64.urlsafe_b64encode(b'abc:key').decode('utf-8')])
+def test_tampered_cursor_is_rejected(rh, model_rankings, cursor):
+    model_rankings(3)
+    with pytest.raises(ValueError):
+        rh.page_model_rankings(cursor=cursor, limit=10)
+
+
+def test_ndjson_streams_one_model_per_line(rh, model_rankings, run):
+    mr_ids = model_rankings(7)
+    response = ndjson_response(rh.iter_model_rankings(), chunk_size=3)
+
+    async def body() -> bytes:
+        return b''.join([chunk async for chunk in response.body_iterator])
+
+    lines = run(body()).decode('utf-8').splitlines()
+    assert sorted(json.loads(line)['id'] for line in lines) == sorted(mr_ids)
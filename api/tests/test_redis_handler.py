@@ -0,0 +1,37 @@
+from models import RankingSample, LikertSample, RatingSample
+
+FIELDS = {RankingSample: {'query': 'query'}, LikertSample: {'caption': 'caption', 'question': 'question'},
+          RatingSample: {'caption': 'caption'}}
+
+
+def _samples(cls, num: int):
+    return [cls(mr_id=f'mr{i}', image_ids=[f'img{i}', f'img{i + 1}'], **FIELDS[cls]) for i in range(num)]
+
+
+def test_list_model_rankings_loads_all_batches(monkeypatch, rh, model_rankings):
+    # the SCAN batches are smaller than the number of ModelRankings
+    monkeypatch.setattr(rh, '_RedisHandler__scan_batch_size', 3)
+    mr_ids = model_rankings(10)
+    assert sorted(mr.id for mr in rh.list_model_rankings()) == sorted(mr_ids)
+    assert sorted(rh.iter_model_ranking_ids()) == sorted(mr_ids)
+    assert rh.num_model_rankings() == 10
+
+
+def test_list_samples_loads_all_batches(monkeypatch, rh, no_validation):
+    monkeypatch.setattr(rh, '_RedisHandler__scan_batch_size', 3)
+    for cls, list_samples in [(RankingSample, rh.list_ranking_samples), (LikertSample, rh.list_likert_samples),
+                              (RatingSample, rh.list_rating_samples)]:
+        samples = _samples(cls, 7)
+        rh.store_samples(samples)
+        assert sorted(s.id for s in list_samples()) == sorted(s.id for s in samples)
+
+
+def test_list_is_capped_by_num(monkeypatch, rh, model_rankings, no_validation):
+    monkeypatch.setattr(rh, '_RedisHandler__scan_batch_size', 3)
+    model_rankings(10)
+    rh.store_samples(_samples(RankingSample, 10))
+    assert len(rh.list_model_rankings(4)) == 4
+    assert len(rh.list_ranking_samples(7)) == 7
+    # a non-positive num lists nothing instead of failing
+    assert rh.list_model_rankings(0) == []
+    assert rh.list_ranking_samples(-1) == []
@@ -0,0 +1,60 @@
+import pytest
+
+from backend.study.study_coordinator_base import Keys
+from models import LikertResult, StudyType
+
+
+@pytest.fixture
+def gc(monkeypatch, rh, likert):
+    # the state of the garbage collection is reset since the coordinator is a singleton. Every SCAN batch has 2 samples
+    monkeypatch.setattr(rh, '_RedisHandler__scan_batch_size', 2)
+    monkeypatch.setattr(likert, '_StudyCoordinatorBase__gc_min_pass_interval', 0)
+    monkeypatch.setattr(likert, '_StudyCoordinatorBase__gc_batches', None)
+    monkeypatch.setattr(likert, '_StudyCoordinatorBase__gc_backfill', None)
+    monkeypatch.setattr(likert, '_StudyCoordinatorBase__gc_last_pass', 0.)
+
+    def run_pass():
+        # (backfills and) runs a whole garbage collection pass, one batch per call
+        for _ in range(100):
+            likert.collect_garbage()
+            if likert._StudyCoordinatorBase__gc_batches is not None:
+                break
+        while likert._StudyCoordinatorBase__gc_batches is not None:
+            likert.collect_garbage()
+
+    return run_pass
+
+
+def _todo(rh):
+    return [str(sid, encoding='utf-8') for sid in rh.get_progress_client(StudyType.LIKERT).smembers(Keys.TODO)]
+
+
+def test_unreferenced_samples_are_deleted_by_the_second_pass(rh, likert, gc):
+    # the samples of the first run are only referenced by a result, MTurk or nothing after the next run started
+    first_run = _todo(rh)
+    sample = likert.next()
+    assert likert.submit(LikertResult(sample_id=sample.id, chosen_answer=sample.answers[0])) is not None
+    in_mturk = rh.load_sample(next(sid for sid in first_run if sid != sample.id))
+    rh.store_hit_info({'HITId': 'hit'}, in_mturk)
+    likert._StudyCoordinatorBase__start_new_run()
+    second_run = _todo(rh)
+    orphans = [sid for sid in first_run if sid not in [sample.id, in_mturk.id]]
+    assert len(orphans) == 3
+
+    # the first pass only finds the candidates
+    gc()
+    assert all(rh.likert_sample_exists(sid) for sid in first_run + second_run)
+    gc()
+    assert not any(rh.likert_sample_exists(sid) for sid in orphans)
+    assert all(rh.likert_sample_exists(sid) for sid in [sample.id, in_mturk.id] + second_run)
+    assert rh.load_sample(sample.id) is not None
+
+
+def test_samples_referenced_in_between_are_kept(rh, likert, gc):
+    first_run = _todo(rh)
+    likert._StudyCoordinatorBase__start_new_run()
+    gc()
+    # the candidates of the first pass are referenced again before the second pass (e.g., reused by a new run)
+    rh.get_progress_client(StudyType.LIKERT).sadd(Keys.TODO, *first_run)
+    gc()
+    assert all(rh.likert_sample_exists(sid) for sid in first_run)
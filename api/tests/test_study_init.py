@@ -0,0 +1,42 @@
+from backend.study.study_coordinator_base import Keys
+from models import LikertSample, StudyType
+
+
+def _todo(rh):
+    return {str(sid, encoding='utf-8') for sid in rh.get_progress_client(StudyType.LIKERT).smembers(Keys.TODO)}
+
+
+def _new_run(monkeypatch, coordinator, batch_size: int, num_samples=None, reuse: bool = False):
+    monkeypatch.setattr(coordinator, '_StudyCoordinatorBase__sample_batch_size', batch_size)
+    monkeypatch.setattr(coordinator, '_StudyCoordinatorBase__reuse_samples', reuse)
+    monkeypatch.setattr(coordinator, 'num_samples', num_samples)
+    coordinator._StudyCoordinatorBase__start_new_run()
+
+
+def test_init_study_generates_a_sample_per_model_ranking(rh, likert):
+    todo = _todo(rh)
+    assert len(todo) == 5
+    samples = [rh.load_sample(sid) for sid in todo]
+    assert all(isinstance(s, LikertSample) for s in samples)
+    assert sorted(s.mr_id for s in samples) == sorted(mr.id for mr in rh.list_model_rankings())
+    # the initialization runs only once
+    likert.init_study()
+    assert _todo(rh) == todo
+
+
+def test_new_run_generates_the_samples_in_batches(monkeypatch, rh, likert):
+    previous = _todo(rh)
+    _new_run(monkeypatch, likert, batch_size=2)
+    todo = _todo(rh)
+    assert len(todo) == 5 and todo.isdisjoint(previous)
+    assert likert.current_progress()['run'] == 2
+
+    # the number of samples is capped by num_samples
+    _new_run(monkeypatch, likert, batch_size=2, num_samples=3)
+    assert len(_todo(rh)) == 3
+
+
+def test_new_run_reuses_the_samples_of_the_previous_run(monkeypatch, rh, likert):
+    previous = _todo(rh)
+    _new_run(monkeypatch, likert, batch_size=2, reuse=True)
+    assert _todo(rh) == previous
@@ -0,0 +1,61 @@
+import pytest
+from pydantic import ValidationError
+
+from models import LikertResult, LikertSample
+from models.validation_context import validation_context, known_model_rankings
+
+
+@pytest.fixture
+def loads(monkeypatch, rh):
+    # records the IDs of the samples that are loaded from the RedisHandler
+    loaded = []
+    load_sample = rh.load_sample
+
+    def counting_load_sample(sample_id: str):
+        loaded.append(sample_id)
+        return load_sample(sample_id)
+
+    monkeypatch.setattr(rh, 'load_sample', counting_load_sample)
+    return loaded
+
+
+def _result(sample: LikertSample) -> LikertResult:
+    return LikertResult(sample_id=sample.id, chosen_answer=sample.answers[0])
+
+
+def test_referenced_sample_is_loaded_once_per_context(rh, likert, loads):
+    sample = likert.next()
+    # leasing the sample loads it as well
+    loads.clear()
+    with validation_context():
+        result = _result(sample)
+        assert likert.submit(result) == result.id
+    assert loads == [sample.id]
+
+    # every context loads the sample again
+    with validation_context():
+        _result(sample)
+    assert loads == [sample.id, sample.id]
+
+
+def test_referenced_sample_is_loaded_by_every_validator_without_context(rh, likert, loads):
+    sample = likert.next()
+    loads.clear()
+    _result(sample)
+    assert loads == [sample.id, sample.id]
+
+
+def test_invalid_result_is_rejected_in_context(likert):
+    sample = likert.next()
+    with validation_context(), pytest.raises(ValidationError):
+        LikertResult(sample_id=sample.id, chosen_answer='not an answer')
+    with validation_context(), pytest.raises(ValidationError):
+        LikertResult(sample_id='unknown', chosen_answer=sample.answers[0])
+
+
+def test_known_model_rankings_are_not_checked(rh):
+    fields = {'caption': 'caption', 'question': 'question', 'image_ids': ['img']}
+    with pytest.raises(ValidationError):
+        LikertSample(mr_id='unknown', **fields)
+    with known_model_rankings(['unknown']):
+        assert LikertSample(mr_id='unknown', **fields).mr_id == 'unknown'
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from shortuuid import uuid
+
+from backend.study import RankingStudyCoordinator
+from backend.study.embedding_index import EmbeddingIndex
+from backend.study.study_coordinator_base import Keys, virtual_sample_id, parse_virtual_sample_id
+from models import StudyType
+
+NUM_IMAGES = 200
+
+
+def test_virtual_sample_ids():
+    assert parse_virtual_sample_id(virtual_sample_id('mr', 42)) == ('mr', 42)
+    assert parse_virtual_sample_id(virtual_sample_id('mr-with-dashes', 0)) == ('mr-with-dashes', 0)
+    # the generated sample IDs are not virtual
+    assert all(parse_virtual_sample_id(uuid()) is None for _ in range(100))
+    assert parse_virtual_sample_id('mr-') is None
+    assert parse_virtual_sample_id('-1') is None
+
+
+def test_virtual_samples_are_materialized_when_leased(monkeypatch, rh, likert, run):
+    monkeypatch.setattr(likert, '_StudyCoordinatorBase__virtual_samples', True)
+    likert._StudyCoordinatorBase__start_new_run()
+    todo = [str(sid, encoding='utf-8') for sid in rh.get_progress_client(StudyType.LIKERT).smembers(Keys.TODO)]
+    assert len(todo) == 5 and all(parse_virtual_sample_id(sid) is not None for sid in todo)
+    assert not any(rh.likert_sample_exists(sid) for sid in todo)
+
+    sample = likert.next()
+    assert sample.id in todo and sample.mr_id == parse_virtual_sample_id(sample.id)[0]
+    assert rh.load_sample(sample.id) == sample
+    leases = likert.next_batch(2) + run(likert.next_batch_async(2))
+    assert len({lease.sample.id for lease in leases} | {sample.id}) == 5
+    assert all(rh.likert_sample_exists(lease.sample.id) for lease in leases)
+
+
+@pytest.fixture
+def ranking(rh, model_rankings, no_validation):
+    model_rankings(3, num_images=NUM_IMAGES)
+    return RankingStudyCoordinator()
+
+
+def test_virtual_ranking_samples_are_reproducible(rh, ranking):
+    mr_id = rh.list_all_model_ranking_ids()[0].decode('utf-8')
+    first = ranking._StudyCoordinatorBase__materialize(virtual_sample_id(mr_id, 7))
+    rh.delete_samples(StudyType.RANKING, [first.id])
+    again = ranking._StudyCoordinatorBase__materialize(virtual_sample_id(mr_id, 7))
+    other = ranking._StudyCoordinatorBase__materialize(virtual_sample_id(mr_id, 8))
+    assert again.image_ids == first.image_ids
+    assert other.image_ids != first.image_ids
+    assert ranking._StudyCoordinatorBase__materialize(virtual_sample_id('unknown', 7)) is None
+
+
+def test_hard_negatives_are_scanned_once_per_model_ranking(monkeypatch, tmp_path, rh, ranking):
+    rng = np.random.default_rng(0)
+    np.save(tmp_path / 'emb.npy', rng.standard_normal((NUM_IMAGES, 8)).astype(np.float32))
+    np.save(tmp_path / 'emb.ids.npy', np.array([f'img{i}' for i in range(NUM_IMAGES)]))
+    index = EmbeddingIndex(str(tmp_path / 'emb.npy'), chunk_size=100)
+    scans = []
+    candidates = index.candidates
+    monkeypatch.setattr(index, 'candidates', lambda *args, **kwargs: scans.append(1) or candidates(*args, **kwargs))
+    monkeypatch.setattr(ranking, '_RankingStudyCoordinator__embeddings', index)
+    monkeypatch.setattr(ranking, '_RankingStudyCoordinator__embeddings_pool_size', None)
+    monkeypatch.setattr(ranking, '_RankingStudyCoordinator__hn_similarity_band', (-1.0, 1.0))
+    monkeypatch.setattr(ranking, 'num_hard_negatives', 3)
+
+    mrs = rh.list_model_rankings()
+    samples = ranking._generate_samples(mrs, rng=np.random.default_rng(1))
+    assert len(scans) == 1
+    again = ranking._generate_samples(mrs, rng=np.random.default_rng(1))
+    assert len(scans) == 1
+    assert [s.image_ids for s in again] == [s.image_ids for s in samples]
+    for mr, sample in zip(mrs, samples):
+        assert set(mr.top_k_image_ids[:ranking.num_top_k_imgs]) <= set(sample.image_ids)
+        assert len(set(sample.image_ids)) == len(sample.image_ids)